@@ -1,120 +1,268 @@
 import json
-import cv2
-import numpy as np
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FuturesTimeoutError
 import requests
+from requests.adapters import HTTPAdapter
+
+# The detection engine lives in scripts/ (bundled via includeFiles in vercel.json)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scripts'))
+from chop_cache import DetectionCache, detect_with_cache
+from chop_engine import REDUCED_DECODE_FLAGS
+from chop_fetch import BlobStore, fetch
+from chop_timing import NULL_TIMER, StageTimer, summarize
+
+# Batch limits. Vercel stops the function at maxDuration (60 s in vercel.json),
+# so stop waiting a few seconds early and return whatever has finished.
+MAX_CONCURRENCY = int(os.environ.get('CROP_DETECT_CONCURRENCY', '8'))
+BATCH_DEADLINE_SECONDS = float(os.environ.get('CROP_DETECT_DEADLINE', '50'))
+FETCH_TIMEOUT_SECONDS = 10
+
+# Detection result cache, kept in /tmp so it survives between requests on a
+# warm instance. Set CHOP_CACHE_PATH to an empty string to disable it.
+CACHE_PATH = os.environ.get('CHOP_CACHE_PATH', '/tmp/chop-detect-cache.sqlite')
+_cache = None
+
+
+# Optional store of downloaded originals, revalidated with If-None-Match.
+# Off by default: /tmp is small and originals are several MB each.
+BLOB_STORE = BlobStore(os.environ['CHOP_BLOB_STORE']) if os.environ.get('CHOP_BLOB_STORE') else None
+
+
+def get_cache():
+    """Shared DetectionCache, opened on first use (None if disabled or unavailable)"""
+    global _cache
+    if _cache is None and CACHE_PATH:
+        try:
+            _cache = DetectionCache(CACHE_PATH)
+        except Exception as e:
+            print(f'Detection cache disabled: {e}', file=sys.stderr)
+            return None
+    return _cache
+
+
+def make_session(pool_size):
+    """Create a requests session whose connection pool matches the worker count"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def process_url(session, url, deadline, scale=1, refine=False, debug=False, geometry=False):
+    """
+    Download, decode and detect a single image, never raising. With debug,
+    the result carries per-stage 'timings' in ms; with geometry, the chop's
+    'polygon' and 'rotated_rect'.
+    """
+    timer = StageTimer() if debug else None
+    result = _process_url(session, url, deadline, scale, refine, timer, geometry)
+    if timer is not None:
+        result['timings'] = timer.as_dict()
+    return result
+
+
+def _process_url(session, url, deadline, scale, refine, timer, geometry=False):
+    try:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return {'image_url': url, 'status': 'timeout', 'error': 'Batch deadline reached before download'}
+
+        # Download image (bounded by both the per-image timeout and the batch deadline)
+        with (timer or NULL_TIMER).span('download'):
+            fetched = fetch(url, BLOB_STORE, session, timeout=min(FETCH_TIMEOUT_SECONDS, remaining))
+        result = detect_with_cache(get_cache(), fetched.data, scale, refine, etag=fetched.etag, timer=timer,
+                                   geometry=geometry)
+
+        return {'image_url': url, **result}
+
+    except Exception as e:
+        return {'image_url': url, 'status': 'error', 'error': str(e)}
+
+
+def iter_results(image_urls, concurrency=MAX_CONCURRENCY, deadline_seconds=BATCH_DEADLINE_SECONDS,
+                 scale=1, refine=False, debug=False, geometry=False):
+    """
+    Fetch and detect a batch of images concurrently, yielding (index, result)
+    pairs in completion order.
+
+    Each worker thread downloads, decodes and segments one image, so network
+    waits overlap with OpenCV work in other threads (OpenCV releases the GIL).
+    Anything still running when the deadline passes is yielded last with
+    status 'timeout'.
+
+    scale > 1 detects on a 1/scale JPEG decode (see chop_engine.detect_reduced);
+    the default of 1 is the full-resolution reference path.
+    """
+    if not image_urls:
+        return
+
+    concurrency = max(1, min(concurrency, len(image_urls)))
+    deadline = time.monotonic() + deadline_seconds
+    session = make_session(concurrency)
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+
+    futures = {
+        executor.submit(process_url, session, url, deadline, scale, refine, debug, geometry): index
+        for index, url in enumerate(image_urls)
+    }
+    reported = set()
+    try:
+        for future in as_completed(futures, timeout=max(0.0, deadline - time.monotonic())):
+            reported.add(future)
+            yield futures[future], future.result()
+    except FuturesTimeoutError:
+        pass
+    finally:
+        # Don't block the response on downloads that overran the deadline
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    for future, index in futures.items():
+        if future in reported:
+            continue
+        if future.done() and not future.cancelled():
+            yield index, future.result()
+        else:
+            yield index, {'image_url': image_urls[index], 'status': 'timeout', 'error': 'Batch deadline reached'}
+
+
+def process_urls(image_urls, concurrency=MAX_CONCURRENCY, deadline_seconds=BATCH_DEADLINE_SECONDS,
+                 scale=1, refine=False, debug=False, geometry=False):
+    """Detect a batch of images (see iter_results) and return results in the order of image_urls"""
+    results = [None] * len(image_urls)
+    for index, result in iter_results(image_urls, concurrency, deadline_seconds, scale, refine, debug,
+                                      geometry):
+        results[index] = result
+    return results
+
+
+def stream_results(image_urls, concurrency=MAX_CONCURRENCY, deadline_seconds=BATCH_DEADLINE_SECONDS,
+                   scale=1, refine=False, debug=False, geometry=False):
+    """
+    NDJSON lines for a batch: one per URL as it completes, carrying its
+    position in 'index' and the time since the batch started in
+    'elapsed_ms', then a final {'summary': ...} line with counts and timings.
+    With debug, the summary also has per-stage p50/p95/p99 under 'timings'.
+    """
+    start = time.monotonic()
+    counts = {'ok': 0, 'rejected': 0, 'error': 0, 'timeout': 0}
+    cache_hits = 0
+    first_result_ms = None
+    timings = []
+
+    for index, result in iter_results(image_urls, concurrency, deadline_seconds, scale, refine, debug,
+                                      geometry):
+        elapsed_ms = round((time.monotonic() - start) * 1000, 1)
+        if first_result_ms is None:
+            first_result_ms = elapsed_ms
+        counts[result['status']] += 1
+        if result.get('cached'):
+            cache_hits += 1
+        if 'timings' in result:
+            timings.append(result['timings'])
+        yield json.dumps({'index': index, **result, 'elapsed_ms': elapsed_ms}) + '\n'
+
+    summary = {
+        'total': len(image_urls),
+        **counts,
+        'cache_hits': cache_hits,
+        'first_result_ms': first_result_ms,
+        'elapsed_ms': round((time.monotonic() - start) * 1000, 1)
+    }
+    if debug:
+        summary['timings'] = summarize(timings)
+    yield json.dumps({'summary': summary}) + '\n'
+
+
+def parse_options(data):
+    """
+    Batch options from a request body: concurrency, deadline_seconds, scale,
+    refine, debug and geometry keyword arguments for process_urls/stream_results.
+
+    Raises:
+        ValueError for an unsupported scale
+    """
+    # Callers may tighten (never loosen) the batch limits
+    concurrency = min(int(data.get('concurrency', MAX_CONCURRENCY)), MAX_CONCURRENCY)
+    deadline_seconds = min(float(data.get('deadline', BATCH_DEADLINE_SECONDS)), BATCH_DEADLINE_SECONDS)
+
+    # Optional reduced-resolution detection: scale is 1 (reference), 2, 4 or 8
+    scale = int(data.get('scale', 1))
+    if scale not in REDUCED_DECODE_FLAGS:
+        raise ValueError(f'Unsupported scale: {scale}')
+
+    return {
+        'concurrency': concurrency,
+        'deadline_seconds': deadline_seconds,
+        'scale': scale,
+        'refine': bool(data.get('refine', False)),
+        # Per-stage timings: per result, plus batch p50/p95/p99
+        'debug': bool(data.get('debug', False)),
+        # Outline polygon and rotated rect alongside the box (see chop_engine.encode_polygon)
+        'geometry': bool(data.get('geometry', False)),
+    }
+
 
 def handler(event, context):
     """AWS Lambda-style handler for Vercel"""
     # Get HTTP method
     http_method = event.get('httpMethod') or event.get('requestContext', {}).get('http', {}).get('method') or 'GET'
-    
+
     if http_method != 'POST':
         return {
             'statusCode': 405,
             'headers': {'Content-Type': 'application/json'},
             'body': json.dumps({'error': 'Method not allowed'})
         }
-    
+
     try:
         # Parse request body
         body_str = event.get('body', '{}')
         if isinstance(body_str, bytes):
             body_str = body_str.decode('utf-8')
         data = json.loads(body_str)
-        
+
         image_urls = data.get('urls', [])
-        results = []
-        
-        for url in image_urls:
-            try:
-                # Download image
-                response = requests.get(url, timeout=10)
-                image_array = np.asarray(bytearray(response.content), dtype=np.uint8)
-                image = cv2.imdecode(image_array, cv2.IMREAD_COLOR)
-                
-                if image is None:
-                    results.append({'image_url': url, 'error': 'Failed to decode image'})
-                    continue
-                
-                # Get image dimensions
-                height, width = image.shape[:2]
-                
-                # Convert to HSV for better color segmentation
-                hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-                
-                # Define range for pink/red meat color
-                lower_red1 = np.array([0, 30, 50])
-                upper_red1 = np.array([20, 255, 255])
-                lower_red2 = np.array([160, 30, 50])
-                upper_red2 = np.array([180, 255, 255])
-                
-                # Create masks
-                mask1 = cv2.inRange(hsv, lower_red1, upper_red1)
-                mask2 = cv2.inRange(hsv, lower_red2, upper_red2)
-                mask = cv2.bitwise_or(mask1, mask2)
-                
-                # Morphological operations to remove noise
-                kernel = np.ones((5, 5), np.uint8)
-                mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel, iterations=2)
-                mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel, iterations=2)
-                
-                # Find contours
-                contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-                
-                if not contours:
-                    results.append({'image_url': url, 'error': 'No contours found'})
-                    continue
-                
-                # Find largest contour (assumed to be the chop)
-                largest_contour = max(contours, key=cv2.contourArea)
-                area = cv2.contourArea(largest_contour)
-                
-                # Validate area (should be between 5% and 80% of image)
-                image_area = width * height
-                area_ratio = area / image_area
-                
-                if area_ratio < 0.05 or area_ratio > 0.8:
-                    results.append({'image_url': url, 'error': f'Invalid area ratio: {area_ratio:.2f}'})
-                    continue
-                
-                # Get bounding box
-                x, y, w, h = cv2.boundingRect(largest_contour)
-                
-                # Add 5% margin
-                margin_x = int(w * 0.05)
-                margin_y = int(h * 0.05)
-                
-                x1 = max(0, x - margin_x)
-                y1 = max(0, y - margin_y)
-                x2 = min(width, x + w + margin_x)
-                y2 = min(height, y + h + margin_y)
-                
-                # Calculate confidence score
-                aspect_ratio = w / h if h > 0 else 0
-                area_confidence = 1.0 - abs(0.4 - area_ratio) / 0.4  # Optimal around 40%
-                aspect_confidence = 1.0 - abs(1.2 - aspect_ratio) / 1.2  # Optimal around 1.2
-                confidence = (area_confidence + aspect_confidence) / 2
-                confidence = max(0, min(1, confidence))
-                
-                results.append({
-                    'image_url': url,
-                    'x1': int(x1),
-                    'y1': int(y1),
-                    'x2': int(x2),
-                    'y2': int(y2),
-                    'confidence': round(confidence, 2),
-                    'area_ratio': round(area_ratio, 3)
-                })
-                
-            except Exception as e:
-                results.append({'image_url': url, 'error': str(e)})
-        
+
+        try:
+            options = parse_options(data)
+        except ValueError as e:
+            return {
+                'statusCode': 400,
+                'headers': {'Content-Type': 'application/json'},
+                'body': json.dumps({'error': str(e)})
+            }
+
+        # NDJSON streaming needs a server that can flush lines as images finish.
+        # This handler returns one buffered body, so only scripts/chop_worker.py
+        # (which calls stream_results directly) accepts it.
+        if data.get('stream'):
+            return {
+                'statusCode': 400,
+                'headers': {'Content-Type': 'application/json'},
+                'body': json.dumps({'error': 'stream is only supported by the chop worker (scripts/chop_worker.py)'})
+            }
+
+        results = process_urls(image_urls, **options)
+        cache_hits = sum(1 for result in results if result.get('cached'))
+
+        # Debug responses wrap the array so the batch aggregate fits alongside it
+        body = results
+        if options['debug']:
+            body = {'results': results, 'timings': summarize(r['timings'] for r in results if 'timings' in r)}
+
         return {
             'statusCode': 200,
-            'headers': {'Content-Type': 'application/json'},
-            'body': json.dumps(results)
+            'headers': {
+                'Content-Type': 'application/json',
+                'X-Detection-Cache': f'hits={cache_hits}; misses={len(results) - cache_hits}'
+            },
+            'body': json.dumps(body)
         }
-        
+
     except Exception as e:
         return {
             'statusCode': 500,
@@ -10,6 +10,7 @@ type ImageData = {
   crop_x2: number
   crop_y2: number
   crop_confidence: number
+  crop_polygon: string | null
 }
 
 export async function GET(request: Request) {
@@ -26,7 +27,7 @@ export async function GET(request: Request) {
     // Get image data from database
     const { data: image, error } = await supabase
       .from('sample_images')
-      .select('image_url, processed_image_url, crop_x1, crop_y1, crop_x2, crop_y2, crop_confidence')
+      .select('image_url, processed_image_url, crop_x1, crop_y1, crop_x2, crop_y2, crop_confidence, crop_polygon')
       .eq('id', id)
       .single<ImageData>()
 
@@ -44,13 +45,15 @@ export async function GET(request: Request) {
       return NextResponse.json({ error: 'Image not processed yet' }, { status: 400 })
     }
 
-    // Process the image with background removal (fallback)
+    // Process the image with background removal (fallback); a stored
+    // outline is used as the mask instead of segmenting again
     const processedBuffer = await processChopImage(image.image_url, {
       x1: image.crop_x1,
       y1: image.crop_y1,
       x2: image.crop_x2,
       y2: image.crop_y2,
-      confidence: image.crop_confidence
+      confidence: image.crop_confidence,
+      polygon: image.crop_polygon
     })
 
     // Return the processed image
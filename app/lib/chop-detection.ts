@@ -6,8 +6,14 @@ interface CropCoordinates {
   x2: number;
   y2: number;
   confidence: number;
+  // Chop outline from the Python detector (sample_images.crop_polygon)
+  polygon?: string | null;
 }
 
+// Width of the stroke drawn around a stored outline, matching the 25px
+// expansion of the segmentation path so the chop edge is not clipped
+const POLYGON_STROKE = 25;
+
 /**
  * Detect chop boundaries using GrabCut-inspired approach
  * Uses initial color-based mask then refines with morphological operations
@@ -177,14 +183,77 @@ export async function detectChopBoundaries(imageUrl: string): Promise<CropCoordi
   }
 }
 
+/**
+ * Decode a crop_polygon value (see encode_polygon in scripts/chop_engine.py):
+ * base64url int16 little-endian [x0, y0, dx1, dy1, ...] in quarter pixels
+ */
+export function decodePolygon(encoded: string): Array<[number, number]> {
+  const raw = Buffer.from(encoded, 'base64url');
+  const points: Array<[number, number]> = [];
+  let x = 0;
+  let y = 0;
+  for (let i = 0; i + 4 <= raw.length; i += 4) {
+    x += raw.readInt16LE(i);
+    y += raw.readInt16LE(i + 2);
+    points.push([x / 4, y / 4]);
+  }
+  return points;
+}
+
+/**
+ * Crop to the box and paint everything outside the stored chop outline white.
+ * Only the box is decoded to raw pixels and the mask is rasterized by sharp,
+ * so no per-pixel segmentation runs.
+ */
+async function cropWithPolygon(imageBuffer: Buffer, coords: CropCoordinates, polygon: string): Promise<Buffer> {
+  const width = coords.x2 - coords.x1;
+  const height = coords.y2 - coords.y1;
+  
+  // The Python detector works on EXIF-oriented pixels (OpenCV applies the
+  // orientation on decode), so orient before extracting its box
+  const region = await sharp(imageBuffer)
+    .rotate()
+    .extract({ left: coords.x1, top: coords.y1, width, height })
+    .removeAlpha()
+    .raw()
+    .toBuffer();
+  
+  // Vertices are pixel centers; SVG pixel i spans [i, i + 1]
+  const points = decodePolygon(polygon)
+    .map(([x, y]) => `${x - coords.x1 + 0.5},${y - coords.y1 + 0.5}`)
+    .join(' ');
+  const svg = `<svg xmlns="http://www.w3.org/2000/svg" width="${width}" height="${height}">` +
+    `<rect width="100%" height="100%" fill="black"/>` +
+    `<polygon points="${points}" fill="white" stroke="white" stroke-width="${POLYGON_STROKE}" stroke-linejoin="round"/>` +
+    `</svg>`;
+  const mask = await sharp(Buffer.from(svg)).extractChannel(0).raw().toBuffer();
+  
+  const cutout = await sharp(region, { raw: { width, height, channels: 3 } })
+    .joinChannel(mask, { raw: { width, height, channels: 1 } })
+    .raw()
+    .toBuffer();
+  
+  return sharp(cutout, { raw: { width, height, channels: 4 } })
+    .flatten({ background: '#ffffff' })
+    .jpeg({ quality: 95 })
+    .toBuffer();
+}
+
 /**
  * Process image: crop to chop region and remove background
  * Maintains original orientation
+ *
+ * When coords carry a stored outline (crop_polygon), it is used as the mask
+ * instead of segmenting the image again.
  */
 export async function processChopImage(imageUrl: string, coords: CropCoordinates): Promise<Buffer> {
   const response = await fetch(imageUrl);
   const imageBuffer = Buffer.from(await response.arrayBuffer());
   
+  if (coords.polygon) {
+    return cropWithPolygon(imageBuffer, coords, coords.polygon);
+  }
+  
   const image = sharp(imageBuffer);
   const metadata = await image.metadata();
   const width = metadata.width!;
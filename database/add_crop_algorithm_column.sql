@@ -0,0 +1,16 @@
+-- Add detection algorithm ID column to sample_images table
+-- Stored alongside crop_confidence so crops from an older detector version
+-- can be found and reprocessed (see ALGORITHM_ID in scripts/chop_engine.py)
+
+ALTER TABLE sample_images ADD COLUMN IF NOT EXISTS crop_algorithm TEXT;
+
+COMMENT ON COLUMN sample_images.crop_algorithm IS 'ID of the detection algorithm that produced crop_x1..crop_y2 and crop_confidence (e.g. hsv-contour-v1)';
+
+-- Verify column was added
+SELECT 
+    column_name, 
+    data_type,
+    is_nullable
+FROM information_schema.columns 
+WHERE table_name = 'sample_images' 
+  AND column_name = 'crop_algorithm';
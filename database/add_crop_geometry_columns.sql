@@ -0,0 +1,21 @@
+-- Add crop geometry columns to sample_images table
+-- Stores the chop outline from chop detection with geometry enabled
+-- (scripts/chop_detection.py --geometry, reconcile_crops.py --geometry), so
+-- /api/crop-image can mask the chop directly instead of segmenting the
+-- original a second time. Run this migration in Supabase SQL Editor
+
+ALTER TABLE sample_images
+ADD COLUMN IF NOT EXISTS crop_polygon TEXT,
+ADD COLUMN IF NOT EXISTS crop_rotated_rect JSONB;
+
+COMMENT ON COLUMN sample_images.crop_polygon IS 'Simplified chop outline: base64url int16 [x0, y0, dx1, dy1, ...] in quarter pixels (see scripts/chop_engine.py encode_polygon)';
+COMMENT ON COLUMN sample_images.crop_rotated_rect IS 'Minimum-area rotated rect of the chop as [center_x, center_y, width, height, angle_degrees]';
+
+-- Verify columns were added
+SELECT
+    column_name,
+    data_type,
+    is_nullable
+FROM information_schema.columns
+WHERE table_name = 'sample_images'
+  AND column_name IN ('crop_polygon', 'crop_rotated_rect');
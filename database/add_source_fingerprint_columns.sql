@@ -0,0 +1,20 @@
+-- Add source fingerprint columns to sample_images table
+-- Records which version of the R2 original the stored crop was computed from,
+-- so incremental runs (scripts/reconcile_crops.py) only re-detect new or
+-- replaced originals. Run this migration in Supabase SQL Editor
+
+ALTER TABLE sample_images
+ADD COLUMN IF NOT EXISTS source_etag TEXT,
+ADD COLUMN IF NOT EXISTS source_last_modified TIMESTAMP WITH TIME ZONE;
+
+COMMENT ON COLUMN sample_images.source_etag IS 'R2 ETag of the original image when crop detection last ran on it';
+COMMENT ON COLUMN sample_images.source_last_modified IS 'R2 LastModified of the original image when crop detection last ran on it';
+
+-- Verify columns were added
+SELECT
+    column_name,
+    data_type,
+    is_nullable
+FROM information_schema.columns
+WHERE table_name = 'sample_images'
+  AND column_name IN ('source_etag', 'source_last_modified');
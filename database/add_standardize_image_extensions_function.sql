@@ -0,0 +1,32 @@
+-- Set-based URL update for scripts/standardize_all_extensions.py
+-- Points every sample_images.image_url whose filename doesn't end in the
+-- standard extension at original/{study number}{standard extension} under
+-- the R2 public URL, in one UPDATE instead of one request per row.
+-- Run this migration in Supabase SQL Editor
+
+CREATE OR REPLACE FUNCTION standardize_image_url_extensions(public_url TEXT, standard_extension TEXT DEFAULT '.jpg')
+RETURNS INTEGER AS $$
+DECLARE
+  updated_count INTEGER;
+BEGIN
+  UPDATE sample_images
+  SET image_url = public_url || '/original/' ||
+      regexp_replace(regexp_replace(image_url, '^.*/', ''), '\.[^.]*$', '') || standard_extension
+  WHERE image_url IS NOT NULL
+    AND right(regexp_replace(image_url, '^.*/', ''), length(standard_extension)) <> standard_extension;
+
+  GET DIAGNOSTICS updated_count = ROW_COUNT;
+  RETURN updated_count;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+-- Only the service role (scripts) may rewrite URLs
+REVOKE ALL ON FUNCTION standardize_image_url_extensions(TEXT, TEXT) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION standardize_image_url_extensions(TEXT, TEXT) TO service_role;
+
+-- Verify the function exists
+SELECT
+    routine_name,
+    data_type
+FROM information_schema.routines
+WHERE routine_name = 'standardize_image_url_extensions';
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+Chop Detection Benchmark
+Runs the detector over a fixed local corpus with reference boxes and reports
+speed (images/sec, per-stage p50/p95/p99), peak RSS and accuracy (IoU against
+the reference boxes). Compares against a saved baseline and exits non-zero on
+a regression, so detector tuning can't silently cost speed or crop quality.
+
+Usage:
+    # 1. Export reviewed crops from Supabase as the reference manifest
+    python benchmark_chop_detection.py --export-reference reference.json
+
+    # 2. Benchmark, saving the first run as the baseline
+    python benchmark_chop_detection.py --corpus photos_staged_for_upload \\
+        --reference reference.json --scale 4 --save-baseline baseline.json
+
+    # 3. Later runs compare against it
+    python benchmark_chop_detection.py --corpus photos_staged_for_upload \\
+        --reference reference.json --scale 4 --baseline baseline.json
+
+Reference manifest format:
+    {"images": {"2304B00C0196D00": {"box": [x1, y1, x2, y2]}, ...}}
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import time
+from typing import Dict, List, Optional, Sequence
+
+import cv2
+
+from chop_engine import ALGORITHM_ID, DetectionError, Rejected, detect_reduced
+from chop_source import iter_images, read_image_bytes, record_key
+from chop_timing import StageTimer, summarize
+
+# Default regression tolerances
+MAX_SLOWDOWN = 0.10     # images/sec may drop by at most 10%
+MAX_IOU_DROP = 0.01     # mean IoU may drop by at most 0.01
+MIN_GOOD_IOU = 0.90     # IoU at or above this counts as a good crop
+
+
+def iou(a: Sequence[int], b: Sequence[int]) -> float:
+    """Intersection over union of two (x1, y1, x2, y2) boxes"""
+    ix1, iy1 = max(a[0], b[0]), max(a[1], b[1])
+    ix2, iy2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0, ix2 - ix1) * max(0, iy2 - iy1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process in MB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KB on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def export_reference(path: str) -> int:
+    """Write reviewed crop boxes from Supabase to a reference manifest; returns the count"""
+    from dotenv import load_dotenv
+    from supabase import create_client
+
+    load_dotenv()
+    client = create_client(os.getenv("NEXT_PUBLIC_SUPABASE_URL"), os.getenv("SUPABASE_SERVICE_ROLE_KEY"))
+
+    images = {}
+    page_size = 1000
+    offset = 0
+    while True:
+        rows = (
+            client.table('sample_images')
+            .select('image_url, crop_x1, crop_y1, crop_x2, crop_y2')
+            .eq('crop_processed', True)
+            .eq('needs_manual_review', False)
+            .not_.is_('crop_x1', 'null')
+            .range(offset, offset + page_size - 1)
+            .execute()
+            .data
+        )
+        for row in rows:
+            key = record_key(row['image_url'].split('?')[0])
+            if key:
+                images[key] = {'box': [row['crop_x1'], row['crop_y1'], row['crop_x2'], row['crop_y2']]}
+        if len(rows) < page_size:
+            break
+        offset += page_size
+
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'images': images}, f, indent=2, sort_keys=True)
+    return len(images)
+
+
+def load_corpus(corpus: str, reference: Dict[str, Dict], limit: Optional[int]) -> List[tuple]:
+    """(key, path, reference box) for every corpus image that has a reference box"""
+    items = [(key, path, reference[key]['box']) for key, path in iter_images(corpus) if key in reference]
+    return items[:limit] if limit else items
+
+
+def run_benchmark(items: List[tuple], scale: int, refine: bool, repeat: int) -> Dict:
+    """Detect every image repeat times (single thread, no cache) and collect metrics"""
+    # Warm up imports, the decoder and OpenCV's thread pool outside the timed loop
+    if items:
+        try:
+            detect_reduced(read_image_bytes(items[0][1]), scale, refine)
+        except DetectionError:
+            pass
+
+    timings = []
+    ious = {}
+    outcomes = {'ok': 0, 'rejected': 0, 'error': 0}
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for key, path, box in items:
+            timer = StageTimer()
+            with timer.span('read'):
+                data = read_image_bytes(path)
+            try:
+                detection = detect_reduced(data, scale, refine, timer)
+                ious[key] = iou(box, (detection.x1, detection.y1, detection.x2, detection.y2))
+                outcomes['ok'] += 1
+            except Rejected:
+                ious[key] = 0.0
+                outcomes['rejected'] += 1
+            except DetectionError:
+                ious[key] = 0.0
+                outcomes['error'] += 1
+            timings.append(timer.as_dict())
+    elapsed = time.perf_counter() - start
+
+    values = sorted(ious.values())
+    processed = len(items) * repeat
+    return {
+        'algorithm': ALGORITHM_ID,
+        'scale': scale,
+        'refine': refine,
+        'images': len(items),
+        'repeat': repeat,
+        'environment': {
+            'python': platform.python_version(),
+            'opencv': cv2.__version__,
+            'machine': platform.machine(),
+            'cpus': os.cpu_count(),
+        },
+        'images_per_sec': round(processed / elapsed, 2) if elapsed > 0 else 0.0,
+        'elapsed_sec': round(elapsed, 3),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+        'stages': summarize(timings),
+        'outcomes': {status: count // repeat for status, count in outcomes.items()},
+        'iou': {
+            'mean': round(sum(values) / len(values), 4) if values else 0.0,
+            'min': round(values[0], 4) if values else 0.0,
+            'p50': round(values[len(values) // 2], 4) if values else 0.0,
+            'good_fraction': round(sum(1 for v in values if v >= MIN_GOOD_IOU) / len(values), 4) if values else 0.0,
+        },
+        'per_image_iou': {key: round(value, 4) for key, value in sorted(ious.items())},
+    }
+
+
+def compare(report: Dict, baseline: Dict, max_slowdown: float, max_iou_drop: float) -> List[str]:
+    """Regressions of report against baseline, as human-readable messages"""
+    problems = []
+
+    # Reports saved while --stack existed carry the group size; 1 is the
+    # one-image-at-a-time path every current report measures
+    params = (report['scale'], report['refine'], report.get('stack', 1))
+    if params != (baseline['scale'], baseline['refine'], baseline.get('stack', 1)):
+        problems.append(f"Baseline was recorded with scale={baseline['scale']} refine={baseline['refine']} "
+                        f"stack={baseline.get('stack', 1)}")
+
+    old_rate, new_rate = baseline['images_per_sec'], report['images_per_sec']
+    if old_rate and new_rate < old_rate * (1 - max_slowdown):
+        problems.append(f"Throughput regressed: {new_rate:.2f} vs {old_rate:.2f} images/sec "
+                        f"({(1 - new_rate / old_rate) * 100:.1f}% slower)")
+
+    old_iou, new_iou = baseline['iou']['mean'], report['iou']['mean']
+    if new_iou < old_iou - max_iou_drop:
+        problems.append(f"Mean IoU regressed: {new_iou:.4f} vs {old_iou:.4f}")
+
+    worse = [
+        key for key, value in report['per_image_iou'].items()
+        if key in baseline.get('per_image_iou', {}) and value < baseline['per_image_iou'][key] - 0.05
+    ]
+    if worse:
+        print(f"⚠️  IoU dropped by more than 0.05 on {len(worse)} images: {', '.join(worse[:10])}",
+              file=sys.stderr)
+
+    return problems
+
+
+def print_summary(report: Dict):
+    print(f"📊 {report['algorithm']} scale={report['scale']} refine={report['refine']}: "
+          f"{report['images']} images x {report['repeat']}", file=sys.stderr)
+    print(f"   Throughput: {report['images_per_sec']:.2f} images/sec "
+          f"(peak RSS {report['peak_rss_mb']:.1f} MB)", file=sys.stderr)
+    print(f"   IoU: mean {report['iou']['mean']:.4f}, min {report['iou']['min']:.4f}, "
+          f"{report['iou']['good_fraction'] * 100:.1f}% >= {MIN_GOOD_IOU}", file=sys.stderr)
+    print(f"   Outcomes: {report['outcomes']}", file=sys.stderr)
+    print("   Stage          p50 ms    p95 ms    p99 ms", file=sys.stderr)
+    for stage, stats in report['stages'].items():
+        print(f"   {stage:<12} {stats['p50']:>8.2f}  {stats['p95']:>8.2f}  {stats['p99']:>8.2f}", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark chop detection speed and accuracy')
+    parser.add_argument('--export-reference', metavar='FILE',
+                        help='Export reviewed crop boxes from Supabase to FILE and exit')
+    parser.add_argument('--corpus', help='Directory of local images (searched recursively)')
+    parser.add_argument('--reference', help='Reference manifest JSON (see --export-reference)')
+    parser.add_argument('--scale', type=int, choices=[1, 2, 4, 8], default=1)
+    parser.add_argument('--refine', action='store_true')
+    parser.add_argument('--repeat', type=int, default=1, help='Passes over the corpus (default: 1)')
+    parser.add_argument('--limit', type=int, help='Only use the first N corpus images')
+    parser.add_argument('--output', help='Write the full JSON report here (default: stdout)')
+    parser.add_argument('--baseline', help='Compare against this saved report')
+    parser.add_argument('--save-baseline', metavar='FILE', help='Save this report as a baseline')
+    parser.add_argument('--max-slowdown', type=float, default=MAX_SLOWDOWN,
+                        help=f'Allowed fractional throughput drop (default: {MAX_SLOWDOWN})')
+    parser.add_argument('--max-iou-drop', type=float, default=MAX_IOU_DROP,
+                        help=f'Allowed mean IoU drop (default: {MAX_IOU_DROP})')
+    args = parser.parse_args()
+
+    if args.export_reference:
+        count = export_reference(args.export_reference)
+        print(f"✅ Exported {count} reference boxes to {args.export_reference}", file=sys.stderr)
+        return
+
+    if not args.corpus or not args.reference:
+        parser.error('--corpus and --reference are required')
+
+    with open(args.reference, encoding='utf-8') as f:
+        reference = json.load(f)['images']
+
+    items = load_corpus(args.corpus, reference, args.limit)
+    if not items:
+        print(f"❌ No images in {args.corpus} have reference boxes", file=sys.stderr)
+        sys.exit(1)
+
+    report = run_benchmark(items, args.scale, args.refine, max(1, args.repeat))
+    print_summary(report)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+        print(f"💾 Baseline saved to {args.save_baseline}", file=sys.stderr)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        problems = compare(report, baseline, args.max_slowdown, args.max_iou_drop)
+        if problems:
+            for problem in problems:
+                print(f"❌ {problem}", file=sys.stderr)
+            sys.exit(1)
+        print("✅ No regression against baseline", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,18 @@
 """
 Check how many images are currently in the R2 bucket
+
+Counts from the local inventory snapshot (see r2_inventory.py); pass
+--refresh to pick up new uploads or --full to re-list the bucket first.
 """
 import boto3
 from botocore.exceptions import ClientError
 import sys
 import os
+import argparse
 from dotenv import load_dotenv
 
+import r2_inventory
+
 # Load environment variables
 load_dotenv()
 
@@ -16,7 +22,7 @@ R2_ACCESS_KEY_ID = os.getenv("R2_ACCESS_KEY_ID")
 R2_SECRET_ACCESS_KEY = os.getenv("R2_SECRET_ACCESS_KEY")
 BUCKET_NAME = os.getenv("R2_BUCKET_NAME", "msl-tender-images")
 
-def count_r2_images():
+def count_r2_images(mode=r2_inventory.SNAPSHOT, inventory_path=r2_inventory.DEFAULT_PATH):
     """Count objects in R2 bucket"""
     
     # Validate configuration
@@ -36,19 +42,12 @@ def count_r2_images():
     )
     
     try:
-        # List all objects with prefix 'original/'
+        # Objects under 'original/', from the inventory snapshot
         print(f"📊 Counting objects in bucket '{BUCKET_NAME}'...")
         
-        paginator = s3.get_paginator('list_objects_v2')
-        page_iterator = paginator.paginate(Bucket=BUCKET_NAME, Prefix='original/')
-        
-        total_count = 0
-        total_size = 0
-        
-        for page in page_iterator:
-            if 'Contents' in page:
-                total_count += len(page['Contents'])
-                total_size += sum(obj['Size'] for obj in page['Contents'])
+        objects = r2_inventory.load(s3, BUCKET_NAME, 'original/', mode, inventory_path)
+        total_count = len(objects)
+        total_size = sum(obj['size'] for obj in objects)
         
         print()
         print("=" * 60)
@@ -71,8 +70,11 @@ def count_r2_images():
         sys.exit(1)
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Count images under original/ in the R2 bucket')
+    r2_inventory.add_arguments(parser)
+    args = parser.parse_args()
     try:
-        count_r2_images()
+        count_r2_images(r2_inventory.mode_from(args), args.inventory)
     except Exception as e:
         print(f"\n❌ Fatal error: {e}")
         sys.exit(1)
@@ -0,0 +1,201 @@
+"""
+Detection Result Cache
+On-disk cache of chop detection results keyed by image content (SHA-256 of
+the bytes, or the R2 ETag when one is known), algorithm ID and parameters.
+
+A small in-memory LRU sits in front of SQLite so repeat lookups within one
+process never touch disk. The SQLite table is trimmed to max_entries by least
+recent access. Hit/miss counters are kept per DetectionCache instance.
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple, Union
+
+import numpy as np
+
+from chop_engine import ALGORITHM_ID, Detection, DetectionError, Rejected, detect_reduced
+from chop_timing import NULL_TIMER, StageTimer
+
+DEFAULT_MAX_ENTRIES = 100_000
+DEFAULT_MEMORY_ENTRIES = 2_048
+
+# Trim the table only every so many writes, not on every put
+_EVICT_EVERY = 256
+
+
+def content_fingerprint(data: Union[bytes, np.ndarray]) -> str:
+    """Fingerprint of encoded image bytes"""
+    return "sha256:" + hashlib.sha256(memoryview(data).cast("B")).hexdigest()
+
+
+def etag_fingerprint(etag: str) -> str:
+    """Fingerprint from an R2/S3 ETag (quotes stripped)"""
+    return "etag:" + etag.strip('"')
+
+
+def make_key(fingerprint: str, algorithm: str, params: Optional[Dict] = None) -> str:
+    """Cache key for one image under one algorithm version and parameter set"""
+    payload = json.dumps([fingerprint, algorithm, params or {}], sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class DetectionCache:
+    """SQLite-backed LRU cache of detection result dicts"""
+
+    def __init__(self, path: str, max_entries: int = DEFAULT_MAX_ENTRIES,
+                 memory_entries: int = DEFAULT_MEMORY_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._puts = 0
+
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " accessed REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_results_accessed ON results(accessed)")
+
+    def get(self, key: str) -> Optional[Dict]:
+        """Cached result for key, or None (counted as a miss)"""
+        with self._lock:
+            value = self._memory.get(key)
+            if value is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return dict(value)
+
+            row = self._db.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            self._db.execute("UPDATE results SET accessed = ? WHERE key = ?", (time.time(), key))
+            value = json.loads(row[0])
+            self._remember(key, value)
+            self.hits += 1
+            return dict(value)
+
+    def put(self, key: str, value: Dict) -> None:
+        """Store a JSON-serializable result dict"""
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO results (key, value, accessed) VALUES (?, ?, ?)",
+                (key, json.dumps(value), time.time()),
+            )
+            self._remember(key, dict(value))
+
+            self._puts += 1
+            if self._puts % _EVICT_EVERY == 0:
+                self._evict()
+
+    def stats(self) -> Dict:
+        """Hit/miss counters for this instance plus the current table size"""
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": entries,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._evict()
+            self._db.close()
+
+    def _remember(self, key: str, value: Dict) -> None:
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _evict(self) -> None:
+        excess = self._db.execute("SELECT COUNT(*) FROM results").fetchone()[0] - self.max_entries
+        if excess > 0:
+            self._db.execute(
+                "DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY accessed LIMIT ?)",
+                (excess,),
+            )
+            self.evictions += excess
+
+
+def detect_with_cache(cache: Optional[DetectionCache], data: Union[bytes, np.ndarray],
+                      scale: int = 1, refine: bool = False, etag: Optional[str] = None,
+                      timer: Optional[StageTimer] = None, geometry: bool = False) -> Dict:
+    """
+    chop_engine.detect_reduced() as a result dict, answered from cache when
+    the same image was already processed with the same algorithm and options.
+
+    "No chop" outcomes are deterministic, so they are cached too, as
+    {'status': 'rejected', 'rejected': reason, ...} for pre-filter rejections
+    and {'status': 'error', 'error': ...} otherwise. The returned dict has
+    'cached' set to whether it came from the cache.
+
+    Lookups are timed as the 'cache' stage when a timer is given.
+    """
+    key, result = _lookup(cache, data, etag, scale, refine, timer, geometry)
+    if result is not None:
+        return result
+
+    try:
+        result = _outcome(detect_reduced(data, scale, refine, timer, geometry))
+    except DetectionError as e:
+        result = _outcome(e)
+
+    _store(cache, key, result, timer)
+    return result
+
+
+def _lookup(cache: Optional[DetectionCache], data: Union[bytes, np.ndarray], etag: Optional[str],
+            scale: int, refine: bool, timer: Optional[StageTimer],
+            geometry: bool = False) -> Tuple[Optional[str], Optional[Dict]]:
+    """(cache key, cached result or None)"""
+    if cache is None:
+        return None, None
+
+    params = {"scale": scale, "refine": refine}
+    if geometry:
+        # Only added when set, so existing box-only entries keep their keys
+        params["geometry"] = True
+    with (timer or NULL_TIMER).span("cache"):
+        fingerprint = etag_fingerprint(etag) if etag else content_fingerprint(data)
+        key = make_key(fingerprint, ALGORITHM_ID, params)
+        result = cache.get(key)
+    if result is not None:
+        result["cached"] = True
+    return key, result
+
+
+def _outcome(outcome: Union[Detection, DetectionError]) -> Dict:
+    if isinstance(outcome, Rejected):
+        return {"status": "rejected", "rejected": outcome.reason, "error": str(outcome), "prefilter": outcome.metrics}
+    if isinstance(outcome, DetectionError):
+        return {"status": "error", "error": str(outcome)}
+    return {"status": "ok", **outcome.to_dict()}
+
+
+def _store(cache: Optional[DetectionCache], key: Optional[str], result: Dict,
+           timer: Optional[StageTimer]) -> None:
+    if cache is not None:
+        with (timer or NULL_TIMER).span("cache"):
+            cache.put(key, result)
+    result["cached"] = False
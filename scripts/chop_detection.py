@@ -2,153 +2,151 @@
 """
 Chop Detection ML Service
 Detects pork chops in images and calculates bounding boxes
+
+Usage:
+    python chop_detection.py <image_url> [<image_url> ...]
+    echo '["<image_url>", ...]' | python chop_detection.py
+
+    # Multi-core batch mode, NDJSON streamed as each image completes
+    python chop_detection.py --batch --dir photos_staged_for_upload --scale 4
+    python chop_detection.py --batch --input urls.txt > results.ndjson
+
+    # Per-stage timings (download, decode, prefilter, hsv, morphology, ...)
+    python chop_detection.py --batch --dir photos --trace trace.jsonl
+
+    # Also output each chop's outline polygon and rotated rect
+    python chop_detection.py --batch --dir photos --scale 4 --geometry
 """
 
 import os
 import sys
 import json
+import time
+import argparse
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import islice
 import cv2
 import numpy as np
-from typing import Dict, Tuple, Optional
-import requests
-from urllib.parse import urlparse
-from io import BytesIO
+from typing import Dict, List, Tuple, Optional
 
-def download_image(url: str) -> Optional[np.ndarray]:
-    """Download image from URL and return as numpy array"""
+from chop_cache import DetectionCache, detect_with_cache
+from chop_engine import DetectionError, detect
+from chop_fetch import BlobStore, FetchResult, fetch
+from chop_source import iter_images, read_image_bytes, record_key
+from chop_timing import NULL_TIMER, StageTimer, summarize
+
+# Optional local store of downloaded originals, revalidated with conditional
+# GETs (--blob-store or CHOP_BLOB_STORE)
+_blob_store = BlobStore(os.environ['CHOP_BLOB_STORE']) if os.environ.get('CHOP_BLOB_STORE') else None
+
+def set_blob_store(path: Optional[str]):
+    """Enable (or with None, disable) the revalidating blob store for downloads"""
+    global _blob_store
+    _blob_store = BlobStore(path) if path else None
+
+def download(url: str) -> Optional[FetchResult]:
+    """Download image bytes and validators from URL (304-revalidated if a blob store is set)"""
     try:
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        image_array = np.asarray(bytearray(response.content), dtype=np.uint8)
-        image = cv2.imdecode(image_array, cv2.IMREAD_COLOR)
-        return image
+        return fetch(url, _blob_store)
     except Exception as e:
         print(f"Error downloading image from {url}: {e}", file=sys.stderr)
         return None
 
+def download_bytes(url: str) -> Optional[bytes]:
+    """Download encoded image bytes from URL"""
+    fetched = download(url)
+    return fetched.data if fetched else None
+
+def download_image(url: str) -> Optional[np.ndarray]:
+    """Download image from URL and return as numpy array"""
+    data = download_bytes(url)
+    if data is None:
+        return None
+    return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+
 def detect_chop(image: np.ndarray) -> Optional[Dict]:
     """
     Detect pork chop in image and return bounding box coordinates.
-    Uses color-based segmentation since chops are pink/red on blue background.
+    Uses the shared color-segmentation engine (see chop_engine.py).
     
     Returns:
-        dict with x1, y1, x2, y2, confidence or None if detection fails
+        dict with x1, y1, x2, y2, confidence, area_ratio, width, height and
+        algorithm, or None if detection fails
     """
-    if image is None:
-        return None
-    
     try:
-        # Convert to HSV for better color segmentation
-        hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-        
-        # Define range for pink/red meat (chop color)
-        # Pork typically has:
-        # - Hue: 0-20 (red) or 160-180 (red-pink)
-        # - Saturation: 30-255 (not too gray)
-        # - Value: 50-255 (not too dark)
-        
-        # Create masks for red ranges
-        lower_red1 = np.array([0, 30, 50])
-        upper_red1 = np.array([20, 255, 255])
-        mask1 = cv2.inRange(hsv, lower_red1, upper_red1)
-        
-        lower_red2 = np.array([160, 30, 50])
-        upper_red2 = np.array([180, 255, 255])
-        mask2 = cv2.inRange(hsv, lower_red2, upper_red2)
-        
-        # Combine masks
-        mask = cv2.bitwise_or(mask1, mask2)
-        
-        # Remove noise with morphological operations
-        kernel = np.ones((5, 5), np.uint8)
-        mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel, iterations=2)
-        mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel, iterations=2)
-        
-        # Find contours
-        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        
-        if not contours:
-            return None
-        
-        # Find largest contour (assumed to be the chop)
-        largest_contour = max(contours, key=cv2.contourArea)
-        area = cv2.contourArea(largest_contour)
-        
-        # Get image dimensions
-        height, width = image.shape[:2]
-        image_area = height * width
-        
-        # Chop should be significant portion of image (at least 5%, at most 80%)
-        area_ratio = area / image_area
-        if area_ratio < 0.05 or area_ratio > 0.80:
-            return None
-        
-        # Get bounding rectangle
-        x, y, w, h = cv2.boundingRect(largest_contour)
-        
-        # Add small margin (5%) to bounding box
-        margin_x = int(w * 0.05)
-        margin_y = int(h * 0.05)
-        
-        x1 = max(0, x - margin_x)
-        y1 = max(0, y - margin_y)
-        x2 = min(width, x + w + margin_x)
-        y2 = min(height, y + h + margin_y)
-        
-        # Calculate confidence based on area ratio and contour characteristics
-        # Perfect area ratio is around 0.3-0.5 (chop taking up 30-50% of image)
-        area_confidence = 1.0 - abs(0.4 - area_ratio) / 0.4
-        area_confidence = max(0.0, min(1.0, area_confidence))
-        
-        # Calculate aspect ratio confidence (chops are roughly oval, not too elongated)
-        aspect_ratio = w / h if h > 0 else 1.0
-        # Ideal aspect ratio is between 0.8 and 2.0
-        if 0.8 <= aspect_ratio <= 2.0:
-            aspect_confidence = 1.0
-        else:
-            aspect_confidence = max(0.0, 1.0 - abs(aspect_ratio - 1.4) / 2.0)
-        
-        # Combined confidence
-        confidence = (area_confidence + aspect_confidence) / 2.0
-        confidence = round(confidence, 2)
-        
-        return {
-            'x1': int(x1),
-            'y1': int(y1),
-            'x2': int(x2),
-            'y2': int(y2),
-            'confidence': confidence,
-            'area_ratio': round(area_ratio, 4)
-        }
-        
+        return detect(image).to_dict()
+    except DetectionError as e:
+        print(f"Chop not detected: {e}", file=sys.stderr)
+        return None
     except Exception as e:
         print(f"Error detecting chop: {e}", file=sys.stderr)
         return None
 
-def process_image_from_url(image_url: str) -> Optional[Dict]:
+def process_image_from_url(image_url: str, scale: int = 1, refine: bool = False,
+                           cache: Optional[DetectionCache] = None, geometry: bool = False) -> Optional[Dict]:
     """
     Download and process image from URL
     
+    Args:
+        scale: 1 for the full-resolution reference path, or 2/4/8 to detect on
+            a reduced JPEG decode and map the box back to original pixels
+        refine: re-locate the reduced box edges at full resolution
+        cache: optional detection cache; unchanged images skip segmentation
+        geometry: also return the outline 'polygon' and 'rotated_rect'
+    
     Returns:
         Detection result dict or None
     """
-    image = download_image(image_url)
-    if image is None:
+    fetched = download(image_url)
+    if fetched is None:
         return None
     
-    result = detect_chop(image)
+    result = _detect_bytes(fetched.data, scale, refine, cache, image_url, fetched.etag, geometry)
     if result:
         result['image_url'] = image_url
-        result['width'] = image.shape[1]
-        result['height'] = image.shape[0]
     
     return result
 
-def process_batch(image_urls: list) -> list:
+def process_image_from_path(path: str, scale: int = 1, refine: bool = False,
+                            cache: Optional[DetectionCache] = None, geometry: bool = False) -> Optional[Dict]:
+    """
+    Process a local image file (no network hop)
+    
+    Returns:
+        Detection result dict with 'path' and 'key' (study image ID), or None
+    """
+    try:
+        data = read_image_bytes(path)
+    except OSError as e:
+        print(f"Error reading {path}: {e}", file=sys.stderr)
+        return None
+    
+    result = _detect_bytes(data, scale, refine, cache, path, geometry=geometry)
+    if result:
+        result['path'] = path
+        result['key'] = record_key(path)
+    
+    return result
+
+def _detect_bytes(data, scale: int, refine: bool, cache: Optional[DetectionCache], source: str,
+                  etag: Optional[str] = None, geometry: bool = False) -> Optional[Dict]:
+    try:
+        result = detect_with_cache(cache, data, scale, refine, etag, geometry=geometry)
+    except Exception as e:
+        print(f"Error detecting chop in {source}: {e}", file=sys.stderr)
+        return None
+    
+    if result.pop('status') != 'ok':
+        print(f"Chop not detected in {source}: {result['error']}", file=sys.stderr)
+        return None
+    return result
+
+def process_batch(image_urls: list, scale: int = 1, refine: bool = False,
+                  cache: Optional[DetectionCache] = None, geometry: bool = False) -> list:
     """Process multiple images and return results"""
     results = []
     for url in image_urls:
-        result = process_image_from_url(url)
+        result = process_image_from_url(url, scale, refine, cache, geometry)
         if result:
             results.append(result)
         else:
@@ -158,26 +156,197 @@ def process_batch(image_urls: list) -> list:
             })
     return results
 
-if __name__ == '__main__':
-    if len(sys.argv) < 2:
-        print("Usage: python chop_detection.py <image_url> [<image_url> ...]")
-        print("Or pipe JSON array of URLs via stdin")
-        sys.exit(1)
+def read_sources(input_path: Optional[str], directory: Optional[str]) -> List[str]:
+    """
+    Collect image sources (URLs or local paths) for batch mode.
     
-    # Check if input is from stdin (JSON array)
-    if not sys.stdin.isatty():
-        try:
-            data = json.load(sys.stdin)
-            if isinstance(data, list):
-                results = process_batch(data)
-                print(json.dumps(results, indent=2))
+    A directory is walked recursively for JPEG/PNG files. An input file ('-' for
+    stdin) may hold a JSON array or one source per line.
+    """
+    if directory:
+        return [path for _, path in iter_images(directory)]
+    
+    if input_path == '-':
+        text = sys.stdin.read()
+    else:
+        with open(input_path, encoding='utf-8') as f:
+            text = f.read()
+    
+    if text.lstrip().startswith('['):
+        return json.loads(text)
+    return [line.strip() for line in text.splitlines() if line.strip() and not line.startswith('#')]
+
+def detect_source(source: str, scale: int = 1, refine: bool = False, trace: bool = False,
+                  geometry: bool = False) -> Dict:
+    """
+    Detect the chop in one URL or local file, never raising (batch worker).
+    With trace, the result carries per-stage 'timings' in ms.
+    """
+    is_url = source.startswith(('http://', 'https://'))
+    result = {'image_url': source} if is_url else {'path': source, 'key': record_key(source)}
+    timer = StageTimer() if trace else None
+    try:
+        with (timer or NULL_TIMER).span('download' if is_url else 'read'):
+            if is_url:
+                fetched = fetch(source, _blob_store)
+                data, etag = fetched.data, fetched.etag
             else:
-                print("Error: Expected JSON array of image URLs", file=sys.stderr)
-                sys.exit(1)
+                data, etag = read_image_bytes(source), None
+        result.update(detect_with_cache(_worker_cache, data, scale, refine, etag, timer, geometry))
+    except Exception as e:
+        result.update(status='error', error=str(e))
+    if timer is not None:
+        result['timings'] = timer.as_dict()
+    return result
+
+# Per-process detection cache for batch workers (set by _init_worker)
+_worker_cache = None
+
+def _init_worker(cache_path: Optional[str] = None, blob_store_path: Optional[str] = None):
+    global _worker_cache
+    # One OpenCV thread per process; the pool already uses every core
+    cv2.setNumThreads(1)
+    if cache_path:
+        _worker_cache = DetectionCache(cache_path)
+    if blob_store_path:
+        set_blob_store(blob_store_path)
+
+def run_batch(sources: List[str], workers: int, scale: int = 1, refine: bool = False,
+              cache_path: Optional[str] = None, out=sys.stdout, trace=None,
+              geometry: bool = False) -> Tuple[int, int, int]:
+    """
+    Detect chops across a process pool, writing one NDJSON line per image as
+    soon as it completes (completion order, not input order).
+    
+    If trace is a writable file, per-stage timings go there as JSONL instead
+    of into the results, followed by a {'summary': ...} line of p50/p95/p99.
+    
+    With geometry, ok results also carry 'polygon' and 'rotated_rect'.
+    
+    Returns:
+        (succeeded, failed, cache_hits) counts
+    """
+    succeeded = failed = cache_hits = 0
+    timings = []
+    tracing = trace is not None
+    pending = set()
+    queue = iter(sources)
+    
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(cache_path, _blob_store.root if _blob_store else None)) as executor:
+        # Keep a few tasks per worker in flight so results stream steadily
+        for source in islice(queue, workers * 4):
+            pending.add(executor.submit(detect_source, source, scale, refine, tracing, geometry))
+        
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                result = future.result()
+                if result['status'] == 'ok':
+                    succeeded += 1
+                else:
+                    failed += 1
+                if result.get('cached'):
+                    cache_hits += 1
+                if tracing:
+                    timing = result.pop('timings')
+                    timings.append(timing)
+                    trace.write(json.dumps({
+                        'source': result.get('image_url') or result.get('path'),
+                        'status': result['status'],
+                        'cached': result.get('cached', False),
+                        'timings': timing
+                    }) + '\n')
+                out.write(json.dumps(result) + '\n')
+                out.flush()
+                
+                for source in islice(queue, 1):
+                    pending.add(executor.submit(detect_source, source, scale, refine, tracing, geometry))
+    
+    if tracing:
+        trace.write(json.dumps({'summary': summarize(timings)}) + '\n')
+        trace.flush()
+    
+    return succeeded, failed, cache_hits
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Detect pork chops in images and print bounding boxes as JSON'
+    )
+    parser.add_argument('urls', nargs='*', help='Image URLs (or pipe a JSON array of URLs via stdin)')
+    parser.add_argument('--batch', action='store_true',
+                        help='Multi-core mode: stream NDJSON results as each image completes')
+    parser.add_argument('--input', help="Batch input file of URLs/paths ('-' for stdin)")
+    parser.add_argument('--dir', help='Batch input directory of local images (searched recursively)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='Worker processes for batch mode (default: all cores)')
+    parser.add_argument('--scale', type=int, choices=[1, 2, 4, 8], default=1,
+                        help='Detect on a 1/scale JPEG decode (default: 1, full resolution)')
+    parser.add_argument('--refine', action='store_true',
+                        help='Refine reduced-resolution box edges at full resolution')
+    parser.add_argument('--geometry', action='store_true',
+                        help="Also output the chop outline ('polygon') and rotated rect ('rotated_rect')")
+    parser.add_argument('--cache', metavar='PATH',
+                        help='SQLite detection cache; unchanged images skip segmentation')
+    parser.add_argument('--blob-store', metavar='DIR',
+                        help='Keep downloaded originals here and revalidate them with conditional GETs')
+    parser.add_argument('--trace', metavar='FILE',
+                        help='Batch mode: write per-stage timings as JSONL, ending with p50/p95/p99')
+    args = parser.parse_args()
+    
+    if args.blob_store:
+        set_blob_store(args.blob_store)
+    
+    if args.batch:
+        if args.dir:
+            sources = read_sources(None, args.dir)
+        elif args.input:
+            sources = read_sources(args.input, None)
+        elif args.urls:
+            sources = args.urls
+        else:
+            sources = read_sources('-', None)
+        
+        trace = open(args.trace, 'w', encoding='utf-8') if args.trace else None
+        start = time.perf_counter()
+        try:
+            succeeded, failed, cache_hits = run_batch(sources, max(1, args.workers), args.scale,
+                                                      args.refine, args.cache, trace=trace,
+                                                      geometry=args.geometry)
+        finally:
+            if trace is not None:
+                trace.close()
+        elapsed = time.perf_counter() - start
+        rate = len(sources) / elapsed if elapsed > 0 else 0.0
+        print(f"Processed {len(sources)} images ({succeeded} ok, {failed} failed) "
+              f"in {elapsed:.1f}s ({rate:.1f} images/sec, {args.workers} workers)", file=sys.stderr)
+        if args.cache:
+            print(f"Detection cache: {cache_hits} hits, {len(sources) - cache_hits} misses", file=sys.stderr)
+        return
+    
+    if args.urls:
+        # Process URLs from command line arguments
+        urls = args.urls
+    elif not sys.stdin.isatty():
+        # Input is from stdin (JSON array)
+        try:
+            urls = json.load(sys.stdin)
         except json.JSONDecodeError as e:
             print(f"Error parsing JSON: {e}", file=sys.stderr)
             sys.exit(1)
+        if not isinstance(urls, list):
+            print("Error: Expected JSON array of image URLs", file=sys.stderr)
+            sys.exit(1)
     else:
-        # Process URLs from command line arguments
-        results = process_batch(sys.argv[1:])
-        print(json.dumps(results, indent=2))
+        parser.print_usage()
+        sys.exit(1)
+    
+    cache = DetectionCache(args.cache) if args.cache else None
+    results = process_batch(urls, args.scale, args.refine, cache, args.geometry)
+    print(json.dumps(results, indent=2))
+    if cache is not None:
+        print(f"Detection cache: {cache.stats()}", file=sys.stderr)
+        cache.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,532 @@
+"""
+Chop Detection Engine
+Shared color-segmentation core used by scripts/chop_detection.py and the
+/api/crop-detect Vercel function.
+
+Bump ALGORITHM_VERSION whenever thresholds, morphology or the confidence
+formula change, so stored and cached crops from older versions can be told
+apart from current ones.
+
+Detection functions take an optional chop_timing.StageTimer to record how
+long each stage (decode, prefilter, hsv, morphology, contours, geometry,
+refine) took.
+
+With geometry=True a detection also carries the chop's outline as a
+simplified polygon (see encode_polygon) and its minimum-area rotated rect, so
+downstream cropping can mask the chop without segmenting the image again.
+"""
+
+import base64
+import threading
+from dataclasses import dataclass, asdict, replace
+from typing import Dict, Optional, Tuple, Union
+
+import cv2
+import numpy as np
+
+from chop_timing import NULL_TIMER, StageTimer
+
+ALGORITHM_VERSION = 2
+ALGORITHM_ID = f"hsv-contour-v{ALGORITHM_VERSION}"
+
+# Pork is pink/red on the blue backdrop:
+# - Hue: 0-20 (red) or 160-180 (red-pink)
+# - Saturation: 30-255 (not too gray)
+# - Value: 50-255 (not too dark)
+LOWER_RED1 = np.array([0, 30, 50], dtype=np.uint8)
+UPPER_RED1 = np.array([20, 255, 255], dtype=np.uint8)
+LOWER_RED2 = np.array([160, 30, 50], dtype=np.uint8)
+UPPER_RED2 = np.array([180, 255, 255], dtype=np.uint8)
+
+# Speckle removal is OPEN then CLOSE with a 5x5 square applied twice. Two
+# passes of a k x k square equal one pass of a (2k-1) x (2k-1) square, so
+# each step is a single 9x9 operation (identical output, one pass).
+MORPH_KERNEL = np.ones((9, 9), np.uint8)
+
+# Reduced-resolution detection: libjpeg decodes straight to 1/2, 1/4 or 1/8
+# size (DCT scaling), so the thumbnail never exists at full size. Every
+# reduced scale uses the same 5x5 kernel (3x3 twice). At 1/2 that is the
+# full-resolution 9x9 scaled down; at 1/4 and 1/8 it is relatively larger, so
+# it also removes bigger specks and rounds off thin edges by a pixel or two
+# (refine=True re-locates the edges at full resolution).
+REDUCED_DECODE_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+REDUCED_KERNELS = {1: MORPH_KERNEL, 2: np.ones((5, 5), np.uint8), 4: np.ones((5, 5), np.uint8), 8: np.ones((5, 5), np.uint8)}
+
+# Per-thread scratch buffers for the masking steps, reallocated only when the
+# working resolution changes, so a worker going through thousands of
+# same-sized images allocates nothing per image
+_scratch = threading.local()
+
+# Half-width of the full-resolution band searched around each reduced box edge
+# during refinement, in thumbnail pixels
+REFINE_BAND = 2
+
+# JPEG start-of-frame markers (carry the image size)
+_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+# Chop should be a significant portion of the image (at least 5%, at most 80%)
+MIN_AREA_RATIO = 0.05
+MAX_AREA_RATIO = 0.80
+
+# Margin added around the bounding box, as a fraction of its width/height
+BOX_MARGIN = 0.05
+
+# Optional outline (geometry=True): the chop contour simplified by
+# approxPolyDP to within this fraction of its perimeter
+POLYGON_EPSILON = 0.005
+# Encoded polygon vertices are int16 quarter pixels, which covers images up
+# to 8191 pixels on a side
+POLYGON_UNITS = 4
+POLYGON_MAX_SIDE = 32767 // POLYGON_UNITS
+
+# Pre-filter: images whose tiny thumbnail shows no meat are rejected before
+# morphology and contour search. Thresholds are deliberately looser than the
+# detector's own (5% area) so no detectable chop is rejected.
+PREFILTER_SIZE = 96                # long side of the sampled thumbnail, pixels
+PREFILTER_MIN_SATURATED = 0.01     # fraction of pixels with S >= 30 (else grayscale: tag/ruler scan)
+PREFILTER_MIN_MEAT_FRACTION = 0.01  # fraction of pixels inside the meat HSV ranges
+PREFILTER_MAX_ASPECT = 6.0         # meat-pixel extent elongation (rulers are > 4:1)
+
+
+class DetectionError(Exception):
+    """Raised when an image cannot be decoded or contains no plausible chop"""
+
+
+class Rejected(DetectionError):
+    """Raised by the pre-filter when an image is clearly not a chop"""
+
+    def __init__(self, reason: str, metrics: Dict):
+        super().__init__(f"Rejected: {reason}")
+        self.reason = reason
+        self.metrics = metrics
+
+
+@dataclass(frozen=True)
+class Detection:
+    """
+    Bounding box of a detected chop in original image pixels, plus, when
+    requested, its outline (encode_polygon) and rotated rect as
+    (center x, center y, width, height, angle in degrees)
+    """
+    x1: int
+    y1: int
+    x2: int
+    y2: int
+    confidence: float
+    area_ratio: float
+    width: int
+    height: int
+    algorithm: str = ALGORITHM_ID
+    polygon: Optional[str] = None
+    rotated_rect: Optional[Tuple[float, float, float, float, float]] = None
+
+    def to_dict(self) -> Dict:
+        # Geometry keys only appear when it was requested
+        return {key: value for key, value in asdict(self).items() if value is not None}
+
+
+def decode_image(data: Union[bytes, np.ndarray], flags: int = cv2.IMREAD_COLOR) -> np.ndarray:
+    """Decode encoded image bytes into a BGR array"""
+    buffer = np.frombuffer(data, dtype=np.uint8) if isinstance(data, (bytes, bytearray, memoryview)) else data
+    image = cv2.imdecode(buffer, flags)
+    if image is None:
+        raise DetectionError("Failed to decode image")
+    return image
+
+
+def jpeg_size(data: Union[bytes, np.ndarray]) -> Optional[Tuple[int, int]]:
+    """(width, height) from a JPEG header without decoding, or None if not a JPEG"""
+    view = memoryview(data).cast("B")
+    if len(view) < 4 or view[0] != 0xFF or view[1] != 0xD8:
+        return None
+
+    i = 2
+    while i + 9 < len(view):
+        if view[i] != 0xFF:
+            return None
+        marker = view[i + 1]
+        if marker == 0xFF:  # fill byte
+            i += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:  # standalone markers
+            i += 2
+            continue
+        if marker in _SOF_MARKERS:
+            height = (view[i + 5] << 8) | view[i + 6]
+            width = (view[i + 7] << 8) | view[i + 8]
+            return width, height
+        i += 2 + ((view[i + 2] << 8) | view[i + 3])
+    return None
+
+
+def scratch(name: str, shape: Tuple[int, ...]) -> np.ndarray:
+    """This thread's uint8 buffer called name, (re)allocated only if the shape changed"""
+    buffers = getattr(_scratch, 'buffers', None)
+    if buffers is None:
+        buffers = _scratch.buffers = {}
+    buffer = buffers.get(name)
+    if buffer is None or buffer.shape != shape:
+        buffer = buffers[name] = np.empty(shape, dtype=np.uint8)
+    return buffer
+
+
+def red_mask(image: np.ndarray, kernel: np.ndarray = MORPH_KERNEL,
+             timer: Optional[StageTimer] = None, reuse: bool = False) -> np.ndarray:
+    """
+    Binary mask of meat-colored pixels, with speckle noise removed.
+
+    With reuse=True every step writes into this thread's scratch buffers, and
+    the returned mask is only valid until the next reuse=True call on the
+    same thread.
+    """
+    timer = timer or NULL_TIMER
+    height, width = image.shape[:2]
+    hsv = scratch('hsv', image.shape) if reuse else None
+    mask = scratch('mask', (height, width)) if reuse else None
+    work = scratch('work', (height, width)) if reuse else None
+
+    with timer.span('hsv'):
+        hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV, dst=hsv)
+        mask = cv2.inRange(hsv, LOWER_RED1, UPPER_RED1, dst=mask)
+        work = cv2.inRange(hsv, LOWER_RED2, UPPER_RED2, dst=work)
+        mask = cv2.bitwise_or(mask, work, dst=mask)
+    return clean_mask(mask, kernel, timer, work)
+
+
+def clean_mask(mask: np.ndarray, kernel: np.ndarray = MORPH_KERNEL,
+               timer: Optional[StageTimer] = None, work: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Remove speckle noise (OPEN) and fill small holes (CLOSE) in a raw mask.
+    The result overwrites mask; work, if given, holds the intermediate step.
+    """
+    with (timer or NULL_TIMER).span('morphology'):
+        work = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel, dst=work)
+        return cv2.morphologyEx(work, cv2.MORPH_CLOSE, kernel, dst=mask)
+
+
+def prefilter(image: np.ndarray, timer: Optional[StageTimer] = None) -> Dict:
+    """
+    Cheap plausibility check on a ~96 px sample of the image.
+
+    Looks at the saturation histogram, the fraction of meat-toned pixels and
+    the elongation of their extent.
+
+    Returns:
+        the metrics, if the image may contain a chop
+
+    Raises:
+        Rejected with reason 'grayscale', 'no_meat_tones' or 'elongated'
+    """
+    with (timer or NULL_TIMER).span('prefilter'):
+        return _prefilter(image)
+
+
+def _prefilter(image: np.ndarray) -> Dict:
+    height, width = image.shape[:2]
+    factor = PREFILTER_SIZE / max(height, width)
+    if factor < 1:
+        size = (max(1, int(width * factor)), max(1, int(height * factor)))
+        image = cv2.resize(image, size, interpolation=cv2.INTER_NEAREST)
+
+    hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+    pixels = hsv.shape[0] * hsv.shape[1]
+
+    saturation_hist = cv2.calcHist([hsv], [1], None, [256], [0, 256]).ravel()
+    saturated = float(saturation_hist[LOWER_RED1[1]:].sum()) / pixels
+
+    meat = cv2.bitwise_or(
+        cv2.inRange(hsv, LOWER_RED1, UPPER_RED1),
+        cv2.inRange(hsv, LOWER_RED2, UPPER_RED2),
+    )
+    meat_fraction = cv2.countNonZero(meat) / pixels
+
+    metrics = {'saturated_fraction': round(saturated, 4), 'meat_fraction': round(meat_fraction, 4)}
+    if saturated < PREFILTER_MIN_SATURATED:
+        raise Rejected('grayscale', metrics)
+    if meat_fraction < PREFILTER_MIN_MEAT_FRACTION:
+        raise Rejected('no_meat_tones', metrics)
+
+    _, _, w, h = cv2.boundingRect(cv2.findNonZero(meat))
+    metrics['meat_aspect'] = round(max(w, h) / max(1, min(w, h)), 2)
+    if metrics['meat_aspect'] > PREFILTER_MAX_ASPECT:
+        raise Rejected('elongated', metrics)
+
+    return metrics
+
+
+def score(area_ratio: float, aspect_ratio: float) -> float:
+    """
+    Confidence in [0, 1] from the chop's share of the image and its shape.
+
+    Perfect area ratio is around 0.4 (chop taking up 30-50% of the image);
+    chops are roughly oval, so an aspect ratio of 0.8-2.0 scores fully.
+    """
+    area_confidence = 1.0 - abs(0.4 - area_ratio) / 0.4
+    area_confidence = max(0.0, min(1.0, area_confidence))
+
+    if 0.8 <= aspect_ratio <= 2.0:
+        aspect_confidence = 1.0
+    else:
+        aspect_confidence = max(0.0, 1.0 - abs(aspect_ratio - 1.4) / 2.0)
+
+    return round((area_confidence + aspect_confidence) / 2.0, 2)
+
+
+def locate(image: np.ndarray, kernel: np.ndarray = MORPH_KERNEL,
+           timer: Optional[StageTimer] = None) -> Tuple[int, int, int, int, float]:
+    """
+    Find the chop's unpadded bounding rect in image pixels.
+
+    Returns:
+        (x, y, w, h, area_ratio)
+
+    Raises:
+        DetectionError if no contour of plausible size is found
+    """
+    return locate_mask(red_mask(image, kernel, timer, reuse=True), timer)
+
+
+def locate_mask(mask: np.ndarray, timer: Optional[StageTimer] = None) -> Tuple[int, int, int, int, float]:
+    """locate() on an already cleaned mask"""
+    contour, area_ratio = chop_contour(mask, timer)
+    x, y, w, h = cv2.boundingRect(contour)
+    return x, y, w, h, area_ratio
+
+
+def chop_contour(mask: np.ndarray, timer: Optional[StageTimer] = None) -> Tuple[np.ndarray, float]:
+    """
+    The chop's outline in a cleaned mask (its largest external contour).
+
+    Returns:
+        (contour, area_ratio)
+
+    Raises:
+        DetectionError if no contour of plausible size is found
+    """
+    with (timer or NULL_TIMER).span('contours'):
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        if not contours:
+            raise DetectionError("No contours found")
+
+        # Largest contour is assumed to be the chop
+        largest_contour = max(contours, key=cv2.contourArea)
+        area = cv2.contourArea(largest_contour)
+
+    height, width = mask.shape[:2]
+    area_ratio = area / (height * width)
+    if area_ratio < MIN_AREA_RATIO or area_ratio > MAX_AREA_RATIO:
+        raise DetectionError(f"Invalid area ratio: {area_ratio:.2f}")
+
+    return largest_contour, area_ratio
+
+
+def contour_geometry(contour: np.ndarray, width: int, height: int, sx: float = 1.0, sy: float = 1.0,
+                     timer: Optional[StageTimer] = None) -> Tuple[Optional[str], Tuple[float, ...]]:
+    """
+    Simplified polygon and rotated rect of a contour, in original pixels.
+
+    A thumbnail contour is mapped back to the centers of the original pixels
+    each thumbnail pixel covers, so vertices land between whole pixels
+    instead of snapping to the thumbnail grid; they are kept to a quarter
+    pixel.
+
+    Returns:
+        (encode_polygon() text, or None for images too large to encode,
+        (center x, center y, width, height, angle))
+    """
+    with (timer or NULL_TIMER).span('geometry'):
+        points = contour.reshape(-1, 2).astype(np.float32)
+        if sx != 1.0 or sy != 1.0:
+            points = (points + 0.5) * np.float32((sx, sy)) - 0.5
+            np.clip(points, 0, (width - 1, height - 1), out=points)
+
+        (cx, cy), (w, h), angle = cv2.minAreaRect(points)
+        rotated_rect = tuple(round(float(v), 2) for v in (cx, cy, w, h, angle))
+
+        if max(width, height) > POLYGON_MAX_SIDE:
+            return None, rotated_rect
+        approx = cv2.approxPolyDP(points, POLYGON_EPSILON * cv2.arcLength(points, True), True)
+        return encode_polygon(approx.reshape(-1, 2)), rotated_rect
+
+
+def encode_polygon(points: np.ndarray) -> str:
+    """
+    Compact text form of a polygon: unpadded base64url of little-endian int16
+    [x0, y0, dx1, dy1, dx2, dy2, ...] in quarter pixels (first vertex
+    absolute, then deltas). A typical chop outline is 20-40 vertices, about
+    110-220 characters.
+    """
+    quarters = np.round(np.asarray(points, np.float64).reshape(-1, 2) * POLYGON_UNITS).astype(np.int32)
+    deltas = np.diff(quarters, axis=0, prepend=np.zeros((1, 2), np.int32))
+    return base64.urlsafe_b64encode(deltas.astype('<i2').tobytes()).rstrip(b'=').decode('ascii')
+
+
+def decode_polygon(text: str) -> np.ndarray:
+    """Inverse of encode_polygon(): float32 (N, 2) vertices in original pixels"""
+    raw = base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+    deltas = np.frombuffer(raw, dtype='<i2').reshape(-1, 2).astype(np.int32)
+    return (np.cumsum(deltas, axis=0) / POLYGON_UNITS).astype(np.float32)
+
+
+def make_detection(x: int, y: int, w: int, h: int, area_ratio: float, width: int, height: int,
+                   algorithm: str = ALGORITHM_ID) -> Detection:
+    """Pad an unpadded rect by BOX_MARGIN, clip it to the image and score it"""
+    margin_x = int(w * BOX_MARGIN)
+    margin_y = int(h * BOX_MARGIN)
+
+    return Detection(
+        x1=max(0, x - margin_x),
+        y1=max(0, y - margin_y),
+        x2=min(width, x + w + margin_x),
+        y2=min(height, y + h + margin_y),
+        confidence=score(area_ratio, w / h if h > 0 else 1.0),
+        area_ratio=round(area_ratio, 4),
+        width=width,
+        height=height,
+        algorithm=algorithm,
+    )
+
+
+def detect(image: np.ndarray, timer: Optional[StageTimer] = None, geometry: bool = False) -> Detection:
+    """
+    Detect the pork chop in a full-resolution BGR image (reference path).
+
+    With geometry=True the detection also carries the outline polygon and
+    rotated rect (see contour_geometry).
+
+    Raises:
+        Rejected if the pre-filter finds no plausible chop
+        DetectionError if no contour of plausible size is found
+    """
+    if image is None:
+        raise DetectionError("No image")
+
+    prefilter(image, timer)
+    height, width = image.shape[:2]
+    contour, area_ratio = chop_contour(red_mask(image, MORPH_KERNEL, timer, reuse=True), timer)
+    return map_detection(image, image, (*cv2.boundingRect(contour), area_ratio), width, height, 1,
+                         timer=timer, contour=contour if geometry else None)
+
+
+def refine_edges(image: np.ndarray, x1: int, y1: int, x2: int, y2: int, band: int) -> Tuple[int, int, int, int]:
+    """
+    Snap each edge of an upscaled box to the full-resolution mask.
+
+    Only four strips of +/- band pixels around the edges are segmented, not the
+    whole image. An edge with no meat pixels in its strip is left unchanged.
+    """
+    height, width = image.shape[:2]
+    ly1, ly2 = max(0, y1 - band), min(height, y2 + band)
+    lx1, lx2 = max(0, x1 - band), min(width, x2 + band)
+
+    def extent(strip: np.ndarray, axis: int) -> Optional[Tuple[int, int]]:
+        hits = np.flatnonzero(red_mask(strip).any(axis=axis))
+        return (int(hits[0]), int(hits[-1])) if hits.size else None
+
+    left = extent(image[ly1:ly2, max(0, x1 - band):min(width, x1 + band)], 0)
+    right = extent(image[ly1:ly2, max(0, x2 - band):min(width, x2 + band)], 0)
+    top = extent(image[max(0, y1 - band):min(height, y1 + band), lx1:lx2], 1)
+    bottom = extent(image[max(0, y2 - band):min(height, y2 + band), lx1:lx2], 1)
+
+    return (
+        max(0, x1 - band) + left[0] if left else x1,
+        max(0, y1 - band) + top[0] if top else y1,
+        max(0, x2 - band) + right[1] + 1 if right else x2,
+        max(0, y2 - band) + bottom[1] + 1 if bottom else y2,
+    )
+
+
+def detect_reduced(data: Union[bytes, np.ndarray], scale: int = 4, refine: bool = False,
+                   timer: Optional[StageTimer] = None, geometry: bool = False) -> Detection:
+    """
+    Detect the chop on a 1/scale thumbnail decoded straight from JPEG bytes and
+    map the box back to original pixels.
+
+    With refine=True the original is also decoded and the box edges are
+    re-located at full resolution (see refine_edges). Input that is not a
+    JPEG, or scale=1, falls back to the full-resolution reference path.
+
+    With geometry=True the thumbnail outline is mapped back too (refine only
+    moves the box edges, not the outline).
+
+    Raises:
+        DetectionError if decoding fails or no plausible chop is found
+    """
+    timer = timer or NULL_TIMER
+    thumb, width, height, scale = decode_thumbnail(data, scale, timer)
+    if scale == 1:
+        return detect(thumb, timer, geometry)
+
+    prefilter(thumb, timer)
+    contour, area_ratio = chop_contour(red_mask(thumb, REDUCED_KERNELS[scale], timer, reuse=True), timer)
+    return map_detection(data, thumb, (*cv2.boundingRect(contour), area_ratio), width, height, scale,
+                         refine, timer, contour if geometry else None)
+
+
+def decode_thumbnail(data: Union[bytes, np.ndarray], scale: int,
+                     timer: Optional[StageTimer] = None) -> Tuple[np.ndarray, int, int, int]:
+    """
+    Decode at 1/scale for detection.
+
+    Returns:
+        (image, original width, original height, scale actually used); scale
+        is 1 for non-JPEG input, which is decoded at full size
+    """
+    size = jpeg_size(data)
+    if scale == 1 or size is None:
+        with (timer or NULL_TIMER).span('decode'):
+            image = decode_image(data)
+        return image, image.shape[1], image.shape[0], 1
+
+    with (timer or NULL_TIMER).span('decode'):
+        thumb = decode_image(data, REDUCED_DECODE_FLAGS[scale])
+    thumb_height, thumb_width = thumb.shape[:2]
+
+    # imdecode applies EXIF orientation but the SOF header holds the stored
+    # (unrotated) size, so swap it when the thumbnail came out rotated
+    width, height = size
+    if (thumb_width >= thumb_height) != (width >= height):
+        width, height = height, width
+    return thumb, width, height, scale
+
+
+def map_detection(data: Union[bytes, np.ndarray], thumb: np.ndarray, box: Tuple[int, int, int, int, float],
+                  width: int, height: int, scale: int, refine: bool = False,
+                  timer: Optional[StageTimer] = None, contour: Optional[np.ndarray] = None) -> Detection:
+    """
+    Map a thumbnail box from locate() back to original pixels, optionally
+    refining it. Given the thumbnail contour, its geometry is added as well.
+    """
+    if scale == 1:
+        detection = make_detection(*box, width, height)
+        if contour is None:
+            return detection
+        polygon, rotated_rect = contour_geometry(contour, width, height, timer=timer)
+        return replace(detection, polygon=polygon, rotated_rect=rotated_rect)
+
+    x, y, w, h, area_ratio = box
+    thumb_height, thumb_width = thumb.shape[:2]
+    sx, sy = width / thumb_width, height / thumb_height
+    x1, y1 = int(x * sx), int(y * sy)
+    x2, y2 = min(width, int(round((x + w) * sx))), min(height, int(round((y + h) * sy)))
+    algorithm = f"{ALGORITHM_ID}/r{scale}"
+
+    if refine:
+        timer = timer or NULL_TIMER
+        with timer.span('decode'):
+            image = decode_image(data)
+        with timer.span('refine'):
+            x1, y1, x2, y2 = refine_edges(image, x1, y1, x2, y2, int(REFINE_BAND * max(sx, sy)))
+        algorithm += "+refine"
+
+    detection = make_detection(x1, y1, x2 - x1, y2 - y1, area_ratio, width, height, algorithm)
+    if contour is None:
+        return detection
+    polygon, rotated_rect = contour_geometry(contour, width, height, sx, sy, timer)
+    return replace(detection, polygon=polygon, rotated_rect=rotated_rect)
+
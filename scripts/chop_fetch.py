@@ -0,0 +1,106 @@
+"""
+Revalidating Image Downloader
+Keeps a local blob store of previously downloaded originals together with
+their ETag/Last-Modified, and revalidates with If-None-Match /
+If-Modified-Since. A 304 reuses the local bytes, so repeat detection and
+validation passes over R2 transfer almost nothing.
+
+Layout of the store directory:
+    <sha256(url)>.bin    image bytes
+    <sha256(url)>.json   {"url", "etag", "last_modified", "size"}
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+from dataclasses import dataclass
+from typing import Dict, Optional, Union
+
+import numpy as np
+import requests
+
+from chop_source import read_image_bytes
+
+DEFAULT_TIMEOUT = 10
+
+
+@dataclass
+class FetchResult:
+    """Downloaded (or revalidated) image bytes and their validators"""
+    data: Union[bytes, np.ndarray]
+    etag: Optional[str]
+    last_modified: Optional[str]
+    not_modified: bool
+
+
+class BlobStore:
+    """Directory of downloaded originals keyed by URL"""
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, url: str, suffix: str) -> str:
+        return os.path.join(self.root, hashlib.sha256(url.encode("utf-8")).hexdigest() + suffix)
+
+    def lookup(self, url: str) -> Optional[Dict]:
+        """Stored validators for url, or None if it was never fetched"""
+        try:
+            with open(self._path(url, ".json"), encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not os.path.exists(self._path(url, ".bin")):
+            return None
+        return meta
+
+    def read(self, url: str) -> np.ndarray:
+        return read_image_bytes(self._path(url, ".bin"))
+
+    def save(self, url: str, data: bytes, etag: Optional[str], last_modified: Optional[str]) -> None:
+        """Store bytes and validators, each written atomically"""
+        self._write(self._path(url, ".bin"), data)
+        meta = {"url": url, "etag": etag, "last_modified": last_modified, "size": len(data)}
+        self._write(self._path(url, ".json"), json.dumps(meta).encode("utf-8"))
+
+    def _write(self, path: str, payload: bytes) -> None:
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(payload)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+
+def fetch(url: str, store: Optional[BlobStore] = None, session: Optional[requests.Session] = None,
+          timeout: float = DEFAULT_TIMEOUT) -> FetchResult:
+    """
+    GET url, revalidating against the blob store when it has a copy.
+
+    Raises:
+        requests.HTTPError for 4xx/5xx responses
+    """
+    http = session or requests
+    meta = store.lookup(url) if store is not None else None
+
+    headers = {}
+    if meta:
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+    response = http.get(url, headers=headers, timeout=timeout)
+    if response.status_code == 304 and meta:
+        return FetchResult(store.read(url), meta.get("etag"), meta.get("last_modified"), True)
+
+    response.raise_for_status()
+    etag = response.headers.get("ETag")
+    last_modified = response.headers.get("Last-Modified")
+    if store is not None:
+        store.save(url, response.content, etag, last_modified)
+    return FetchResult(response.content, etag, last_modified, False)
@@ -0,0 +1,346 @@
+"""
+Chop Post-Processing
+Turns a foreground mask into the published processed/ crop, a port of the
+post-processing in process_chops_colab.ipynb (process_image_with_rembg, after
+the background removal step) using only OpenCV and NumPy.
+
+Given the original RGB image and any foreground mask (rembg alpha, or the
+CPU segmentation in chop_segment.py), postprocess() keeps the largest
+component, cuts off a tag attached at the bottom, crops with a 2% margin,
+removes blue edge pixels, fills holes, puts the chop on white and computes
+the enhanced metrics stored on sample_images.
+
+OCR is optional: pass a callable returning the text found in the crop (the
+notebook uses EasyOCR); without one, the text-based flags are all False.
+"""
+
+import re
+from typing import Callable, Dict, Optional, Tuple
+
+import cv2
+import numpy as np
+
+# Margin around the chop's bounding box, as a fraction of its width/height
+CROP_MARGIN = 0.02
+
+# Tag cut-off: in the bottom 30% of the image, the first row (5-row moving
+# average) covering less than 20% of the width ends the chop
+TAG_SEARCH_START = 0.7
+TAG_GAP_DENSITY = 0.2
+TAG_SMOOTHING = 5
+
+# Residual backdrop on the chop edge: blue channel above red and green by these
+BLUE_EDGE_MARGIN_R = 20
+BLUE_EDGE_MARGIN_G = 15
+
+# Bright region in the bottom 20% of the crop flags a possible tag
+TAG_WARNING_BRIGHTNESS = 240
+TAG_WARNING_FRACTION = 0.1
+
+# Crops smaller than this on either side are likely tag fragments
+MIN_CROP_SIDE = 300
+
+# Aspect ratio above which a crop is likely a ruler
+MAX_ASPECT_RATIO = 4.0
+
+JPEG_QUALITY = 95
+
+_CROSS = cv2.getStructuringElement(cv2.MORPH_CROSS, (3, 3))
+
+# Saturation (max - min) / max for every (max, min) pair of 8-bit channels,
+# and per max the largest max - min with saturation <= 0.15
+_SATURATION = np.fromfunction(lambda high, low: np.where(high > low, (high - low) / np.maximum(high, 1), 0),
+                              (256, 256))
+_SATURATION_FLOOR = (np.arange(256) * 3 // 20).astype(np.uint8)
+
+
+def analyze_color_distribution(rgb_array: np.ndarray, mask: np.ndarray) -> Dict:
+    """
+    Analyze color distribution to distinguish meat from rulers/tags.
+
+    Works on 8-bit channels in the mask's bounding box with integer tests
+    (no float copies of the pixels): a pixel is a meat tone when red is the
+    strict maximum, its hue is within 30° of red (2·|g - b| < max - min) and
+    its saturation is above 0.15 (20·(max - min) > 3·max). The mean
+    saturation comes from a (max, min) histogram of the masked pixels.
+
+    Returns:
+        dict with color metrics:
+        - has_meat_tones: True if pink/red meat colors detected
+        - avg_saturation: Average color saturation (0-1)
+        - is_grayscale: True if mostly gray (like rulers)
+    """
+    mask = (mask if mask.dtype == bool else mask > 0).view(np.uint8)
+    total = cv2.countNonZero(mask)
+    if total == 0:
+        return {'has_meat_tones': False, 'avg_saturation': 0.0, 'is_grayscale': True}
+
+    x, y, w, h = cv2.boundingRect(mask)
+    mask = mask[y:y + h, x:x + w]
+    red, green, blue = cv2.split(rgb_array[y:y + h, x:x + w])
+    high = cv2.max(cv2.max(red, green), blue)
+    low = cv2.min(cv2.min(red, green), blue)
+
+    hist = cv2.calcHist([high, low], [0, 1], mask, [256, 256], [0, 256, 0, 256])
+    avg_saturation = float((hist * _SATURATION).sum() / total)
+
+    # Meat tones: red/pink (hue 0-30 or 330-360) with moderate saturation
+    diff = cv2.subtract(high, low)
+    spread = cv2.absdiff(green, blue)
+    meat = cv2.compare(cv2.add(spread, spread), diff, cv2.CMP_LT)
+    cv2.bitwise_and(meat, cv2.compare(red, green, cv2.CMP_GT), dst=meat)
+    cv2.bitwise_and(meat, cv2.compare(red, blue, cv2.CMP_GT), dst=meat)
+    cv2.bitwise_and(meat, cv2.compare(diff, cv2.LUT(high, _SATURATION_FLOOR), cv2.CMP_GT), dst=meat)
+    cv2.bitwise_and(meat, mask, dst=meat)
+    has_meat_tones = cv2.countNonZero(meat) / total > 0.3
+
+    # Grayscale check: low saturation across most pixels
+    is_grayscale = avg_saturation < 0.15
+
+    return {
+        'has_meat_tones': bool(has_meat_tones),
+        'avg_saturation': avg_saturation,
+        'is_grayscale': bool(is_grayscale)
+    }
+
+
+def analyze_text_pattern(detected_text: str) -> Dict:
+    """
+    Analyze text patterns to distinguish rulers from tags.
+
+    Returns:
+        dict with text pattern flags:
+        - has_sequential_numbers: True if text like "1 2 3 4" (ruler)
+        - has_alphanumeric_id: True if text like "2304B00C0196D00" (tag)
+        - has_measurement_marks: True if contains inch/cm markers
+    """
+    if not detected_text or len(detected_text) < 2:
+        return {
+            'has_sequential_numbers': False,
+            'has_alphanumeric_id': False,
+            'has_measurement_marks': False
+        }
+
+    # Sequential numbers (ruler pattern): first five within 2 of each other
+    numbers = re.findall(r'\d+', detected_text)
+    has_sequential = False
+    if len(numbers) >= 3:
+        nums = [int(n) for n in numbers[:5]]
+        diffs = [abs(nums[i + 1] - nums[i]) for i in range(len(nums) - 1)]
+        has_sequential = all(d <= 2 for d in diffs)
+
+    return {
+        'has_sequential_numbers': bool(has_sequential),
+        'has_alphanumeric_id': bool(re.search(r'[A-Z]\d+[A-Z]\d+', detected_text)),
+        'has_measurement_marks': bool(re.search(r'\b(in|inch|cm|mm)\b', detected_text.lower()))
+    }
+
+
+def largest_component(foreground: np.ndarray) -> Optional[Tuple[np.ndarray, Tuple[int, int, int, int]]]:
+    """
+    Largest 4-connected component (as ndimage.label), from one
+    connectedComponentsWithStats pass: component sizes and boxes come from
+    the stats, so only the winner gets a mask, cut to its bounding box.
+
+    Returns:
+        (boolean mask inside the box, (x, y, w, h) box), or None if there is
+        no foreground
+    """
+    foreground = (foreground if foreground.dtype == bool else foreground > 0).view(np.uint8)
+    count, labels, stats, _ = cv2.connectedComponentsWithStats(foreground, connectivity=4)
+    if count <= 1:
+        return None
+    label = int(np.argmax(stats[1:, cv2.CC_STAT_AREA])) + 1
+    x, y, w, h = (int(v) for v in stats[label, :4])
+    return labels[y:y + h, x:x + w] == label, (x, y, w, h)
+
+
+def cut_bottom_tag(chop_mask: np.ndarray, top: int, height: int, width: int) -> bool:
+    """
+    Clear everything below the first low-density row in the bottom 30% of
+    the image (in place). chop_mask is the component's box, starting at
+    image row top, in a height x width image; densities are per image row.
+
+    Returns:
+        True if rows of the box were cleared
+    """
+    bottom = int(height * TAG_SEARCH_START)
+    end = top + chop_mask.shape[0]
+    densities = np.zeros(max(0, height - bottom))
+    start = max(bottom, top)
+    if end > start:
+        densities[start - bottom:end - bottom] = np.count_nonzero(chop_mask[start - top:], axis=1) / width
+    if not densities.size or densities.max() <= 0:
+        return False
+
+    # Moving average with mirrored edges (scipy.ndimage.uniform_filter1d)
+    pad = TAG_SMOOTHING // 2
+    padded = np.pad(densities, (pad, TAG_SMOOTHING - 1 - pad), mode='symmetric')
+    smoothed = np.convolve(padded, np.ones(TAG_SMOOTHING) / TAG_SMOOTHING, mode='valid')
+
+    low = np.flatnonzero(smoothed < TAG_GAP_DENSITY)
+    if not low.size or bottom + low[0] >= end:
+        return False
+    chop_mask[max(0, bottom + low[0] - top):, :] = False
+    return True
+
+
+def fill_holes(mask: np.ndarray) -> np.ndarray:
+    """Fill holes not connected to the border (scipy.ndimage.binary_fill_holes)"""
+    inverse = np.pad(~mask, 1, constant_values=True).astype(np.uint8)
+    cv2.floodFill(inverse, None, (0, 0), 0)
+    return mask | inverse[1:-1, 1:-1].astype(bool)
+
+
+def postprocess(rgb: np.ndarray, foreground: np.ndarray,
+                ocr: Optional[Callable[[np.ndarray], str]] = None) -> Tuple[Optional[np.ndarray], Dict]:
+    """
+    Crop the chop out of an RGB image given a foreground mask.
+
+    Args:
+        rgb: original image, RGB
+        foreground: boolean (or 0/nonzero) mask of everything that isn't backdrop
+        ocr: optional callable returning the text found in the RGB crop
+
+    Returns:
+        (RGB crop on a white background, metadata dict with crop_x1..crop_y2,
+        confidence and the enhanced metrics), or (None, {'confidence': 0.0,
+        'error': ...})
+    """
+    component = largest_component(foreground)
+    if component is None:
+        return None, {'confidence': 0.0, 'error': 'No foreground detected'}
+    chop_mask, (box_x, box_y, box_w, box_h) = component
+
+    # The component's box only changes if the tag cut cleared rows of it
+    height, width = foreground.shape[:2]
+    if cut_bottom_tag(chop_mask, box_y, height, width):
+        box = cv2.boundingRect(chop_mask.view(np.uint8))
+        if box[2] == 0 or box[3] == 0:
+            return None, {'confidence': 0.0, 'error': 'No chop detected'}
+        chop_mask = chop_mask[box[1]:box[1] + box[3], box[0]:box[0] + box[2]]
+        box_x, box_y, box_w, box_h = box_x + box[0], box_y + box[1], box[2], box[3]
+
+    x1, y1 = box_x, box_y
+    x2, y2 = box_x + box_w - 1, box_y + box_h - 1
+
+    margin_x = int((x2 - x1) * CROP_MARGIN)
+    margin_y = int((y2 - y1) * CROP_MARGIN)
+    x1 = max(0, x1 - margin_x)
+    y1 = max(0, y1 - margin_y)
+    x2 = min(width - 1, x2 + margin_x + 1)
+    y2 = min(height - 1, y2 + margin_y + 1)
+
+    cropped_rgb = rgb[y1:y2, x1:x2]
+    cropped_mask = np.zeros((y2 - y1, x2 - x1), bool)
+    inner = chop_mask[:y2 - box_y, :x2 - box_x]
+    cropped_mask[box_y - y1:box_y - y1 + inner.shape[0], box_x - x1:box_x - x1 + inner.shape[1]] = inner
+
+    # Residual blue backdrop on the chop edge
+    red, green, blue = (cropped_rgb[:, :, i].astype(np.int16) for i in range(3))
+    is_blue = (blue > red + BLUE_EDGE_MARGIN_R) & (blue > green + BLUE_EDGE_MARGIN_G)
+    final_mask = fill_holes(cropped_mask & ~is_blue)
+
+    # Erode by 1 pixel (cross, border counts as background) to clean up edges
+    final_mask = cv2.erode(final_mask.astype(np.uint8), _CROSS, borderType=cv2.BORDER_CONSTANT,
+                           borderValue=0).astype(bool)
+
+    final = np.full_like(cropped_rgb, 255)
+    np.copyto(final, cropped_rgb, where=final_mask[:, :, None])
+
+    # Confidence from the share of the image the crop covers
+    crop_width = x2 - x1
+    crop_height = y2 - y1
+    confidence = min(0.99, (crop_width * crop_height) / (width * height))
+
+    aspect_ratio = max(crop_width, crop_height) / max(min(crop_width, crop_height), 1)
+    color_metrics = analyze_color_distribution(cropped_rgb, final_mask)
+
+    # Bright region along the bottom of the crop suggests a tag slipped through
+    bottom_region = final[int(final.shape[0] * 0.8):].mean(axis=2)
+    has_tag_warning = bool(bottom_region.size and
+                           np.count_nonzero(bottom_region > TAG_WARNING_BRIGHTNESS) / bottom_region.size
+                           > TAG_WARNING_FRACTION)
+
+    # Chops never have text: any text means a tag-only image
+    detected_text = ''
+    if ocr is not None:
+        try:
+            detected_text = (ocr(final) or '').strip()
+        except Exception:
+            detected_text = ''
+    has_text = len(detected_text) > 0
+    text_patterns = analyze_text_pattern(detected_text)
+    if has_text and len(detected_text) > 2:
+        has_tag_warning = True
+        confidence *= 0.1
+
+    is_extreme_aspect_ratio = aspect_ratio > MAX_ASPECT_RATIO
+    is_too_small = crop_width < MIN_CROP_SIDE or crop_height < MIN_CROP_SIDE
+    likely_ruler = (
+        is_extreme_aspect_ratio and
+        color_metrics['is_grayscale'] and
+        text_patterns['has_sequential_numbers']
+    )
+    likely_tag = is_too_small or (has_tag_warning and text_patterns['has_alphanumeric_id'])
+    likely_invalid = likely_ruler or likely_tag or (is_extreme_aspect_ratio and not color_metrics['has_meat_tones'])
+
+    if has_tag_warning and not has_text:
+        confidence *= 0.7
+
+    metadata = {
+        'crop_x1': int(x1),
+        'crop_y1': int(y1),
+        'crop_x2': int(x2),
+        'crop_y2': int(y2),
+        'crop_width': int(crop_width),
+        'crop_height': int(crop_height),
+        'crop_area': int(crop_width * crop_height),
+        'aspect_ratio': float(aspect_ratio),
+        'confidence': float(confidence),
+        'has_tag_warning': bool(has_tag_warning),
+        'has_text': bool(has_text),
+        'detected_text': detected_text[:100],
+        'has_meat_tones': bool(color_metrics['has_meat_tones']),
+        'avg_saturation': float(color_metrics['avg_saturation']),
+        'is_grayscale': bool(color_metrics['is_grayscale']),
+        'has_sequential_numbers': bool(text_patterns['has_sequential_numbers']),
+        'has_alphanumeric_id': bool(text_patterns['has_alphanumeric_id']),
+        'likely_ruler': bool(likely_ruler),
+        'likely_tag': bool(likely_tag),
+        'likely_invalid': bool(likely_invalid)
+    }
+    return final, metadata
+
+
+def encode_jpeg(rgb: np.ndarray, quality: int = JPEG_QUALITY) -> bytes:
+    """JPEG bytes for an RGB crop, as uploaded to processed/ (quality 95, optimized)"""
+    ok, encoded = cv2.imencode('.jpg', cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR),
+                               [cv2.IMWRITE_JPEG_QUALITY, quality, cv2.IMWRITE_JPEG_OPTIMIZE, 1])
+    if not ok:
+        raise ValueError('JPEG encoding failed')
+    return encoded.tobytes()
+
+
+def database_update(processed_url: str, metadata: Dict) -> Dict:
+    """sample_images columns written for a processed image (as in the notebook's update_database)"""
+    return {
+        'processed_image_url': processed_url,
+        'crop_x1': metadata['crop_x1'],
+        'crop_y1': metadata['crop_y1'],
+        'crop_x2': metadata['crop_x2'],
+        'crop_y2': metadata['crop_y2'],
+        'crop_width': metadata['crop_width'],
+        'crop_height': metadata['crop_height'],
+        'aspect_ratio': metadata['aspect_ratio'],
+        'crop_confidence': metadata['confidence'],
+        'has_meat_tones': metadata['has_meat_tones'],
+        'avg_saturation': metadata['avg_saturation'],
+        'is_grayscale': metadata['is_grayscale'],
+        'has_sequential_numbers': metadata['has_sequential_numbers'],
+        'likely_ruler': metadata['likely_ruler'],
+        'likely_tag': metadata['likely_tag'],
+        'likely_invalid': metadata['likely_invalid'],
+        'crop_processed': True,
+        'processed_at': 'now()'
+    }
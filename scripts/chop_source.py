@@ -0,0 +1,55 @@
+"""
+Local Image Source
+Reads chop photos straight from disk (photos/ or photos_staged_for_upload/)
+so detection can run offline at disk speed, with no R2 access.
+
+Files are memory-mapped and handed to cv2.imdecode as-is, so the JPEG bytes
+are never copied into a Python bytes object or bytearray first.
+"""
+
+import os
+import re
+from typing import Iterator, Optional, Tuple
+
+import numpy as np
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+# Filename stems are the study image ID: SSSSB##C####D## (e.g. 2304B00C0196D00)
+RECORD_KEY_PATTERN = re.compile(r'^\d{4}B\d{2}C\d{4}D\d{2}$', re.IGNORECASE)
+
+
+def record_key(path: str) -> Optional[str]:
+    """Study image ID for a file path, or None if the name doesn't follow SSSSB##C####D##"""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    if RECORD_KEY_PATTERN.match(stem):
+        return stem.upper()
+    return None
+
+
+def read_image_bytes(path: str) -> np.ndarray:
+    """
+    Encoded image bytes as a read-only uint8 array backed by the file.
+
+    Uses numpy.memmap; empty files (which can't be mapped) fall back to
+    np.fromfile.
+    """
+    if os.path.getsize(path) == 0:
+        return np.fromfile(path, dtype=np.uint8)
+    return np.memmap(path, dtype=np.uint8, mode='r')
+
+
+def iter_images(root: str) -> Iterator[Tuple[Optional[str], str]]:
+    """
+    Walk a directory tree and yield (record_key, path) for every image, sorted
+    by path. Works for both the per-study photos/ folders and the flat
+    photos_staged_for_upload/ layout.
+    """
+    paths = []
+    for dirpath, _, files in os.walk(root):
+        for name in files:
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                paths.append(os.path.join(dirpath, name))
+
+    for path in sorted(paths):
+        yield record_key(path), path
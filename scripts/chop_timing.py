@@ -0,0 +1,78 @@
+"""
+Detection Stage Timing
+Monotonic-clock spans for the stages of chop detection (download, decode,
+pre-filter, HSV, morphology, contours, geometry, refine), reported per image
+and aggregated per batch as p50/p95/p99.
+
+Timing is opt-in: engine functions take timer=None and use NULL_TIMER, whose
+spans do nothing.
+"""
+
+import math
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Dict, Iterable, List
+
+
+class StageTimer:
+    """Accumulates milliseconds per named stage for one image"""
+
+    def __init__(self):
+        self.stages = {}
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def span(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[stage] = self.stages.get(stage, 0.0) + (time.perf_counter() - start) * 1000
+
+    def as_dict(self) -> Dict[str, float]:
+        """Stage times in ms, plus 'total' since the timer was created"""
+        timings = {stage: round(ms, 3) for stage, ms in self.stages.items()}
+        timings['total'] = round((time.perf_counter() - self._start) * 1000, 3)
+        return timings
+
+
+class _NullTimer:
+    """Stand-in when timing is off"""
+
+    _span = nullcontext()
+
+    def span(self, stage: str):
+        return self._span
+
+
+NULL_TIMER = _NullTimer()
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    rank = math.ceil(q / 100 * len(values))
+    return values[max(0, min(len(values), rank) - 1)]
+
+
+def summarize(timings: Iterable[Dict[str, float]]) -> Dict[str, Dict[str, float]]:
+    """
+    Aggregate per-image timing dicts into {stage: {count, mean, p50, p95, p99}}.
+    Stages an image skipped (e.g. 'download' for a local file) are not counted
+    for it.
+    """
+    by_stage = {}
+    for timing in timings:
+        for stage, ms in timing.items():
+            by_stage.setdefault(stage, []).append(ms)
+
+    summary = {}
+    for stage, values in by_stage.items():
+        values.sort()
+        summary[stage] = {
+            'count': len(values),
+            'mean': round(sum(values) / len(values), 3),
+            'p50': round(percentile(values, 50), 3),
+            'p95': round(percentile(values, 95), 3),
+            'p99': round(percentile(values, 99), 3),
+        }
+    return summary
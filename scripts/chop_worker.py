@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""
+Chop Detection Worker
+Long-running local server for the /api/crop-detect handler. cv2, numpy and
+requests are imported once, and OpenCV and the detection cache are warmed at
+startup, so requests skip the cold-start cost. The handler still runs each
+batch on a new thread pool, so per-thread scratch buffers are allocated per
+request. NDJSON ("stream": true) responses are sent line by line as images
+complete instead of being buffered.
+
+Usage:
+    python chop_worker.py --port 8790
+    python chop_worker.py --socket /tmp/chop-worker.sock
+
+    curl -X POST localhost:8790 -d '{"urls": ["https://.../original/2304B00C0196D00.JPG"]}'
+    curl --unix-socket /tmp/chop-worker.sock -X POST http://worker/ -d '{"urls": [...], "stream": true}'
+
+    # Cold-start cost: python -X importtime breakdown of the handler's imports
+    # plus cold vs warm request timing; measured output is in docs/CHOP_WORKER.md
+    python chop_worker.py --profile-startup
+
+GET /health returns uptime and request counts.
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import re
+import socketserver
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+import numpy as np
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+HANDLER_PATH = os.path.join(os.path.dirname(SCRIPTS_DIR), 'api', 'crop-detect.py')
+
+
+def load_handler_module():
+    """Import api/crop-detect.py (not importable by name because of the hyphen)"""
+    spec = importlib.util.spec_from_file_location('crop_detect', HANDLER_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def warm(api) -> float:
+    """
+    Touch what a first request would otherwise pay for: the detection cache
+    and OpenCV's codecs and thread pool. Returns seconds taken.
+    """
+    from chop_engine import detect_reduced, DetectionError
+
+    start = time.perf_counter()
+    api.get_cache()
+
+    # A synthetic chop-on-backdrop JPEG exercises decode, prefilter, HSV,
+    # morphology and contours at both full and reduced resolution
+    image = np.full((480, 640, 3), (200, 120, 40), dtype=np.uint8)
+    cv2.ellipse(image, (320, 240), (180, 120), 0, 0, 360, (90, 80, 200), -1)
+    ok, encoded = cv2.imencode('.jpg', image)
+    for scale in (1, 4):
+        try:
+            detect_reduced(encoded.tobytes(), scale)
+        except DetectionError:
+            pass
+    return time.perf_counter() - start
+
+
+class WorkerState:
+    def __init__(self, api):
+        self.api = api
+        self.started = time.time()
+        self.requests = 0
+        self.images = 0
+        self.lock = threading.Lock()
+
+    def count(self, images: int):
+        with self.lock:
+            self.requests += 1
+            self.images += images
+
+
+def make_request_handler(state: WorkerState):
+    api = state.api
+
+    class RequestHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def address_string(self):
+            # Unix-socket peers have no (host, port) address
+            return self.client_address[0] if isinstance(self.client_address, tuple) else 'unix'
+
+        def do_GET(self):
+            if self.path.rstrip('/') != '/health':
+                self.send_json(404, {'error': 'Not found'})
+                return
+            self.send_json(200, {
+                'status': 'ok',
+                'uptime_seconds': round(time.time() - state.started, 1),
+                'requests': state.requests,
+                'images': state.images,
+            })
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+            try:
+                data = json.loads(body or b'{}')
+            except ValueError:
+                self.send_json(400, {'error': 'Invalid JSON'})
+                return
+
+            # NDJSON is written as results complete; everything else goes
+            # through the Vercel handler unchanged
+            if isinstance(data, dict) and data.get('stream'):
+                try:
+                    options = api.parse_options(data)
+                except ValueError as e:
+                    self.send_json(400, {'error': str(e)})
+                    return
+                urls = data.get('urls', [])
+                state.count(len(urls))
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/x-ndjson')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                for line in api.stream_results(urls, **options):
+                    chunk = line.encode('utf-8')
+                    self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+                    self.wfile.flush()
+                self.wfile.write(b'0\r\n\r\n')
+                return
+
+            response = api.handler({'httpMethod': 'POST', 'body': body}, None)
+            if isinstance(data, dict):
+                state.count(len(data.get('urls', [])))
+            payload = response['body'].encode('utf-8')
+            self.send_response(response['statusCode'])
+            for name, value in response.get('headers', {}).items():
+                self.send_header(name, value)
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def send_json(self, status, obj):
+            payload = json.dumps(obj).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+    return RequestHandler
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(port: int, host: str, socket_path: str):
+    load_start = time.perf_counter()
+    api = load_handler_module()
+    loaded = time.perf_counter() - load_start
+    warmed = warm(api)
+    print(f"🔥 Handler loaded in {loaded * 1000:.0f} ms, warmed in {warmed * 1000:.0f} ms", file=sys.stderr)
+
+    handler_class = make_request_handler(WorkerState(api))
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = ThreadingUnixHTTPServer(socket_path, handler_class)
+        where = socket_path
+    else:
+        server = ThreadingHTTPServer((host, port), handler_class)
+        where = f"http://{host}:{port}"
+
+    print(f"🚀 Chop detection worker listening on {where}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if socket_path and os.path.exists(socket_path):
+            os.remove(socket_path)
+
+
+# -X importtime lines: "import time: <self us> | <cumulative us> | <indented name>"
+_IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)')
+
+
+def profile_startup(top: int = 15, image: str = None):
+    """
+    Print the cold-start breakdown of loading the handler in a fresh
+    interpreter (python -X importtime), then cold vs warm handler() request
+    time with the detection cache off.
+    """
+    code = (
+        "import importlib.util, time; t = time.perf_counter();"
+        f"spec = importlib.util.spec_from_file_location('crop_detect', {HANDLER_PATH!r});"
+        "m = importlib.util.module_from_spec(spec); spec.loader.exec_module(m);"
+        "print('LOADED', time.perf_counter() - t)"
+    )
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                          capture_output=True, text=True, cwd=SCRIPTS_DIR)
+    process_total = time.perf_counter() - start
+    if proc.returncode != 0:
+        print(proc.stderr, file=sys.stderr)
+        sys.exit(1)
+
+    # Packages (no dot in the name) at any depth, as a flat list by cumulative
+    # time: cv2 and numpy are imported from inside chop_cache, so top-level
+    # lines alone would hide them. A nested package's time is also counted in
+    # whatever imported it, so the rows overlap and don't add up.
+    packages = []
+    for line in proc.stderr.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        depth = (len(match.group(3)) - 1) // 2 if match else 0
+        if match and '.' not in match.group(4) and depth <= 2:
+            packages.append((int(match.group(2)), int(match.group(1)), match.group(4)))
+    packages.sort(reverse=True)
+    loaded = float(re.search(r'LOADED ([\d.]+)', proc.stdout).group(1))
+
+    print(f"Environment: Python {sys.version.split()[0]}, OpenCV {cv2.__version__}, "
+          f"NumPy {np.__version__}, {os.cpu_count()} CPU(s), {sys.platform}")
+    print(f"Cold process (interpreter start + handler load): {process_total * 1000:.0f} ms")
+    print(f"Handler module load in that process: {loaded * 1000:.0f} ms")
+    print()
+    print(f"{'package (times overlap)':<32} {'cumulative ms':>14} {'self ms':>9}")
+    for cumulative, own, name in packages[:top]:
+        print(f"{name:<32} {cumulative / 1000:>14.1f} {own / 1000:>9.1f}")
+
+    # Cold vs warm request through the handler, in this process. The image is
+    # served from a local HTTP server so the download is included, and the
+    # detection cache is off so every request runs detection.
+    api = load_handler_module()
+    api.CACHE_PATH = ''
+    if image:
+        with open(image, 'rb') as f:
+            data = f.read()
+    else:
+        frame = np.full((1800, 2400, 3), (200, 120, 40), dtype=np.uint8)
+        cv2.ellipse(frame, (1200, 900), (600, 400), 0, 0, 360, (90, 80, 200), -1)
+        data = cv2.imencode('.jpg', frame)[1].tobytes()
+
+    class ImageHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/jpeg')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), ImageHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    event = {'httpMethod': 'POST', 'body': json.dumps({'urls': [f"http://127.0.0.1:{server.server_port}/image.jpg"]})}
+    timings = []
+    try:
+        for _ in range(4):
+            start = time.perf_counter()
+            response = api.handler(event, None)
+            timings.append((time.perf_counter() - start) * 1000)
+            result = json.loads(response['body'])[0]
+            if result['status'] == 'error':
+                print(f"❌ Request failed: {result['error']}", file=sys.stderr)
+                sys.exit(1)
+    finally:
+        server.shutdown()
+        server.server_close()
+    print()
+    print(f"First request through a fresh handler (local download, full resolution): {timings[0]:.1f} ms")
+    print(f"Warm request (median of next {len(timings) - 1}): {sorted(timings[1:])[len(timings[1:]) // 2]:.1f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve /api/crop-detect from a warm, long-running process')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8790)
+    parser.add_argument('--socket', metavar='PATH', help='Listen on a Unix socket instead of TCP')
+    parser.add_argument('--profile-startup', action='store_true',
+                        help='Print the cold-start import profile and cold vs warm timing, then exit')
+    parser.add_argument('--image', help='JPEG to time in --profile-startup (default: synthetic 2400x1800)')
+    args = parser.parse_args()
+
+    if args.profile_startup:
+        profile_startup(image=args.image)
+        return
+
+    serve(args.port, args.host, args.socket)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+"""
+Thumbnail and Review Derivatives
+Fixed-width web copies of every original, so gallery and review pages load
+kilobytes per image instead of the full camera file:
+
+    thumbnail/{study}.webp   320 px wide   → sample_images.thumbnail_url
+    review/{study}.webp      1280 px wide
+
+Each original is downloaded once and decoded straight to the smallest JPEG
+DCT scale (1/2, 1/4, 1/8) that is still at least as wide as the largest
+missing derivative, then area-resized per size. Work is spread across a
+process pool (same pool as process_chops_cpu.py), and each worker uploads
+its own results.
+
+Each derivative carries its original's ETag as x-amz-meta-source-etag.
+Derivatives already in R2 are skipped when that ETag still matches the
+original's in the local inventory snapshot (see r2_inventory.py); a changed
+original (e.g. after optimize_originals.py) gets its derivatives rebuilt at
+the same keys. Source ETags are remembered in the snapshot as uploads finish,
+so only derivatives written elsewhere need a HEAD request to read them. Rows
+whose derivatives are current only get thumbnail_url filled in.
+
+Usage:
+    # Missing derivatives for every image, all cores
+    python generate_derivatives.py
+
+    # Try a few first
+    python generate_derivatives.py --limit 5
+
+    # JPEG instead of WebP (progressive, optimized)
+    python generate_derivatives.py --format jpeg
+
+    # Regenerate everything, re-listing R2 first
+    python generate_derivatives.py --force --full
+"""
+
+import os
+import sys
+import time
+import argparse
+from typing import Dict, List, Optional
+from urllib.parse import unquote, urlparse
+
+import boto3
+import cv2
+import requests
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+import r2_inventory
+from chop_engine import decode_image, jpeg_size, REDUCED_DECODE_FLAGS
+from chop_fetch import fetch
+from process_chops_cpu import ENV_PATH, run_pool, study_number
+
+# name: (prefix, width in pixels)
+DERIVATIVES = {
+    'thumbnail': ('thumbnail/', 320),
+    'review': ('review/', 1280),
+}
+
+# format: (extension, content type, encoder parameters)
+FORMATS = {
+    'webp': ('.webp', 'image/webp', [cv2.IMWRITE_WEBP_QUALITY, 80]),
+    'jpeg': ('.jpg', 'image/jpeg', [cv2.IMWRITE_JPEG_QUALITY, 85, cv2.IMWRITE_JPEG_OPTIMIZE, 1,
+                                    cv2.IMWRITE_JPEG_PROGRESSIVE, 1]),
+}
+
+# Derivatives are rewritten in place when their original changes, so they
+# can't be cached as immutable
+CACHE_CONTROL = 'public, max-age=86400'
+
+# User metadata on each derivative: ETag of the original it was rendered from
+SOURCE_ETAG = 'source-etag'
+
+# Per-process R2 client (set by _init_worker)
+_r2 = None
+_bucket = None
+
+
+def derivative_key(name: str, study: str, image_format: str) -> str:
+    prefix, _ = DERIVATIVES[name]
+    return f"{prefix}{study}{FORMATS[image_format][0]}"
+
+
+def original_key(image_url: str) -> str:
+    """Object key for a public R2 URL (https://<public host>/original/<file>)"""
+    return unquote(urlparse(image_url).path).lstrip('/')
+
+
+def decode_for_width(data, width: int):
+    """
+    Decode at the smallest DCT scale whose short side is still at least
+    width pixels (so the result is wide enough whatever its orientation);
+    full size for non-JPEG input.
+    """
+    size = jpeg_size(data)
+    scale = 1
+    if size is not None:
+        for candidate in (8, 4, 2):
+            if min(size) // candidate >= width:
+                scale = candidate
+                break
+    return decode_image(data, REDUCED_DECODE_FLAGS[scale])
+
+
+def render(data, names: List[str], image_format: str) -> Dict[str, bytes]:
+    """{name: encoded bytes} for the requested derivatives of one original"""
+    image = decode_for_width(data, max(DERIVATIVES[name][1] for name in names))
+    height, width = image.shape[:2]
+    extension, _, params = FORMATS[image_format]
+
+    rendered = {}
+    for name in names:
+        target = DERIVATIVES[name][1]
+        resized = image
+        if width > target:  # never upscale
+            resized = cv2.resize(image, (target, max(1, round(height * target / width))),
+                                 interpolation=cv2.INTER_AREA)
+        ok, encoded = cv2.imencode(extension, resized, params)
+        if not ok:
+            raise ValueError(f"{image_format} encoding failed")
+        rendered[name] = encoded.tobytes()
+    return rendered
+
+
+def derive_row(image_id, image_url: str, names: List[str], image_format: str) -> Dict:
+    """Download one original, render and upload its missing derivatives (pool task; never raises)"""
+    result = {'id': image_id, 'image_url': image_url, 'uploaded': {}}
+    try:
+        fetched = fetch(image_url, timeout=30)
+        source_etag = fetched.etag.strip('"') if fetched.etag else None
+        result['original_bytes'] = len(fetched.data)
+        study = study_number(image_url)
+        for name, body in render(fetched.data, names, image_format).items():
+            key = derivative_key(name, study, image_format)
+            response = _r2.put_object(
+                Bucket=_bucket,
+                Key=key,
+                Body=body,
+                ContentType=FORMATS[image_format][1],
+                CacheControl=CACHE_CONTROL,
+                Metadata={SOURCE_ETAG: source_etag} if source_etag else {}
+            )
+            result['uploaded'][name] = {'key': key, 'size': len(body), 'etag': response['ETag'],
+                                        'source_etag': source_etag}
+        result['status'] = 'ok'
+    except requests.exceptions.HTTPError as e:
+        status = e.response.status_code if e.response is not None else None
+        result.update(status='missing' if status == 404 else 'failed', error=str(e))
+    except Exception as e:
+        result.update(status='failed', error=str(e))
+    return result
+
+
+def _init_worker(r2_config: Dict):
+    global _r2, _bucket
+    # One OpenCV thread per process; the pool already uses every core
+    cv2.setNumThreads(1)
+    _bucket = r2_config['bucket']
+    _r2 = boto3.client(
+        's3',
+        endpoint_url=f"https://{r2_config['account_id']}.r2.cloudflarestorage.com",
+        aws_access_key_id=r2_config['access_key_id'],
+        aws_secret_access_key=r2_config['secret_access_key'],
+        config=Config(signature_version='s3v4'),
+        region_name='auto'
+    )
+
+
+def fetch_rows(supabase, limit: Optional[int]) -> List[Dict]:
+    """sample_images rows that have an image"""
+    rows = []
+    page_size = 1000
+    offset = 0
+    while limit is None or len(rows) < limit:
+        response = supabase.table('sample_images') \
+            .select('id, image_url, thumbnail_url') \
+            .not_.is_('image_url', 'null') \
+            .order('id') \
+            .range(offset, offset + page_size - 1) \
+            .execute()
+        rows.extend(response.data)
+        if len(response.data) < page_size:
+            break
+        offset += page_size
+    return rows[:limit] if limit else rows
+
+
+def main():
+    from dotenv import load_dotenv
+    from supabase import create_client
+
+    parser = argparse.ArgumentParser(description='Generate thumbnail and review derivatives of R2 originals')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='Worker processes (default: all cores)')
+    parser.add_argument('--limit', type=int, help='Only process the first N images')
+    parser.add_argument('--format', choices=sorted(FORMATS), default='webp', help='Output format (default: webp)')
+    parser.add_argument('--force', action='store_true', help='Regenerate derivatives even if they are current')
+    r2_inventory.add_arguments(parser)
+    args = parser.parse_args()
+    workers = max(1, args.workers)
+
+    load_dotenv(ENV_PATH)
+    supabase_url = os.environ.get('SUPABASE_URL') or os.environ.get('NEXT_PUBLIC_SUPABASE_URL')
+    supabase_key = os.environ.get('SUPABASE_SERVICE_KEY') or os.environ.get('SUPABASE_SERVICE_ROLE_KEY')
+    public_url = os.environ.get('R2_PUBLIC_URL') or os.environ.get('NEXT_PUBLIC_R2_PUBLIC_URL')
+    r2_config = {
+        'account_id': os.environ.get('R2_ACCOUNT_ID'),
+        'access_key_id': os.environ.get('R2_ACCESS_KEY_ID'),
+        'secret_access_key': os.environ.get('R2_SECRET_ACCESS_KEY'),
+        'bucket': os.environ.get('R2_BUCKET_NAME', 'msl-tender-images'),
+    }
+    if not supabase_url or not supabase_key or not r2_config['account_id'] or not public_url:
+        print("ERROR: Missing Supabase, R2 or R2_PUBLIC_URL settings in .env file", file=sys.stderr)
+        sys.exit(1)
+
+    supabase = create_client(supabase_url, supabase_key)
+    _init_worker(r2_config)
+    bucket = r2_config['bucket']
+
+    # {key: ETag} of originals and existing derivatives
+    originals = {}
+    existing = {}
+    if not args.force:
+        mode = r2_inventory.mode_from(args)
+        originals = {obj['key']: obj['etag'] for obj in
+                     r2_inventory.load(_r2, bucket, r2_inventory.ORIGINAL_PREFIX, mode, args.inventory)}
+        for prefix, _ in DERIVATIVES.values():
+            existing.update((obj['key'], obj['etag']) for obj in
+                            r2_inventory.load(_r2, bucket, prefix, mode, args.inventory))
+
+    rows = fetch_rows(supabase, args.limit)
+    tasks = []
+    url_only = []
+    stale = heads = 0
+    inventory = r2_inventory.Inventory(args.inventory)
+    try:
+        sources = {}
+        for prefix, _ in DERIVATIVES.values():
+            sources.update(inventory.sources(bucket, prefix))
+
+        def is_current(key: str, source_etag: Optional[str]) -> bool:
+            nonlocal heads
+            if key not in existing:
+                return False
+            if source_etag is None:
+                # Original not in the snapshot: nothing to compare against
+                return True
+            if key not in sources:
+                # Written by another run (or before source ETags were kept)
+                heads += 1
+                try:
+                    recorded = _r2.head_object(Bucket=bucket, Key=key).get('Metadata', {}).get(SOURCE_ETAG)
+                except ClientError:
+                    recorded = None  # deleted since the snapshot
+                sources[key] = recorded
+                if recorded:
+                    inventory.record_source(bucket, key, existing[key], recorded)
+            return sources[key] == source_etag
+
+        for row in rows:
+            study = study_number(row['image_url'])
+            source_etag = originals.get(original_key(row['image_url']))
+            missing = [name for name in DERIVATIVES
+                       if not is_current(derivative_key(name, study, args.format), source_etag)]
+            stale += sum(1 for name in missing if derivative_key(name, study, args.format) in existing)
+            if missing:
+                tasks.append((row['id'], row['image_url'], missing, args.format))
+            elif row.get('thumbnail_url') != f"{public_url}/{derivative_key('thumbnail', study, args.format)}":
+                url_only.append(row)
+    finally:
+        inventory.close()
+    print(f"{len(rows)} images: {len(tasks)} need derivatives ({stale} existing derivatives out of date), "
+          f"{len(url_only)} only need thumbnail_url, {len(rows) - len(tasks) - len(url_only)} up to date",
+          file=sys.stderr)
+    if heads:
+        print(f"   Read source ETags of {heads} derivatives with HEAD requests", file=sys.stderr)
+
+    counts = {'ok': 0, 'failed': 0, 'missing': 0}
+    errors = []
+    original_bytes = 0
+    derivative_bytes = {name: [] for name in DERIVATIVES}
+    start = time.perf_counter()
+
+    def set_thumbnail_url(result: Dict, study: str):
+        try:
+            supabase.table('sample_images').update({
+                'thumbnail_url': f"{public_url}/{derivative_key('thumbnail', study, args.format)}"
+            }).eq('id', result['id']).execute()
+        except Exception as e:
+            result.update(status='failed', error=f"Database update failed: {e}")
+
+    for row in url_only:
+        result = {'id': row['id'], 'image_url': row['image_url'], 'status': 'ok'}
+        set_thumbnail_url(result, study_number(row['image_url']))
+        if result['status'] == 'failed':
+            counts['failed'] += 1
+            errors.append(result)
+
+    inventory = r2_inventory.Inventory(args.inventory)
+    try:
+        for result in run_pool(iter(tasks), derive_row, workers, (r2_config,), _init_worker):
+            for name, uploaded in result['uploaded'].items():
+                inventory.record_put(bucket, uploaded['key'], uploaded['size'], uploaded['etag'])
+                if uploaded['source_etag']:
+                    inventory.record_source(bucket, uploaded['key'], uploaded['etag'], uploaded['source_etag'])
+                derivative_bytes[name].append(uploaded['size'])
+            if result['status'] == 'ok':
+                original_bytes += result['original_bytes']
+                set_thumbnail_url(result, study_number(result['image_url']))
+            counts[result['status']] += 1
+            if result['status'] == 'failed':
+                errors.append(result)
+
+            done = counts['ok'] + counts['failed'] + counts['missing']
+            if done % 100 == 0:
+                print(f"Progress: {done}/{len(tasks)} — {counts['ok']} succeeded, {counts['failed']} failed, "
+                      f"{counts['missing']} missing originals", file=sys.stderr)
+    finally:
+        inventory.close()
+
+    elapsed = time.perf_counter() - start
+    print("=" * 50, file=sys.stderr)
+    print(f"✓ COMPLETE: {counts['ok']} succeeded, {counts['failed']} failed in {elapsed:.1f}s "
+          f"({len(tasks) / elapsed if elapsed else 0:.1f} images/sec, {workers} workers)", file=sys.stderr)
+    if counts['ok']:
+        print(f"   Originals: {original_bytes / counts['ok'] / 1024:.0f} KB average", file=sys.stderr)
+    for name, sizes in derivative_bytes.items():
+        if sizes:
+            print(f"   {name} ({DERIVATIVES[name][1]} px {args.format}): "
+                  f"{sum(sizes) / len(sizes) / 1024:.1f} KB average, {len(sizes)} uploaded", file=sys.stderr)
+    if counts['missing']:
+        print(f"⚠️  {counts['missing']} images with missing R2 originals (404)", file=sys.stderr)
+    print("=" * 50, file=sys.stderr)
+    for err in errors[:10]:
+        print(f"  ID {err['id']}: {err['error']}", file=sys.stderr)
+    if len(errors) > 10:
+        print(f"  ... and {len(errors) - 10} more", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
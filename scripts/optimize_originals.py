@@ -0,0 +1,396 @@
+#!/usr/bin/env python3
+"""
+Optimize Originals
+Re-encodes the camera JPEGs under original/ into smaller progressive,
+optimized JPEGs that look the same, and reports the bytes saved per study
+(first four characters of the filename, e.g. 2304).
+
+For each original two candidates are tried:
+  - lossless: jpegtran -optimize -progressive (same pixels, metadata kept),
+    if jpegtran is on PATH
+  - re-encoded: the lowest JPEG quality whose SSIM against the original
+    still meets --target-ssim in each of the Y, Cr and Cb channels (11x11
+    Gaussian window; the color metrics downstream depend on chroma), found
+    by binary search over QUALITY_MIN..QUALITY_MAX. The original's chroma
+    subsampling is kept. EXIF orientation is applied to the pixels and
+    other metadata is dropped, so originals with an embedded ICC profile
+    are never re-encoded (lossless only).
+The smaller one is used if it saves at least --min-saving percent.
+
+Nothing is written unless --apply is given. Each original is then first
+copied to camera/{key} (the untouched camera file; copy it back to undo),
+and the optimized file only replaces the original if it still has the ETag
+that was backed up. upload_to_r2.py treats a camera file matching its
+backup as already uploaded, so it won't restore the camera file over it.
+Replaced objects are appended to a journal with their new ETag, and later
+runs skip them, so an image is never re-encoded twice (losses would add up).
+The originals are listed from the local inventory snapshot (see
+r2_inventory.py), which is updated with the new sizes and ETags.
+
+Replaced originals get new ETags, so reconcile_crops.py treats them as
+changed and re-detects them on its next run.
+
+Usage:
+    # Report what would be saved (nothing written)
+    python optimize_originals.py
+
+    # One study first, then write back
+    python optimize_originals.py --study 2304 --apply
+
+    # Lossless recompression only
+    python optimize_originals.py --lossless-only --apply
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import subprocess
+from typing import Dict, List, Optional, Set
+
+import boto3
+import cv2
+import numpy as np
+from botocore.config import Config
+
+import r2_inventory
+from chop_engine import decode_image, jpeg_size
+from process_chops_cpu import ENV_PATH, run_pool
+
+# Journal of replaced originals (one JSON object per line)
+JOURNAL_PATH = 'optimize_originals_journal.jsonl'
+
+# Untouched camera files are kept at BACKUP_PREFIX + original key
+BACKUP_PREFIX = 'camera/'
+
+QUALITY_MIN = 50
+QUALITY_MAX = 95
+DEFAULT_TARGET_SSIM = 0.99
+DEFAULT_MIN_SAVING = 5.0  # percent
+
+SSIM_WINDOW = (11, 11)
+SSIM_SIGMA = 1.5
+SSIM_C1 = (0.01 * 255) ** 2
+SSIM_C2 = (0.03 * 255) ** 2
+
+# Luma (H, V) sampling factors in the SOF header → encoder setting
+SAMPLING_FACTORS = {
+    (1, 1): cv2.IMWRITE_JPEG_SAMPLING_FACTOR_444,
+    (2, 1): cv2.IMWRITE_JPEG_SAMPLING_FACTOR_422,
+    (1, 2): cv2.IMWRITE_JPEG_SAMPLING_FACTOR_440,
+    (2, 2): cv2.IMWRITE_JPEG_SAMPLING_FACTOR_420,
+    (4, 1): cv2.IMWRITE_JPEG_SAMPLING_FACTOR_411,
+}
+_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+# Per-process R2 client (set by _init_worker)
+_r2 = None
+_bucket = None
+
+
+def study_of(key: str) -> str:
+    return key.split('/')[-1][:4]
+
+
+def jpeg_header(data: bytes) -> Dict:
+    """
+    {'sampling': luma (H, V) sampling factors or None, 'icc': embedded ICC
+    profile} from the JPEG markers before the scan data
+    """
+    view = memoryview(data).cast("B")
+    header = {'sampling': None, 'icc': False}
+    i = 2
+    while i + 4 < len(view):
+        if view[i] != 0xFF:
+            break
+        marker = view[i + 1]
+        if marker == 0xFF:  # fill byte
+            i += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:  # standalone markers
+            i += 2
+            continue
+        if marker == 0xDA:  # start of scan
+            break
+        length = (view[i + 2] << 8) | view[i + 3]
+        if marker == 0xE2 and bytes(view[i + 4:i + 16]) == b'ICC_PROFILE\x00':
+            header['icc'] = True
+        elif marker in _SOF_MARKERS and i + 11 < len(view):
+            factors = view[i + 11]  # first component (Y): H in the high nibble, V in the low
+            header['sampling'] = (factors >> 4, factors & 0x0F)
+        i += 2 + length
+    return header
+
+
+class SSIMReference:
+    """Per-channel (Y, Cr, Cb) statistics of the original, computed once and compared against each candidate"""
+
+    def __init__(self, image: np.ndarray):
+        self.channels = []
+        for channel in self._prepare(image):
+            mean = self._blur(channel)
+            self.channels.append((channel, mean, self._blur(channel * channel) - mean * mean))
+
+    @staticmethod
+    def _prepare(image: np.ndarray) -> List[np.ndarray]:
+        return [channel.astype(np.float32) for channel in cv2.split(cv2.cvtColor(image, cv2.COLOR_BGR2YCrCb))]
+
+    @staticmethod
+    def _blur(values: np.ndarray) -> np.ndarray:
+        return cv2.GaussianBlur(values, SSIM_WINDOW, SSIM_SIGMA)
+
+    def score(self, image: np.ndarray) -> float:
+        """Lowest mean SSIM of image against the original over the Y, Cr and Cb channels"""
+        scores = []
+        for (reference, reference_mean, reference_variance), channel in zip(self.channels, self._prepare(image)):
+            mean = self._blur(channel)
+            variance = self._blur(channel * channel) - mean * mean
+            covariance = self._blur(reference * channel) - reference_mean * mean
+            numerator = (2 * reference_mean * mean + SSIM_C1) * (2 * covariance + SSIM_C2)
+            denominator = ((reference_mean * reference_mean + mean * mean + SSIM_C1)
+                           * (reference_variance + variance + SSIM_C2))
+            scores.append(float((numerator / denominator).mean()))
+        return min(scores)
+
+
+def encode_progressive(image: np.ndarray, quality: int,
+                       sampling: int = cv2.IMWRITE_JPEG_SAMPLING_FACTOR_420) -> bytes:
+    ok, encoded = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality, cv2.IMWRITE_JPEG_OPTIMIZE, 1,
+                                               cv2.IMWRITE_JPEG_PROGRESSIVE, 1,
+                                               cv2.IMWRITE_JPEG_SAMPLING_FACTOR, sampling])
+    if not ok:
+        raise ValueError('JPEG encoding failed')
+    return encoded.tobytes()
+
+
+def lossless(data: bytes, jpegtran: str) -> bytes:
+    """jpegtran's optimized progressive rewrite of the same DCT coefficients"""
+    return subprocess.run([jpegtran, '-copy', 'all', '-optimize', '-progressive'],
+                          input=data, capture_output=True, check=True).stdout
+
+
+def reencode(data: bytes, target_ssim: float, sampling: int) -> Optional[Dict]:
+    """Lowest quality meeting target_ssim as {'data', 'quality', 'ssim'}, or None if none does"""
+    image = decode_image(data)
+    reference = SSIMReference(image)
+    best = None
+    low, high = QUALITY_MIN, QUALITY_MAX
+    while low <= high:
+        quality = (low + high) // 2
+        encoded = encode_progressive(image, quality, sampling)
+        ssim = reference.score(decode_image(encoded))
+        if ssim >= target_ssim:
+            best = {'data': encoded, 'quality': quality, 'ssim': ssim}
+            high = quality - 1
+        else:
+            low = quality + 1
+    return best
+
+
+def optimize(data: bytes, target_ssim: float, lossless_only: bool, jpegtran: Optional[str]) -> Optional[Dict]:
+    """Smallest candidate as {'data', 'method', 'quality', 'ssim'}, or None without one"""
+    candidates = []
+    if jpegtran:
+        candidates.append({'data': lossless(data, jpegtran), 'method': 'lossless', 'quality': None, 'ssim': 1.0})
+    header = jpeg_header(data)
+    # Re-encoding would drop the color profile
+    if not lossless_only and not header['icc']:
+        sampling = SAMPLING_FACTORS.get(header['sampling'], cv2.IMWRITE_JPEG_SAMPLING_FACTOR_420)
+        candidate = reencode(data, target_ssim, sampling)
+        if candidate:
+            candidates.append({**candidate, 'method': 'reencode'})
+    return min(candidates, key=lambda candidate: len(candidate['data']), default=None)
+
+
+def optimize_object(key: str, etag: str, options: Dict) -> Dict:
+    """
+    Download one original, optimize it and (with apply) back it up to
+    camera/ and write it back (pool task; never raises)
+    """
+    result = {'key': key, 'etag': etag, 'backup': None, 'uploaded': None}
+    try:
+        # IfMatch: only the version the snapshot describes
+        data = _r2.get_object(Bucket=_bucket, Key=key, IfMatch=etag)['Body'].read()
+        result['bytes_before'] = len(data)
+        if jpeg_size(data) is None:
+            result.update(status='skipped', reason='not a JPEG')
+            return result
+
+        best = optimize(data, options['target_ssim'], options['lossless_only'], options['jpegtran'])
+        if best is None or len(best['data']) > len(data) * (1 - options['min_saving'] / 100):
+            result.update(status='skipped', reason='no worthwhile saving')
+            return result
+
+        result.update(status='ok', bytes_after=len(best['data']), method=best['method'],
+                      quality=best['quality'], ssim=best['ssim'])
+        if options['apply']:
+            # Keep the camera file before replacing the only other copy
+            backup_key = f"{BACKUP_PREFIX}{key}"
+            copied = _r2.copy_object(
+                Bucket=_bucket,
+                CopySource={'Bucket': _bucket, 'Key': key},
+                CopySourceIfMatch=etag,
+                Key=backup_key
+            )
+            result['backup'] = {'key': backup_key, 'etag': copied['CopyObjectResult']['ETag'].strip('"')}
+            # IfMatch again: never replace a version other than the one backed up
+            response = _r2.put_object(
+                Bucket=_bucket,
+                Key=key,
+                Body=best['data'],
+                ContentType='image/jpeg',
+                CacheControl='public, max-age=31536000',
+                IfMatch=etag
+            )
+            result['uploaded'] = response['ETag'].strip('"')
+    except Exception as e:
+        result.update(status='failed', error=str(e))
+    return result
+
+
+def _init_worker(r2_config: Dict):
+    global _r2, _bucket
+    # One OpenCV thread per process; the pool already uses every core
+    cv2.setNumThreads(1)
+    _bucket = r2_config['bucket']
+    _r2 = boto3.client(
+        's3',
+        endpoint_url=f"https://{r2_config['account_id']}.r2.cloudflarestorage.com",
+        aws_access_key_id=r2_config['access_key_id'],
+        aws_secret_access_key=r2_config['secret_access_key'],
+        config=Config(signature_version='s3v4'),
+        region_name='auto'
+    )
+
+
+def load_journal(path: str) -> Set[tuple]:
+    """(key, ETag) of every original this script already wrote"""
+    written = set()
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # torn last line from a crash
+                written.add((entry['key'], entry['etag_after']))
+    return written
+
+
+def main():
+    from dotenv import load_dotenv
+
+    parser = argparse.ArgumentParser(description='Re-encode R2 originals as smaller progressive JPEGs')
+    parser.add_argument('--apply', action='store_true', help='Write optimized images back to R2 (default: report only)')
+    parser.add_argument('--target-ssim', type=float, default=DEFAULT_TARGET_SSIM,
+                        help=f'Minimum SSIM against the original for re-encoding (default: {DEFAULT_TARGET_SSIM})')
+    parser.add_argument('--min-saving', type=float, default=DEFAULT_MIN_SAVING,
+                        help=f'Keep the original unless this percent is saved (default: {DEFAULT_MIN_SAVING})')
+    parser.add_argument('--lossless-only', action='store_true', help='Only use jpegtran (needs jpegtran on PATH)')
+    parser.add_argument('--study', help='Only originals of this study (e.g. 2304)')
+    parser.add_argument('--limit', type=int, help='Only process the first N images')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='Worker processes (default: all cores)')
+    parser.add_argument('--journal', default=JOURNAL_PATH, help=f'Journal of replaced originals (default: {JOURNAL_PATH})')
+    r2_inventory.add_arguments(parser)
+    args = parser.parse_args()
+    workers = max(1, args.workers)
+
+    jpegtran = shutil.which('jpegtran')
+    if args.lossless_only and not jpegtran:
+        print("ERROR: --lossless-only needs jpegtran (libjpeg-turbo) on PATH", file=sys.stderr)
+        sys.exit(1)
+    if not jpegtran:
+        print("⚠️  jpegtran not found: re-encoding only, no lossless recompression", file=sys.stderr)
+
+    load_dotenv(ENV_PATH)
+    r2_config = {
+        'account_id': os.environ.get('R2_ACCOUNT_ID'),
+        'access_key_id': os.environ.get('R2_ACCESS_KEY_ID'),
+        'secret_access_key': os.environ.get('R2_SECRET_ACCESS_KEY'),
+        'bucket': os.environ.get('R2_BUCKET_NAME', 'msl-tender-images'),
+    }
+    if not r2_config['account_id']:
+        print("ERROR: Missing R2 settings in .env file", file=sys.stderr)
+        sys.exit(1)
+    _init_worker(r2_config)
+    bucket = r2_config['bucket']
+
+    written = load_journal(args.journal)
+    objects = [obj for obj in r2_inventory.load(_r2, bucket, 'original/', r2_inventory.mode_from(args), args.inventory)
+               if obj['key'].lower().endswith(('.jpg', '.jpeg'))
+               and (args.study is None or study_of(obj['key']) == args.study)
+               and (obj['key'], obj['etag']) not in written][:args.limit]
+    options = {'target_ssim': args.target_ssim, 'min_saving': args.min_saving,
+               'lossless_only': args.lossless_only, 'jpegtran': jpegtran, 'apply': args.apply}
+    print(f"Optimizing {len(objects)} originals with {workers} workers"
+          f"{'' if args.apply else ' (report only; --apply to write back)'}...", file=sys.stderr)
+
+    counts = {'ok': 0, 'skipped': 0, 'failed': 0}
+    studies = {}
+    errors = []
+    start = time.perf_counter()
+
+    inventory = r2_inventory.Inventory(args.inventory)
+    try:
+        with open(args.journal, 'a', encoding='utf-8') as journal:
+            tasks = ((obj['key'], obj['etag'], options) for obj in objects)
+            for result in run_pool(tasks, optimize_object, workers, (r2_config,), _init_worker):
+                counts[result['status']] += 1
+                if result['status'] == 'failed':
+                    errors.append(result)
+                    continue
+
+                study = studies.setdefault(study_of(result['key']),
+                                           {'images': 0, 'optimized': 0, 'before': 0, 'after': 0})
+                study['images'] += 1
+                study['before'] += result['bytes_before']
+                study['after'] += result.get('bytes_after', result['bytes_before'])
+                if result['status'] == 'ok':
+                    study['optimized'] += 1
+                if result['uploaded']:
+                    journal.write(json.dumps({
+                        'key': result['key'], 'etag_before': result['etag'], 'etag_after': result['uploaded'],
+                        'backup_key': result['backup']['key'],
+                        'bytes_before': result['bytes_before'], 'bytes_after': result['bytes_after'],
+                        'method': result['method'], 'quality': result['quality'], 'ssim': result['ssim']
+                    }) + '\n')
+                    journal.flush()
+                    inventory.record_put(bucket, result['backup']['key'], result['bytes_before'],
+                                         result['backup']['etag'])
+                    inventory.record_put(bucket, result['key'], result['bytes_after'], result['uploaded'])
+
+                done = sum(counts.values())
+                if done % 100 == 0:
+                    print(f"Progress: {done}/{len(objects)} — {counts['ok']} smaller, "
+                          f"{counts['skipped']} kept, {counts['failed']} failed", file=sys.stderr)
+    finally:
+        inventory.close()
+
+    elapsed = time.perf_counter() - start
+    print("=" * 72)
+    print(f"{'Study':<8}{'Images':>8}{'Smaller':>9}{'Before MB':>12}{'After MB':>11}{'Saved MB':>11}{'Saved':>9}")
+    totals = {'images': 0, 'optimized': 0, 'before': 0, 'after': 0}
+    for name, study in sorted(studies.items()):
+        for field in totals:
+            totals[field] += study[field]
+        saved = study['before'] - study['after']
+        print(f"{name:<8}{study['images']:>8}{study['optimized']:>9}{study['before'] / 2**20:>12.1f}"
+              f"{study['after'] / 2**20:>11.1f}{saved / 2**20:>11.1f}{saved / study['before'] if study['before'] else 0:>9.1%}")
+    saved = totals['before'] - totals['after']
+    print(f"{'Total':<8}{totals['images']:>8}{totals['optimized']:>9}{totals['before'] / 2**20:>12.1f}"
+          f"{totals['after'] / 2**20:>11.1f}{saved / 2**20:>11.1f}{saved / totals['before'] if totals['before'] else 0:>9.1%}")
+    print("=" * 72)
+    print(f"✓ {counts['ok']} smaller, {counts['skipped']} kept, {counts['failed']} failed in {elapsed:.1f}s "
+          f"({len(objects) / elapsed if elapsed else 0:.1f} images/sec)"
+          f"{'' if args.apply else ' — report only, nothing written'}", file=sys.stderr)
+    for err in errors[:10]:
+        print(f"  {err['key']}: {err['error']}", file=sys.stderr)
+    if len(errors) > 10:
+        print(f"  ... and {len(errors) - 10} more", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+CPU Chop Processing
+Batch background removal without rembg or a GPU: the same pipeline as
+process_chops_colab.ipynb, with the blue backdrop removed by color key plus
+GrabCut in the detected box (chop_segment.py) and the notebook's
+post-processing (chop_postprocess.py), spread across a process pool.
+
+Output matches the notebook: processed/{study}.jpg on R2 (JPEG quality 95,
+white background) and the same sample_images columns. There is no OCR, so
+the text-based flags stay False.
+
+Usage:
+    # Unprocessed rows (crop_processed null or false), all cores
+    python process_chops_cpu.py
+
+    # Try a few first, then review at /admin/crop-test
+    python process_chops_cpu.py --limit 5
+
+    # Re-run every row that has an image
+    python process_chops_cpu.py --all
+
+    # Local only: write crops and metadata to a folder (no R2, no Supabase)
+    python process_chops_cpu.py --dir photos_staged_for_upload --out-dir processed_local
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import islice
+from typing import Dict, Iterator, List, Optional
+
+import boto3
+import cv2
+import requests
+from botocore.config import Config
+
+from chop_engine import DetectionError
+from chop_fetch import fetch
+from chop_postprocess import database_update, encode_jpeg, postprocess
+from chop_segment import segment_bytes
+from chop_source import iter_images, read_image_bytes, record_key
+
+ENV_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.env')
+
+PROCESSED_PREFIX = 'processed/'
+
+# Per-process R2 client (set by _init_worker when uploading)
+_r2 = None
+_bucket = None
+
+
+def study_number(image_url: str) -> str:
+    """Filename without extension (the filename IS the study number)"""
+    return image_url.split('/')[-1].split('?')[0].rsplit('.', 1)[0]
+
+
+def process_data(data) -> Dict:
+    """
+    Segment and post-process one encoded photo.
+
+    Returns:
+        {'status': 'ok', 'jpeg': bytes, 'metadata': {...}} or
+        {'status': 'failed', 'error': ...}
+    """
+    try:
+        rgb, foreground = segment_bytes(data)
+    except DetectionError as e:
+        return {'status': 'failed', 'error': str(e)}
+
+    processed, metadata = postprocess(rgb, foreground)
+    if processed is None:
+        return {'status': 'failed', 'error': metadata.get('error', 'Unknown error')}
+    return {'status': 'ok', 'jpeg': encode_jpeg(processed), 'metadata': metadata}
+
+
+def process_row(image_id, image_url: str) -> Dict:
+    """Download, process and upload one sample_images row (pool task; never raises)"""
+    result = {'id': image_id, 'image_url': image_url}
+    try:
+        outcome = process_data(fetch(image_url, timeout=30).data)
+        if outcome['status'] == 'ok':
+            key = f"{PROCESSED_PREFIX}{study_number(image_url)}.jpg"
+            _r2.put_object(
+                Bucket=_bucket,
+                Key=key,
+                Body=outcome.pop('jpeg'),
+                ContentType='image/jpeg',
+                CacheControl='public, max-age=31536000, immutable'
+            )
+            outcome['key'] = key
+        result.update(outcome)
+    except requests.exceptions.HTTPError as e:
+        status = e.response.status_code if e.response is not None else None
+        result.update(status='missing' if status == 404 else 'failed', error=str(e))
+    except Exception as e:
+        result.update(status='failed', error=str(e))
+    return result
+
+
+def process_path(path: str, out_dir: str) -> Dict:
+    """Process one local photo into out_dir/{study}.jpg (pool task; never raises)"""
+    name = record_key(path) or os.path.splitext(os.path.basename(path))[0]
+    result = {'path': path, 'key': name}
+    try:
+        outcome = process_data(read_image_bytes(path))
+        if outcome['status'] == 'ok':
+            with open(os.path.join(out_dir, f"{name}.jpg"), 'wb') as f:
+                f.write(outcome.pop('jpeg'))
+        result.update(outcome)
+    except Exception as e:
+        result.update(status='failed', error=str(e))
+    return result
+
+
+def _init_worker(upload: bool, r2_config: Optional[Dict] = None):
+    global _r2, _bucket
+    # One OpenCV thread per process; the pool already uses every core
+    cv2.setNumThreads(1)
+    if upload:
+        _bucket = r2_config['bucket']
+        _r2 = boto3.client(
+            's3',
+            endpoint_url=f"https://{r2_config['account_id']}.r2.cloudflarestorage.com",
+            aws_access_key_id=r2_config['access_key_id'],
+            aws_secret_access_key=r2_config['secret_access_key'],
+            config=Config(signature_version='s3v4'),
+            region_name='auto'
+        )
+
+
+def run_pool(tasks: Iterator[tuple], function, workers: int, initargs: tuple,
+             initializer=_init_worker) -> Iterator[Dict]:
+    """Run function over tasks in a process pool, yielding results as they complete"""
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs) as executor:
+        # Keep a few tasks per worker in flight
+        pending = {executor.submit(function, *task) for task in islice(tasks, workers * 4)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                for task in islice(tasks, 1):
+                    pending.add(executor.submit(function, *task))
+                yield future.result()
+
+
+def fetch_rows(supabase, include_processed: bool, limit: Optional[int]) -> List[Dict]:
+    """sample_images rows to process (unprocessed only unless include_processed)"""
+    rows = []
+    page_size = 1000
+    offset = 0
+    while limit is None or len(rows) < limit:
+        query = supabase.table('sample_images').select('id, image_url').not_.is_('image_url', 'null')
+        if not include_processed:
+            query = query.or_('crop_processed.is.null,crop_processed.eq.false')
+        response = query.order('id').range(offset, offset + page_size - 1).execute()
+        rows.extend(response.data)
+        if len(response.data) < page_size:
+            break
+        offset += page_size
+    return rows[:limit] if limit else rows
+
+
+def run_local(directory: str, out_dir: str, workers: int, limit: Optional[int]):
+    os.makedirs(out_dir, exist_ok=True)
+    paths = [path for _, path in iter_images(directory)][:limit]
+    counts = {'ok': 0, 'failed': 0}
+    start = time.perf_counter()
+
+    with open(os.path.join(out_dir, 'metadata.ndjson'), 'w', encoding='utf-8') as out:
+        for result in run_pool(((path, out_dir) for path in paths), process_path, workers, (False,)):
+            counts[result['status']] += 1
+            out.write(json.dumps(result) + '\n')
+
+    elapsed = time.perf_counter() - start
+    print(f"✅ {counts['ok']} processed, {counts['failed']} failed in {elapsed:.1f}s "
+          f"({len(paths) / elapsed if elapsed else 0:.1f} images/sec, {workers} workers) → {out_dir}",
+          file=sys.stderr)
+
+
+def run_database(workers: int, include_processed: bool, limit: Optional[int]):
+    from dotenv import load_dotenv
+    from supabase import create_client
+
+    load_dotenv(ENV_PATH)
+    supabase_url = os.environ.get('SUPABASE_URL') or os.environ.get('NEXT_PUBLIC_SUPABASE_URL')
+    supabase_key = os.environ.get('SUPABASE_SERVICE_KEY') or os.environ.get('SUPABASE_SERVICE_ROLE_KEY')
+    public_url = os.environ.get('R2_PUBLIC_URL') or os.environ.get('NEXT_PUBLIC_R2_PUBLIC_URL')
+    r2_config = {
+        'account_id': os.environ.get('R2_ACCOUNT_ID'),
+        'access_key_id': os.environ.get('R2_ACCESS_KEY_ID'),
+        'secret_access_key': os.environ.get('R2_SECRET_ACCESS_KEY'),
+        'bucket': os.environ.get('R2_BUCKET_NAME', 'msl-tender-images'),
+    }
+    if not supabase_url or not supabase_key or not r2_config['account_id'] or not public_url:
+        print("ERROR: Missing Supabase, R2 or R2_PUBLIC_URL settings in .env file", file=sys.stderr)
+        sys.exit(1)
+
+    supabase = create_client(supabase_url, supabase_key)
+    rows = fetch_rows(supabase, include_processed, limit)
+    print(f"Processing {len(rows)} images with {workers} workers...", file=sys.stderr)
+
+    counts = {'ok': 0, 'failed': 0, 'missing': 0}
+    tag_warnings = 0
+    errors = []
+    start = time.perf_counter()
+
+    tasks = ((row['id'], row['image_url']) for row in rows)
+    for result in run_pool(tasks, process_row, workers, (True, r2_config)):
+        if result['status'] == 'ok':
+            try:
+                update = database_update(f"{public_url}/{result['key']}", result['metadata'])
+                supabase.table('sample_images').update(update).eq('id', result['id']).execute()
+                tag_warnings += result['metadata']['has_tag_warning']
+            except Exception as e:
+                result.update(status='failed', error=f"Database update failed: {e}")
+        counts[result['status']] += 1
+        if result['status'] == 'failed':
+            errors.append(result)
+
+        done = sum(counts.values())
+        if done % 100 == 0:
+            print(f"Progress: {done}/{len(rows)} — {counts['ok']} succeeded, {counts['failed']} failed, "
+                  f"{counts['missing']} missing originals, {tag_warnings} warnings", file=sys.stderr)
+
+    elapsed = time.perf_counter() - start
+    print("=" * 50, file=sys.stderr)
+    print(f"✓ COMPLETE: {counts['ok']} succeeded, {counts['failed']} failed in {elapsed:.1f}s "
+          f"({len(rows) / elapsed if elapsed else 0:.1f} images/sec)", file=sys.stderr)
+    if counts['missing']:
+        print(f"⚠️  {counts['missing']} images with missing R2 originals (404)", file=sys.stderr)
+    if tag_warnings:
+        print(f"⚠️  {tag_warnings} images flagged with potential tags", file=sys.stderr)
+        print("   → Review images with confidence < 70% at /admin/crop-test", file=sys.stderr)
+    print("=" * 50, file=sys.stderr)
+    for err in errors[:10]:
+        print(f"  ID {err['id']}: {err['error']}", file=sys.stderr)
+    if len(errors) > 10:
+        print(f"  ... and {len(errors) - 10} more", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Remove chop backgrounds on CPU (color key + GrabCut, no rembg)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='Worker processes (default: all cores)')
+    parser.add_argument('--limit', type=int, help='Only process the first N images')
+    parser.add_argument('--all', action='store_true', help='Also re-process rows that already have a crop')
+    parser.add_argument('--dir', help='Process local images from this directory instead of Supabase rows')
+    parser.add_argument('--out-dir', default='processed_local',
+                        help='With --dir: where crops and metadata.ndjson are written (default: processed_local)')
+    args = parser.parse_args()
+
+    workers = max(1, args.workers)
+    if args.dir:
+        run_local(args.dir, args.out_dir, workers, args.limit)
+    else:
+        run_database(workers, args.all, args.limit)
+
+
+if __name__ == '__main__':
+    main()
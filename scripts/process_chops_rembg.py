@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""
+rembg (U²-Net) Chop Processing on CPU
+The rembg path of process_chops_colab.ipynb without rembg.remove(): one ONNX
+Runtime CPU session, created once with explicit intra/inter-op thread counts,
+fed fixed-size 320x320 batches. Each predicted mask is scaled back to the
+full-size photo and goes through the notebook's post-processing
+(chop_postprocess.py), so output matches the notebook: processed/{study}.jpg
+on R2 and the same sample_images columns (no OCR).
+
+Decoding and post-processing run on a small thread pool while the session
+works on the current batch (OpenCV and ONNX Runtime release the GIL).
+
+Needs the U²-Net model rembg downloads (~/.u2net/u2net.onnx, or $U2NET_HOME;
+run `rembg d u2net` once) and onnxruntime.
+
+Usage:
+    # Unprocessed rows, uploaded and recorded like the notebook
+    python process_chops_rembg.py --batch-size 8 --intra-op-threads 8
+
+    # Local folder; prints images/sec and images/sec per core
+    python process_chops_rembg.py --dir photos_staged_for_upload --out-dir processed_local --limit 200
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+import boto3
+import cv2
+import numpy as np
+from botocore.config import Config
+
+from chop_engine import DetectionError, decode_image
+from chop_fetch import fetch
+from chop_postprocess import database_update, encode_jpeg, postprocess
+from chop_source import iter_images, read_image_bytes, record_key
+from process_chops_cpu import ENV_PATH, PROCESSED_PREFIX, fetch_rows, study_number
+
+# U²-Net input: 320x320 RGB scaled to [0, 1] by its max, then ImageNet
+# mean/std (as rembg's u2net session)
+MODEL_SIZE = 320
+MEAN = np.array([0.485, 0.456, 0.406], np.float32)
+STD = np.array([0.229, 0.224, 0.225], np.float32)
+
+# rembg's alpha above this counts as foreground (as in the notebook)
+ALPHA_THRESHOLD = 128
+
+DEFAULT_MODEL = os.path.join(os.environ.get('U2NET_HOME', os.path.expanduser('~/.u2net')), 'u2net.onnx')
+
+
+class U2NetSession:
+    """One ONNX Runtime CPU session for the U²-Net model, reused for every batch"""
+
+    def __init__(self, model_path: str, intra_op_threads: int, inter_op_threads: int = 1):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = intra_op_threads
+        options.inter_op_num_threads = inter_op_threads
+        options.execution_mode = (ort.ExecutionMode.ORT_PARALLEL if inter_op_threads > 1
+                                  else ort.ExecutionMode.ORT_SEQUENTIAL)
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(model_path, options, providers=['CPUExecutionProvider'])
+
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        # Exports with a fixed batch dimension take that many images per run
+        self.fixed_batch = model_input.shape[0] if isinstance(model_input.shape[0], int) else None
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        """(N, 3, 320, 320) float32 inputs → (N, 320, 320) masks in [0, 1]"""
+        step = self.fixed_batch or len(batch)
+        outputs = [self.session.run(None, {self.input_name: batch[i:i + step]})[0][:, 0]
+                   for i in range(0, len(batch), step)]
+        pred = np.concatenate(outputs)
+        # Min-max normalized per image, as rembg does
+        low = pred.min(axis=(1, 2), keepdims=True)
+        high = pred.max(axis=(1, 2), keepdims=True)
+        return (pred - low) / np.maximum(high - low, 1e-8)
+
+
+def model_input(rgb: np.ndarray) -> np.ndarray:
+    """(3, 320, 320) float32 network input for an RGB photo"""
+    small = cv2.resize(rgb, (MODEL_SIZE, MODEL_SIZE), interpolation=cv2.INTER_AREA).astype(np.float32)
+    small /= max(float(small.max()), 1e-6)
+    small -= MEAN
+    small /= STD
+    return small.transpose(2, 0, 1)
+
+
+def full_size_foreground(mask: np.ndarray, width: int, height: int) -> np.ndarray:
+    """Boolean foreground at photo size from a 320x320 mask in [0, 1]"""
+    alpha = cv2.resize((mask * 255).astype(np.uint8), (width, height), interpolation=cv2.INTER_LINEAR)
+    return alpha > ALPHA_THRESHOLD
+
+
+class Pipeline:
+    """Decode → batched U²-Net → post-process → output, timing each stage"""
+
+    def __init__(self, session: U2NetSession, batch_size: int, io_threads: int, output):
+        self.session = session
+        self.batch_size = batch_size
+        self.pool = ThreadPoolExecutor(max_workers=io_threads)
+        self.output = output
+        self.seconds = {'load': 0.0, 'inference': 0.0, 'finish': 0.0}
+
+    def load(self, source: Dict) -> Dict:
+        start = time.perf_counter()
+        try:
+            if 'path' in source:
+                data = read_image_bytes(source['path'])
+            else:
+                data = fetch(source['image_url'], timeout=30).data
+            rgb = cv2.cvtColor(decode_image(data), cv2.COLOR_BGR2RGB)
+            item = {'source': source, 'rgb': rgb, 'input': model_input(rgb)}
+        except DetectionError as e:
+            item = {'source': source, 'error': str(e)}
+        except Exception as e:
+            status = getattr(getattr(e, 'response', None), 'status_code', None)
+            item = {'source': source, 'error': str(e), 'missing': status == 404}
+        item['seconds'] = time.perf_counter() - start
+        return item
+
+    def finish(self, item: Dict, mask: np.ndarray) -> Dict:
+        start = time.perf_counter()
+        result = dict(item['source'])
+        try:
+            rgb = item['rgb']
+            processed, metadata = postprocess(rgb, full_size_foreground(mask, rgb.shape[1], rgb.shape[0]))
+            if processed is None:
+                result.update(status='failed', error=metadata.get('error', 'Unknown error'))
+            else:
+                result.update(self.output(result, encode_jpeg(processed), metadata))
+        except Exception as e:
+            result.update(status='failed', error=str(e))
+        result['seconds'] = time.perf_counter() - start
+        return result
+
+    def run(self, sources: List[Dict]):
+        """Yield one result per source; the next batch decodes while this one runs"""
+        chunks = [sources[i:i + self.batch_size] for i in range(0, len(sources), self.batch_size)]
+        upcoming = [self.pool.submit(self.load, s) for s in chunks[0]] if chunks else []
+        finishing = []
+
+        for index in range(len(chunks)):
+            loads = upcoming
+            if index + 1 < len(chunks):
+                upcoming = [self.pool.submit(self.load, s) for s in chunks[index + 1]]
+            items = [future.result() for future in loads]
+
+            ready = []
+            for item in items:
+                self.seconds['load'] += item.pop('seconds')
+                if 'error' in item:
+                    status = 'missing' if item.get('missing') else 'failed'
+                    yield {**item['source'], 'status': status, 'error': item['error']}
+                else:
+                    ready.append(item)
+            if not ready:
+                continue
+
+            start = time.perf_counter()
+            masks = self.session.predict(np.stack([item.pop('input') for item in ready]))
+            self.seconds['inference'] += time.perf_counter() - start
+
+            # Results of the previous batch, before queueing this one's
+            yield from self._collect(finishing)
+            finishing = [self.pool.submit(self.finish, item, mask) for item, mask in zip(ready, masks)]
+
+        yield from self._collect(finishing)
+        self.pool.shutdown()
+
+    def _collect(self, futures) -> List[Dict]:
+        results = [future.result() for future in futures]
+        for result in results:
+            self.seconds['finish'] += result.pop('seconds')
+        return results
+
+
+def local_output(out_dir: str):
+    os.makedirs(out_dir, exist_ok=True)
+
+    def output(source: Dict, jpeg: bytes, metadata: Dict) -> Dict:
+        name = record_key(source['path']) or os.path.splitext(os.path.basename(source['path']))[0]
+        with open(os.path.join(out_dir, f"{name}.jpg"), 'wb') as f:
+            f.write(jpeg)
+        return {'status': 'ok', 'key': name, 'metadata': metadata}
+
+    return output
+
+
+def r2_output(r2, bucket: str, public_url: str, supabase):
+    def output(source: Dict, jpeg: bytes, metadata: Dict) -> Dict:
+        key = f"{PROCESSED_PREFIX}{study_number(source['image_url'])}.jpg"
+        r2.put_object(
+            Bucket=bucket,
+            Key=key,
+            Body=jpeg,
+            ContentType='image/jpeg',
+            CacheControl='public, max-age=31536000, immutable'
+        )
+        supabase.table('sample_images').update(database_update(f"{public_url}/{key}", metadata)) \
+            .eq('id', source['id']).execute()
+        return {'status': 'ok', 'key': key, 'metadata': metadata}
+
+    return output
+
+
+def main():
+    parser = argparse.ArgumentParser(description='rembg (U²-Net) background removal on CPU with a batched ONNX session')
+    parser.add_argument('--model', default=DEFAULT_MODEL, help=f'U²-Net ONNX model (default: {DEFAULT_MODEL})')
+    parser.add_argument('--batch-size', type=int, default=8, help='Images per session run (default: 8)')
+    parser.add_argument('--intra-op-threads', type=int, default=os.cpu_count() or 1,
+                        help='ONNX Runtime threads within an operator (default: all cores)')
+    parser.add_argument('--inter-op-threads', type=int, default=1,
+                        help='ONNX Runtime threads across operators (default: 1, sequential)')
+    parser.add_argument('--io-threads', type=int, default=2,
+                        help='Threads decoding and post-processing around the session (default: 2)')
+    parser.add_argument('--limit', type=int, help='Only process the first N images')
+    parser.add_argument('--all', action='store_true', help='Also re-process rows that already have a crop')
+    parser.add_argument('--dir', help='Process local images from this directory instead of Supabase rows')
+    parser.add_argument('--out-dir', default='processed_local',
+                        help='With --dir: where crops and metadata.ndjson are written (default: processed_local)')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.model):
+        print(f"ERROR: Model not found at {args.model} (run `rembg d u2net` or pass --model)", file=sys.stderr)
+        sys.exit(1)
+
+    if args.dir:
+        sources = [{'path': path} for _, path in iter_images(args.dir)][:args.limit]
+        output = local_output(args.out_dir)
+    else:
+        from dotenv import load_dotenv
+        from supabase import create_client
+
+        load_dotenv(ENV_PATH)
+        supabase_url = os.environ.get('SUPABASE_URL') or os.environ.get('NEXT_PUBLIC_SUPABASE_URL')
+        supabase_key = os.environ.get('SUPABASE_SERVICE_KEY') or os.environ.get('SUPABASE_SERVICE_ROLE_KEY')
+        public_url = os.environ.get('R2_PUBLIC_URL') or os.environ.get('NEXT_PUBLIC_R2_PUBLIC_URL')
+        if not supabase_url or not supabase_key or not os.environ.get('R2_ACCOUNT_ID') or not public_url:
+            print("ERROR: Missing Supabase, R2 or R2_PUBLIC_URL settings in .env file", file=sys.stderr)
+            sys.exit(1)
+
+        supabase = create_client(supabase_url, supabase_key)
+        r2 = boto3.client(
+            's3',
+            endpoint_url=f"https://{os.environ['R2_ACCOUNT_ID']}.r2.cloudflarestorage.com",
+            aws_access_key_id=os.environ.get('R2_ACCESS_KEY_ID'),
+            aws_secret_access_key=os.environ.get('R2_SECRET_ACCESS_KEY'),
+            config=Config(signature_version='s3v4'),
+            region_name='auto'
+        )
+        sources = fetch_rows(supabase, args.all, args.limit)
+        output = r2_output(r2, os.environ.get('R2_BUCKET_NAME', 'msl-tender-images'), public_url, supabase)
+
+    load_start = time.perf_counter()
+    session = U2NetSession(args.model, max(1, args.intra_op_threads), max(1, args.inter_op_threads))
+    print(f"🧠 Session ready in {time.perf_counter() - load_start:.1f}s "
+          f"(intra-op {args.intra_op_threads}, inter-op {args.inter_op_threads}"
+          f"{f', fixed batch {session.fixed_batch}' if session.fixed_batch else ''})", file=sys.stderr)
+
+    pipeline = Pipeline(session, max(1, args.batch_size), max(1, args.io_threads), output)
+    counts = {'ok': 0, 'failed': 0, 'missing': 0}
+    metadata_file = open(os.path.join(args.out_dir, 'metadata.ndjson'), 'w', encoding='utf-8') if args.dir else None
+
+    start = time.perf_counter()
+    try:
+        for result in pipeline.run(sources):
+            counts[result['status']] += 1
+            if metadata_file is not None:
+                metadata_file.write(json.dumps(result) + '\n')
+            elif result['status'] == 'failed':
+                print(f"  ID {result.get('id')}: {result.get('error')}", file=sys.stderr)
+            done = sum(counts.values())
+            if done % 100 == 0:
+                print(f"Progress: {done}/{len(sources)} — {counts}", file=sys.stderr)
+    finally:
+        if metadata_file is not None:
+            metadata_file.close()
+    elapsed = time.perf_counter() - start
+
+    # Cores doing the work: the session's threads plus the decode/post-process pool
+    cores = min(os.cpu_count() or 1, args.intra_op_threads * args.inter_op_threads + args.io_threads)
+    rate = len(sources) / elapsed if elapsed > 0 else 0.0
+    print(f"✅ {counts['ok']} processed, {counts['failed']} failed, {counts['missing']} missing "
+          f"in {elapsed:.1f}s: {rate:.2f} images/sec, {rate / cores:.2f} images/sec per core ({cores} cores)",
+          file=sys.stderr)
+    per_image = {stage: f"{seconds / max(1, len(sources)) * 1000:.0f} ms" for stage, seconds in pipeline.seconds.items()}
+    print(f"   Per image: {per_image}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
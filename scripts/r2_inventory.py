@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+R2 Inventory Snapshot
+Local SQLite copy of the bucket listing (key, size, ETag, last-modified) per
+prefix, shared by the audit scripts so they don't page through
+list_objects_v2 on every run.
+
+Scripts read the snapshot as is by default. An incremental refresh lists
+only keys after the last one in the snapshot (StartAfter), which picks up
+newly uploaded studies in one short request. It does not see deletions,
+overwrites or new keys that sort before the last one, so use a full
+refresh (re-list the prefix) after anything other than plain uploads. A
+prefix with no snapshot yet always gets a full listing.
+
+Usage:
+    # Refresh (full) and summarize original/
+    python r2_inventory.py --full
+
+    # Summarize from the snapshot, picking up new uploads first
+    python r2_inventory.py --refresh --prefix processed/
+"""
+
+import os
+import sys
+import time
+import sqlite3
+import argparse
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'r2_inventory.sqlite')
+ORIGINAL_PREFIX = 'original/'
+
+# How load() gets the listing
+SNAPSHOT = 'snapshot'
+INCREMENTAL = 'incremental'
+FULL = 'full'
+
+
+class Inventory:
+    """SQLite snapshot of bucket listings"""
+
+    def __init__(self, path: str = DEFAULT_PATH):
+        self.path = path
+        self._db = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS objects ("
+            " bucket TEXT NOT NULL,"
+            " key TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " etag TEXT NOT NULL,"
+            " last_modified TEXT NOT NULL,"
+            " PRIMARY KEY (bucket, key))"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS listings ("
+            " bucket TEXT NOT NULL,"
+            " prefix TEXT NOT NULL,"
+            " refreshed REAL NOT NULL,"
+            " full_refreshed REAL NOT NULL,"
+            " PRIMARY KEY (bucket, prefix))"
+        )
+        # Which source object version (ETag) a derived object was built from,
+        # valid while the derived object itself still has the recorded ETag
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS sources ("
+            " bucket TEXT NOT NULL,"
+            " key TEXT NOT NULL,"
+            " etag TEXT NOT NULL,"
+            " source_etag TEXT NOT NULL,"
+            " PRIMARY KEY (bucket, key))"
+        )
+
+    def refreshed(self, bucket: str, prefix: str) -> Optional[Dict]:
+        """{'refreshed', 'full_refreshed'} timestamps for a prefix, or None if never listed"""
+        row = self._db.execute("SELECT refreshed, full_refreshed FROM listings WHERE bucket = ? AND prefix = ?",
+                               (bucket, prefix)).fetchone()
+        return {'refreshed': row[0], 'full_refreshed': row[1]} if row else None
+
+    def objects(self, bucket: str, prefix: str = ORIGINAL_PREFIX) -> List[Dict]:
+        """Snapshot of every object under prefix, in key order (the listing order)"""
+        rows = self._db.execute(
+            "SELECT key, size, etag, last_modified FROM objects"
+            " WHERE bucket = ? AND substr(key, 1, ?) = ? ORDER BY key",
+            (bucket, len(prefix), prefix),
+        )
+        return [{'key': key, 'size': size, 'etag': etag, 'last_modified': last_modified}
+                for key, size, etag, last_modified in rows]
+
+    def refresh(self, r2, bucket: str, prefix: str = ORIGINAL_PREFIX, full: bool = False) -> Dict:
+        """
+        Update the snapshot of prefix from R2: re-list all of it (full, or no
+        snapshot yet) or only keys after the last one it holds.
+
+        Returns:
+            {'mode', 'listed', 'seconds'}
+        """
+        start = time.perf_counter()
+        full = full or self.refreshed(bucket, prefix) is None
+        params = {'Bucket': bucket, 'Prefix': prefix}
+        if not full:
+            row = self._db.execute("SELECT MAX(key) FROM objects WHERE bucket = ? AND substr(key, 1, ?) = ?",
+                                   (bucket, len(prefix), prefix)).fetchone()
+            if row[0]:
+                params['StartAfter'] = row[0]
+
+        listed = []
+        paginator = r2.get_paginator('list_objects_v2')
+        for page in paginator.paginate(**params):
+            for obj in page.get('Contents', []):
+                listed.append(_row(bucket, obj['Key'], obj['Size'], obj['ETag'], obj['LastModified']))
+
+        now = time.time()
+        self._db.execute("BEGIN")
+        try:
+            if full:
+                self._db.execute("DELETE FROM objects WHERE bucket = ? AND substr(key, 1, ?) = ?",
+                                 (bucket, len(prefix), prefix))
+            self._db.executemany("INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?, ?)", listed)
+            self._db.execute(
+                "INSERT INTO listings VALUES (?, ?, ?, ?) ON CONFLICT (bucket, prefix) DO UPDATE"
+                " SET refreshed = excluded.refreshed,"
+                " full_refreshed = CASE WHEN ? THEN excluded.full_refreshed ELSE listings.full_refreshed END",
+                (bucket, prefix, now, now, full),
+            )
+            self._db.execute("COMMIT")
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        return {'mode': FULL if full else INCREMENTAL, 'listed': len(listed),
+                'seconds': time.perf_counter() - start}
+
+    def record_put(self, bucket: str, key: str, size: int, etag: str, last_modified=None) -> None:
+        """Record an object this process wrote, keeping the snapshot current"""
+        self._db.execute("INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?, ?)",
+                         _row(bucket, key, size, etag, last_modified or datetime.now().astimezone()))
+
+    def record_deletes(self, bucket: str, keys: Iterable[str]) -> None:
+        """Drop objects this process deleted from the snapshot"""
+        self._db.executemany("DELETE FROM objects WHERE bucket = ? AND key = ?", ((bucket, key) for key in keys))
+
+    def record_source(self, bucket: str, key: str, etag: str, source_etag: str) -> None:
+        """Record that object key (at this ETag) was derived from a source at source_etag"""
+        self._db.execute("INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?)",
+                         (bucket, key, etag.strip('"'), source_etag.strip('"')))
+
+    def sources(self, bucket: str, prefix: str) -> Dict[str, str]:
+        """
+        {key: source ETag} for derived objects under prefix whose snapshot
+        ETag still matches the one recorded with record_source
+        """
+        rows = self._db.execute(
+            "SELECT s.key, s.source_etag FROM sources s"
+            " JOIN objects o ON o.bucket = s.bucket AND o.key = s.key AND o.etag = s.etag"
+            " WHERE s.bucket = ? AND substr(s.key, 1, ?) = ?",
+            (bucket, len(prefix), prefix),
+        )
+        return dict(rows.fetchall())
+
+    def close(self) -> None:
+        self._db.close()
+
+
+def _row(bucket: str, key: str, size: int, etag: str, last_modified) -> tuple:
+    if isinstance(last_modified, datetime):
+        last_modified = last_modified.isoformat()
+    return (bucket, key, size, etag.strip('"'), last_modified)
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    """--refresh / --full / --inventory options shared by scripts that read the snapshot"""
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--refresh', action='store_true',
+                       help='Pick up keys added after the snapshot (StartAfter) before reading it')
+    group.add_argument('--full', action='store_true', help='Re-list the bucket into the snapshot before reading it')
+    parser.add_argument('--inventory', default=DEFAULT_PATH, help=f'Snapshot file (default: {DEFAULT_PATH})')
+
+
+def mode_from(args: argparse.Namespace) -> str:
+    return FULL if args.full else INCREMENTAL if args.refresh else SNAPSHOT
+
+
+def load(r2, bucket: str, prefix: str = ORIGINAL_PREFIX, mode: str = SNAPSHOT,
+         path: str = DEFAULT_PATH) -> List[Dict]:
+    """
+    Objects under prefix from the snapshot, refreshed first as asked (a
+    prefix that was never listed is always listed in full). Prints where the
+    listing came from on stderr.
+    """
+    inventory = Inventory(path)
+    try:
+        state = inventory.refreshed(bucket, prefix)
+        if mode != SNAPSHOT or state is None:
+            result = inventory.refresh(r2, bucket, prefix, full=(mode == FULL))
+            print(f"📋 R2 inventory: {result['mode']} listing of {bucket}/{prefix} "
+                  f"({result['listed']} objects, {result['seconds']:.1f}s) → {path}", file=sys.stderr)
+        else:
+            age = (time.time() - state['full_refreshed']) / 3600
+            print(f"📋 R2 inventory: snapshot of {bucket}/{prefix} from {path} "
+                  f"(full listing {age:.1f}h ago; --refresh/--full to update)", file=sys.stderr)
+        return inventory.objects(bucket, prefix)
+    finally:
+        inventory.close()
+
+
+def main():
+    from dotenv import load_dotenv
+    import boto3
+    from botocore.config import Config
+
+    parser = argparse.ArgumentParser(description='Refresh and summarize the local R2 inventory snapshot')
+    parser.add_argument('--prefix', default=ORIGINAL_PREFIX, help=f'Prefix (default: {ORIGINAL_PREFIX})')
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    load_dotenv(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.env'))
+    r2 = boto3.client(
+        's3',
+        endpoint_url=f"https://{os.environ.get('R2_ACCOUNT_ID')}.r2.cloudflarestorage.com",
+        aws_access_key_id=os.environ.get('R2_ACCESS_KEY_ID'),
+        aws_secret_access_key=os.environ.get('R2_SECRET_ACCESS_KEY'),
+        config=Config(signature_version='s3v4'),
+        region_name='auto'
+    )
+    bucket = os.environ.get('R2_BUCKET_NAME', 'msl-tender-images')
+
+    start = time.perf_counter()
+    objects = load(r2, bucket, args.prefix, mode_from(args), args.inventory)
+    extensions = {}
+    for obj in objects:
+        filename = obj['key'][len(args.prefix):]
+        ext = '.' + filename.rsplit('.', 1)[-1] if '.' in filename else 'none'
+        extensions[ext] = extensions.get(ext, 0) + 1
+
+    print(f"{bucket}/{args.prefix}: {len(objects)} objects, "
+          f"{sum(obj['size'] for obj in objects) / (1024 * 1024):.2f} MB "
+          f"({(time.perf_counter() - start) * 1000:.0f} ms)")
+    for ext, count in sorted(extensions.items(), key=lambda x: -x[1]):
+        print(f"  {ext}: {count}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+"""
+Incremental Crop Reconcile
+Compares the R2 listing of original/ (ETag, LastModified) with the fingerprint
+stored on each sample_images row and re-runs chop detection only for new or
+replaced originals. A nightly run costs one paginated listing plus the
+downloads for whatever actually changed.
+
+Requires database/add_source_fingerprint_columns.sql and
+database/add_crop_geometry_columns.sql (outlines are cleared on every update
+made without --geometry).
+
+Usage:
+    # First run after the migration: adopt current ETags for rows that
+    # already have crops, without re-detecting them
+    python reconcile_crops.py --adopt
+
+    # Show what would be queued
+    python reconcile_crops.py --dry-run
+
+    # Nightly: detect changed originals and update their rows
+    python reconcile_crops.py --scale 4 --refine --cache detect-cache.sqlite
+
+    # Also store each chop's outline so crop-image can mask it without
+    # segmenting the original again
+    python reconcile_crops.py --scale 4 --geometry
+"""
+
+import os
+import sys
+import json
+import argparse
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import unquote, urlparse
+
+import boto3
+from botocore.config import Config
+from dotenv import load_dotenv
+from supabase import create_client
+
+from chop_detection import run_batch
+from chop_engine import ALGORITHM_ID
+
+# Load environment variables
+env_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.env')
+load_dotenv(env_path)
+
+SUPABASE_URL = os.environ.get('SUPABASE_URL') or os.environ.get('NEXT_PUBLIC_SUPABASE_URL')
+SUPABASE_SERVICE_KEY = os.environ.get('SUPABASE_SERVICE_KEY') or os.environ.get('SUPABASE_SERVICE_ROLE_KEY')
+R2_ACCOUNT_ID = os.environ.get('R2_ACCOUNT_ID')
+R2_ACCESS_KEY_ID = os.environ.get('R2_ACCESS_KEY_ID')
+R2_SECRET_ACCESS_KEY = os.environ.get('R2_SECRET_ACCESS_KEY')
+R2_BUCKET_NAME = os.environ.get('R2_BUCKET_NAME', 'msl-tender-images')
+
+ORIGINAL_PREFIX = 'original/'
+
+
+def normalize_etag(etag: Optional[str]) -> Optional[str]:
+    return etag.strip('"') if etag else None
+
+
+def r2_key(image_url: str) -> str:
+    """Object key for a public R2 URL (https://<public host>/original/<file>)"""
+    return unquote(urlparse(image_url).path).lstrip('/')
+
+
+def list_originals(r2, bucket: str, prefix: str = ORIGINAL_PREFIX) -> Dict[str, Dict]:
+    """{key: {'etag', 'last_modified', 'size'}} for every object under prefix"""
+    objects = {}
+    paginator = r2.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            if obj['Key'] == prefix:
+                continue
+            objects[obj['Key']] = {
+                'etag': normalize_etag(obj['ETag']),
+                'last_modified': obj['LastModified'].isoformat(),
+                'size': obj['Size'],
+            }
+    return objects
+
+
+def fetch_rows(supabase) -> List[Dict]:
+    """All sample_images rows with their crop state and stored fingerprint"""
+    rows = []
+    page_size = 1000
+    offset = 0
+    while True:
+        response = supabase.table('sample_images') \
+            .select('id, image_url, crop_processed, crop_algorithm, source_etag') \
+            .not_.is_('image_url', 'null') \
+            .range(offset, offset + page_size - 1) \
+            .execute()
+        rows.extend(response.data)
+        if len(response.data) < page_size:
+            break
+        offset += page_size
+    return rows
+
+
+def plan(rows: List[Dict], objects: Dict[str, Dict], algorithm_changes: bool = False,
+         retry_failed: bool = False) -> Tuple[List[Tuple[Dict, Dict, str]], Dict[str, int]]:
+    """
+    Decide which rows need detection.
+
+    A row is queued when its original is new to it (no stored ETag), was
+    replaced (ETag differs), or, optionally, was cropped by another algorithm
+    version (ignoring the /r4+refine options suffix) or previously produced
+    no crop.
+
+    Returns:
+        ([(row, R2 object, reason), ...], counts per reason plus 'unchanged'
+        and 'missing')
+    """
+    queue = []
+    counts = {'new': 0, 'modified': 0, 'algorithm': 0, 'failed': 0, 'unchanged': 0, 'missing': 0}
+
+    for row in rows:
+        obj = objects.get(r2_key(row['image_url']))
+        if obj is None:
+            counts['missing'] += 1
+            continue
+
+        stored = normalize_etag(row.get('source_etag'))
+        if stored is None:
+            reason = 'new'
+        elif stored != obj['etag']:
+            reason = 'modified'
+        elif algorithm_changes and (row.get('crop_algorithm') or '').split('/')[0] != ALGORITHM_ID:
+            reason = 'algorithm'
+        elif retry_failed and not row.get('crop_processed'):
+            reason = 'failed'
+        else:
+            counts['unchanged'] += 1
+            continue
+
+        counts[reason] += 1
+        queue.append((row, obj, reason))
+
+    return queue, counts
+
+
+class _Results:
+    """File-like sink collecting run_batch's NDJSON lines"""
+
+    def __init__(self):
+        self.items = []
+
+    def write(self, text: str):
+        for line in text.splitlines():
+            if line:
+                self.items.append(json.loads(line))
+
+    def flush(self):
+        pass
+
+
+def row_update(result: Dict, obj: Dict) -> Dict:
+    """sample_images columns to write for one detection result"""
+    update = {
+        'crop_algorithm': result.get('algorithm', ALGORITHM_ID),
+        'source_etag': obj['etag'],
+        'source_last_modified': obj['last_modified'],
+        'processed_at': datetime.now(timezone.utc).isoformat(),
+    }
+    if result['status'] == 'ok':
+        update.update({
+            'crop_x1': result['x1'],
+            'crop_y1': result['y1'],
+            'crop_x2': result['x2'],
+            'crop_y2': result['y2'],
+            'crop_confidence': result['confidence'],
+            'crop_processed': True,
+        })
+    else:
+        # The replaced photo must not keep the previous image's box; an
+        # unprocessed row is picked up again by --retry-failed
+        update.update({
+            'crop_x1': None,
+            'crop_y1': None,
+            'crop_x2': None,
+            'crop_y2': None,
+            'crop_confidence': None,
+            'crop_processed': False,
+        })
+    # Always written: an outline left from an earlier --geometry run would no
+    # longer match the new box, and crop-image would mask through it
+    update['crop_polygon'] = result.get('polygon') if result['status'] == 'ok' else None
+    update['crop_rotated_rect'] = result.get('rotated_rect') if result['status'] == 'ok' else None
+    return update
+
+
+def adopt(supabase, rows: List[Dict], objects: Dict[str, Dict]) -> int:
+    """Record current ETags on already-cropped rows that have none, without re-detecting"""
+    adopted = 0
+    for row in rows:
+        obj = objects.get(r2_key(row['image_url']))
+        if obj is None or row.get('source_etag') or not row.get('crop_processed'):
+            continue
+        supabase.table('sample_images').update({
+            'source_etag': obj['etag'],
+            'source_last_modified': obj['last_modified'],
+        }).eq('id', row['id']).execute()
+        adopted += 1
+    return adopted
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Re-detect crops only for new or changed R2 originals')
+    parser.add_argument('--dry-run', action='store_true', help='Report the queue without detecting')
+    parser.add_argument('--queue', metavar='FILE', help='Also write queued image URLs to FILE, one per line')
+    parser.add_argument('--adopt', action='store_true',
+                        help='Record current ETags for already-cropped rows without a fingerprint, then exit')
+    parser.add_argument('--algorithm-changes', action='store_true',
+                        help=f'Also queue rows cropped by an algorithm other than {ALGORITHM_ID}')
+    parser.add_argument('--retry-failed', action='store_true',
+                        help='Also queue unchanged rows whose last detection found no chop')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--scale', type=int, choices=[1, 2, 4, 8], default=1)
+    parser.add_argument('--refine', action='store_true')
+    parser.add_argument('--geometry', action='store_true',
+                        help='Also store the chop outline (crop_polygon) and rotated rect (crop_rotated_rect)')
+    parser.add_argument('--cache', metavar='PATH', help='SQLite detection cache (see chop_cache.py)')
+    args = parser.parse_args()
+
+    if not SUPABASE_URL or not SUPABASE_SERVICE_KEY or not R2_ACCOUNT_ID:
+        print("ERROR: Missing Supabase or R2 credentials in .env file", file=sys.stderr)
+        sys.exit(1)
+
+    supabase = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
+    r2 = boto3.client(
+        's3',
+        endpoint_url=f"https://{R2_ACCOUNT_ID}.r2.cloudflarestorage.com",
+        aws_access_key_id=R2_ACCESS_KEY_ID,
+        aws_secret_access_key=R2_SECRET_ACCESS_KEY,
+        config=Config(signature_version='s3v4'),
+        region_name='auto'
+    )
+
+    print(f"📋 Listing {ORIGINAL_PREFIX} in {R2_BUCKET_NAME}...", file=sys.stderr)
+    objects = list_originals(r2, R2_BUCKET_NAME)
+    rows = fetch_rows(supabase)
+    print(f"   {len(objects)} originals, {len(rows)} sample_images rows", file=sys.stderr)
+
+    if args.adopt:
+        print(f"✅ Adopted current ETags for {adopt(supabase, rows, objects)} rows", file=sys.stderr)
+        return
+
+    queue, counts = plan(rows, objects, args.algorithm_changes, args.retry_failed)
+    print(f"   Queued {len(queue)}: " + ", ".join(f"{reason} {count}" for reason, count in counts.items()),
+          file=sys.stderr)
+
+    if args.queue:
+        with open(args.queue, 'w', encoding='utf-8') as f:
+            for row, _, _ in queue:
+                f.write(row['image_url'] + '\n')
+
+    if args.dry_run or not queue:
+        return
+
+    by_url = {}
+    for row, obj, _ in queue:
+        by_url.setdefault(row['image_url'], []).append((row, obj))
+
+    results = _Results()
+    succeeded, failed, _ = run_batch(list(by_url), max(1, args.workers), args.scale, args.refine,
+                                     args.cache, out=results, geometry=args.geometry)
+
+    updated = 0
+    for result in results.items:
+        # Download failures never reached the detector (no 'cached' key); leave
+        # those rows alone so the next run retries them
+        if 'cached' not in result:
+            print(f"⚠️  {result.get('image_url')}: {result.get('error')}", file=sys.stderr)
+            continue
+        for row, obj in by_url.get(result.get('image_url'), []):
+            try:
+                supabase.table('sample_images').update(row_update(result, obj)).eq('id', row['id']).execute()
+                updated += 1
+            except Exception as e:
+                print(f"❌ Failed to update row {row['id']}: {e}", file=sys.stderr)
+
+    print(f"✅ Detected {succeeded} ok, {failed} without a crop; updated {updated} rows", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -8,16 +8,41 @@ This script:
 4. Updates ALL database URLs to match .jpg (lowercase)
 5. Verifies all extensions are now uniform
 
+R2 renames run as parallel server-side copies, then the old keys are removed
+with bulk deletes (1,000 keys per request). Every finished copy and delete
+batch is appended to a journal, so a run that fails partway is rolled
+forward by running the script again: copies already made (matched by old
+key and ETag) are not repeated and their old keys are deleted. The database URLs are updated in one
+statement by the standardize_image_url_extensions() function
+(database/add_standardize_image_extensions_function.sql), and only once every
+rename has gone through.
+
+The plan is made from the local inventory snapshot (see r2_inventory.py;
+--refresh / --full update it first). Copies and deletes are written back to
+the snapshot as they finish, and the final check re-lists original/ in full.
+
 Run after configuring .env with Supabase and R2 credentials.
+
+Usage:
+    python standardize_all_extensions.py
+    python standardize_all_extensions.py --workers 64 --journal standardize_journal.jsonl
+    python standardize_all_extensions.py --full   # re-list R2 before planning
 """
 
 import os
+import json
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Tuple
+
 import boto3
 from botocore.config import Config
 from supabase import create_client
 from dotenv import load_dotenv
 from tqdm import tqdm
 
+import r2_inventory
+
 # Load environment variables
 env_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), '.env')
 load_dotenv(env_path)
@@ -31,296 +56,339 @@ R2_SECRET_ACCESS_KEY = os.environ.get('R2_SECRET_ACCESS_KEY')
 R2_BUCKET_NAME = os.environ.get('R2_BUCKET_NAME')
 R2_PUBLIC_URL = os.environ.get('R2_PUBLIC_URL') or os.environ.get('NEXT_PUBLIC_R2_PUBLIC_URL')
 
-if not SUPABASE_URL or not SUPABASE_SERVICE_KEY:
-    print("ERROR: Missing Supabase credentials in .env file")
-    exit(1)
-
-# Initialize clients
-print("Initializing clients...")
-supabase = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
-
-r2 = boto3.client(
-    's3',
-    endpoint_url=f"https://{R2_ACCOUNT_ID}.r2.cloudflarestorage.com",
-    aws_access_key_id=R2_ACCESS_KEY_ID,
-    aws_secret_access_key=R2_SECRET_ACCESS_KEY,
-    config=Config(signature_version='s3v4'),
-    region_name='auto'
-)
-
-print("✓ Clients initialized")
-print()
-
 # STANDARD: .jpg (lowercase) - we'll rename everything to this
 STANDARD_EXTENSION = '.jpg'
 
-# Step 1: Analyze R2 extensions
-print("="*80)
-print("STEP 1: Analyzing R2 file extensions...")
-print("="*80)
-
-paginator = r2.get_paginator('list_objects_v2')
-pages = paginator.paginate(Bucket=R2_BUCKET_NAME, Prefix='original/')
-
-r2_files = []
-extension_counts = {}
-
-for page in pages:
-    if 'Contents' in page:
-        for obj in page['Contents']:
-            key = obj['Key']
-            if key.startswith('original/'):
-                filename = key[len('original/'):]
-                if filename:  # Skip if it's just the folder itself
-                    ext = '.' + filename.split('.')[-1] if '.' in filename else 'none'
-                    extension_counts[ext] = extension_counts.get(ext, 0) + 1
-                    r2_files.append(filename)
-
-print(f"✓ Found {len(r2_files)} files in R2 original/")
-print()
-print("Extension breakdown:")
-for ext, count in sorted(extension_counts.items(), key=lambda x: -x[1]):
-    print(f"  {ext}: {count} files")
-print()
-
-# Step 2: Identify files that need renaming in R2
-files_to_rename = []
-for filename in r2_files:
-    current_ext = '.' + filename.split('.')[-1] if '.' in filename else ''
-    if current_ext != STANDARD_EXTENSION:
-        study_number = filename.rsplit('.', 1)[0]
-        new_filename = f"{study_number}{STANDARD_EXTENSION}"
-        files_to_rename.append({
-            'old_key': f"original/{filename}",
-            'new_key': f"original/{new_filename}",
-            'old_filename': filename,
-            'new_filename': new_filename,
-            'study_number': study_number
-        })
-
-print(f"Files that need renaming to {STANDARD_EXTENSION}: {len(files_to_rename)}")
-print()
-
-if len(files_to_rename) > 0:
-    print("First 10 examples:")
-    for item in files_to_rename[:10]:
-        print(f"  {item['old_filename']} → {item['new_filename']}")
-    if len(files_to_rename) > 10:
-        print(f"  ... and {len(files_to_rename) - 10} more")
+# Journal of finished R2 operations (one JSON object per line)
+JOURNAL_PATH = 'standardize_extensions_journal.jsonl'
+
+# delete_objects limit
+DELETE_BATCH_SIZE = 1000
+DEFAULT_WORKERS = 32
+
+
+def file_extension(filename: str) -> str:
+    return '.' + filename.split('.')[-1] if '.' in filename else ''
+
+
+def list_original_extensions(r2, mode: str, inventory_path: str) -> Tuple[List[str], Dict[str, int], Dict[str, Dict]]:
+    """Filenames under original/ (listing order), their extension counts and inventory rows"""
+    r2_files = []
+    extension_counts = {}
+    objects = {}
+    for obj in r2_inventory.load(r2, R2_BUCKET_NAME, 'original/', mode, inventory_path):
+        filename = obj['key'][len('original/'):]
+        if filename:  # Skip if it's just the folder itself
+            ext = file_extension(filename) or 'none'
+            extension_counts[ext] = extension_counts.get(ext, 0) + 1
+            r2_files.append(filename)
+            objects[filename] = obj
+    return r2_files, extension_counts, objects
+
+
+def plan_renames(r2_files: List[str], objects: Dict[str, Dict]) -> List[Dict]:
+    """Every original/ file without the standard extension, with its target key"""
+    files_to_rename = []
+    for filename in r2_files:
+        if file_extension(filename) != STANDARD_EXTENSION:
+            study_number = filename.rsplit('.', 1)[0]
+            new_filename = f"{study_number}{STANDARD_EXTENSION}"
+            files_to_rename.append({
+                'old_key': f"original/{filename}",
+                'new_key': f"original/{new_filename}",
+                'old_filename': filename,
+                'new_filename': new_filename,
+                'study_number': study_number,
+                'etag': objects[filename]['etag'],
+                'size': objects[filename]['size']
+            })
+    return files_to_rename
+
+
+def load_journal(path: str) -> Dict[Tuple[str, str], str]:
+    """
+    {(old_key, ETag): new_key} for every object version a journaled copy
+    stands for: the copied file and the other variants of the same study
+    that were to be dropped in its favour. Those old keys only need deleting.
+    """
+    covered = {}
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # torn last line from a crash
+                if entry['op'] == 'copy':
+                    for old_key, etag in entry['covers'].items():
+                        covered[(old_key, etag)] = entry['new_key']
+    return covered
+
+
+def copy_one(r2, item: Dict) -> Dict:
+    """Server-side copy of one object to its new key (worker task; never raises)"""
+    try:
+        response = r2.copy_object(
+            Bucket=R2_BUCKET_NAME,
+            CopySource={'Bucket': R2_BUCKET_NAME, 'Key': item['old_key']},
+            Key=item['new_key'],
+            CacheControl='public, max-age=31536000, immutable'
+        )
+        return {'item': item, 'copy': response['CopyObjectResult']}
+    except Exception as e:
+        return {'item': item, 'error': str(e)}
+
+
+def delete_batch(r2, keys: List[str]) -> List[Dict]:
+    """Delete up to DELETE_BATCH_SIZE keys in one request; returns per-key errors"""
+    try:
+        response = r2.delete_objects(
+            Bucket=R2_BUCKET_NAME,
+            Delete={'Objects': [{'Key': key} for key in keys], 'Quiet': True}
+        )
+    except Exception as e:
+        return [{'file': key, 'error': str(e)} for key in keys]
+    return [{'file': err['Key'], 'error': err.get('Message', err.get('Code', 'Delete failed'))}
+            for err in response.get('Errors', [])]
+
+
+def rename_objects(r2, files_to_rename: List[Dict], journal_path: str, workers: int,
+                   inventory: r2_inventory.Inventory) -> Tuple[int, List[Dict]]:
+    """
+    Copy every file to its new key in parallel, then delete the old keys in
+    bulk, journaling each step and keeping the inventory snapshot in step.
+
+    Returns:
+        (old keys removed, errors)
+    """
+    covered = load_journal(journal_path)
+
+    def is_covered(item: Dict) -> bool:
+        return covered.get((item['old_key'], item['etag'])) == item['new_key']
+
+    # Several variants of one study (X.JPG, X.jpeg) all map to X.jpg: like the
+    # old one-at-a-time loop, the last one in listing order ends up there.
+    # Variants a journaled copy already stands for are only deleted; a file
+    # uploaded again since (new ETag) is renamed again.
+    groups = {}
+    for item in files_to_rename:
+        groups.setdefault(item['new_key'], []).append(item)
+    to_copy = []
+    for items in groups.values():
+        uncovered = [item for item in items if not is_covered(item)]
+        if uncovered:
+            to_copy.append((uncovered[-1], items))
+    if len(to_copy) < len(groups):
+        print(f"↻ Journal {journal_path}: {len(groups) - len(to_copy)} copies already made, "
+              f"deleting their old keys")
+
+    errors = []
+    removed = 0
+    with open(journal_path, 'a', encoding='utf-8') as journal:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(copy_one, r2, item): items for item, items in to_copy}
+            for future in tqdm(as_completed(futures), total=len(futures), desc="Copying R2 files"):
+                result = future.result()
+                item = result['item']
+                if 'error' in result:
+                    errors.append({'file': item['old_filename'], 'error': result['error']})
+                    continue
+                covers = {other['old_key']: other['etag'] for other in futures[future]}
+                journal.write(json.dumps({'op': 'copy', 'old_key': item['old_key'],
+                                          'new_key': item['new_key'], 'covers': covers}) + '\n')
+                journal.flush()
+                inventory.record_put(R2_BUCKET_NAME, item['new_key'], item['size'],
+                                     result['copy']['ETag'], result['copy']['LastModified'])
+                for old_key, etag in covers.items():
+                    covered[(old_key, etag)] = item['new_key']
+
+        # Old keys go only once a journaled copy stands for them
+        to_delete = [item['old_key'] for item in files_to_rename if is_covered(item)]
+        for start in tqdm(range(0, len(to_delete), DELETE_BATCH_SIZE), desc="Deleting old keys"):
+            batch = to_delete[start:start + DELETE_BATCH_SIZE]
+            batch_errors = delete_batch(r2, batch)
+            failed = {err['file'] for err in batch_errors}
+            deleted = [key for key in batch if key not in failed]
+            journal.write(json.dumps({'op': 'delete', 'keys': deleted}) + '\n')
+            journal.flush()
+            inventory.record_deletes(R2_BUCKET_NAME, deleted)
+            removed += len(batch) - len(failed)
+            errors.extend(batch_errors)
+
+    return removed, errors
+
+
+def update_database_urls(supabase) -> int:
+    """Rewrite every non-standard image_url in one statement; returns rows updated"""
+    response = supabase.rpc('standardize_image_url_extensions', {
+        'public_url': R2_PUBLIC_URL,
+        'standard_extension': STANDARD_EXTENSION
+    }).execute()
+    return int(response.data or 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Standardize R2 and database image extensions to .jpg')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help=f'Parallel R2 copies (default: {DEFAULT_WORKERS})')
+    parser.add_argument('--journal', default=JOURNAL_PATH, help=f'Rename journal (default: {JOURNAL_PATH})')
+    r2_inventory.add_arguments(parser)
+    args = parser.parse_args()
+    workers = max(1, args.workers)
+
+    if not SUPABASE_URL or not SUPABASE_SERVICE_KEY:
+        print("ERROR: Missing Supabase credentials in .env file")
+        exit(1)
+
+    # Initialize clients
+    print("Initializing clients...")
+    supabase = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
+
+    r2 = boto3.client(
+        's3',
+        endpoint_url=f"https://{R2_ACCOUNT_ID}.r2.cloudflarestorage.com",
+        aws_access_key_id=R2_ACCESS_KEY_ID,
+        aws_secret_access_key=R2_SECRET_ACCESS_KEY,
+        config=Config(signature_version='s3v4', max_pool_connections=workers,
+                      retries={'max_attempts': 5, 'mode': 'adaptive'}),
+        region_name='auto'
+    )
+
+    print("✓ Clients initialized")
     print()
 
-# Step 3: Rename files in R2 (copy to new name, delete old)
-if len(files_to_rename) > 0:
+    # Step 1: Analyze R2 extensions
     print("="*80)
-    print("STEP 2: Renaming files in R2...")
+    print("STEP 1: Analyzing R2 file extensions...")
     print("="*80)
-    print(f"⚠️  This will rename {len(files_to_rename)} files in R2")
+
+    r2_files, extension_counts, objects = list_original_extensions(r2, r2_inventory.mode_from(args), args.inventory)
+
+    print(f"✓ Found {len(r2_files)} files in R2 original/")
     print()
-    
-    renamed_count = 0
-    failed_count = 0
-    errors = []
-    
-    for item in tqdm(files_to_rename, desc="Renaming R2 files"):
-        try:
-            # Copy to new key
-            r2.copy_object(
-                Bucket=R2_BUCKET_NAME,
-                CopySource={'Bucket': R2_BUCKET_NAME, 'Key': item['old_key']},
-                Key=item['new_key'],
-                CacheControl='public, max-age=31536000, immutable'
-            )
-            
-            # Delete old key
-            r2.delete_object(
-                Bucket=R2_BUCKET_NAME,
-                Key=item['old_key']
-            )
-            
-            renamed_count += 1
-            
-        except Exception as e:
-            failed_count += 1
-            errors.append({
-                'file': item['old_filename'],
-                'error': str(e)
-            })
-    
+    print("Extension breakdown:")
+    for ext, count in sorted(extension_counts.items(), key=lambda x: -x[1]):
+        print(f"  {ext}: {count} files")
     print()
-    print("R2 RENAME RESULTS:")
-    print(f"✅ Successfully renamed: {renamed_count}")
-    print(f"❌ Failed: {failed_count}")
+
+    # Step 2: Identify files that need renaming in R2
+    files_to_rename = plan_renames(r2_files, objects)
+
+    print(f"Files that need renaming to {STANDARD_EXTENSION}: {len(files_to_rename)}")
     print()
-    
-    if len(errors) > 0:
-        print("Errors encountered:")
-        for err in errors[:10]:
-            print(f"  {err['file']}: {err['error']}")
-        if len(errors) > 10:
-            print(f"  ... and {len(errors) - 10} more")
+
+    if len(files_to_rename) > 0:
+        print("First 10 examples:")
+        for item in files_to_rename[:10]:
+            print(f"  {item['old_filename']} → {item['new_filename']}")
+        if len(files_to_rename) > 10:
+            print(f"  ... and {len(files_to_rename) - 10} more")
         print()
-else:
-    print("✓ All R2 files already use standard extension!")
-    print()
 
-# Step 4: Update ALL database URLs to use standard extension
-print("="*80)
-print("STEP 3: Updating database URLs to standard extension...")
-print("="*80)
+    # Step 3: Rename files in R2 (parallel copy to new name, bulk delete old)
+    errors = []
+    if len(files_to_rename) > 0:
+        print("="*80)
+        print("STEP 2: Renaming files in R2...")
+        print("="*80)
+        print(f"⚠️  This will rename {len(files_to_rename)} files in R2 ({workers} parallel copies)")
+        print()
 
-# Fetch all database records
-db_records = []
-page_size = 1000
-offset = 0
+        inventory = r2_inventory.Inventory(args.inventory)
+        try:
+            renamed_count, errors = rename_objects(r2, files_to_rename, args.journal, workers, inventory)
+        finally:
+            inventory.close()
 
-while True:
-    response = supabase.table('sample_images') \
-        .select('id, image_url') \
-        .not_.is_('image_url', 'null') \
-        .range(offset, offset + page_size - 1) \
-        .execute()
-    
-    if not response.data or len(response.data) == 0:
-        break
-    
-    db_records.extend(response.data)
-    
-    if len(response.data) < page_size:
-        break
-    
-    offset += page_size
-
-print(f"✓ Found {len(db_records)} database records")
-print()
-
-# Find records that need updating
-urls_to_update = []
-for record in db_records:
-    url = record['image_url']
-    filename = url.split('/')[-1]
-    current_ext = '.' + filename.split('.')[-1] if '.' in filename else ''
-    
-    if current_ext != STANDARD_EXTENSION:
-        study_number = filename.rsplit('.', 1)[0]
-        new_filename = f"{study_number}{STANDARD_EXTENSION}"
-        new_url = f"{R2_PUBLIC_URL}/original/{new_filename}"
-        
-        urls_to_update.append({
-            'id': record['id'],
-            'old_url': url,
-            'new_url': new_url
-        })
-
-print(f"Database URLs that need updating: {len(urls_to_update)}")
-print()
-
-if len(urls_to_update) > 0:
-    print("First 10 examples:")
-    for item in urls_to_update[:10]:
-        print(f"  {item['old_url'].split('/')[-1]} → {item['new_url'].split('/')[-1]}")
-    if len(urls_to_update) > 10:
-        print(f"  ... and {len(urls_to_update) - 10} more")
-    print()
-    
-    updated_count = 0
-    failed_count = 0
-    errors = []
-    
-    for item in tqdm(urls_to_update, desc="Updating database URLs"):
+        print()
+        print("R2 RENAME RESULTS:")
+        print(f"✅ Successfully renamed: {renamed_count}")
+        print(f"❌ Failed: {len(errors)}")
+        print()
+
+        if len(errors) > 0:
+            print("Errors encountered:")
+            for err in errors[:10]:
+                print(f"  {err['file']}: {err['error']}")
+            if len(errors) > 10:
+                print(f"  ... and {len(errors) - 10} more")
+            print()
+    else:
+        print("✓ All R2 files already use standard extension!")
+        print()
+
+    # Step 4: Update ALL database URLs to use standard extension
+    print("="*80)
+    print("STEP 3: Updating database URLs to standard extension...")
+    print("="*80)
+
+    if errors:
+        # URLs would point at keys that don't exist yet
+        print(f"⚠️  Skipped: {len(errors)} R2 renames failed. Run the script again to roll the")
+        print(f"   rename forward (journal: {args.journal}); URLs are updated once it completes.")
+        print()
+    else:
         try:
-            supabase.table('sample_images').update({
-                'image_url': item['new_url']
-            }).eq('id', item['id']).execute()
-            
-            updated_count += 1
-            
+            updated_count = update_database_urls(supabase)
+            print(f"✅ Successfully updated: {updated_count}")
         except Exception as e:
-            failed_count += 1
-            errors.append({
-                'id': item['id'],
-                'error': str(e)
-            })
-    
-    print()
-    print("DATABASE UPDATE RESULTS:")
-    print(f"✅ Successfully updated: {updated_count}")
-    print(f"❌ Failed: {failed_count}")
-    print()
-    
-    if len(errors) > 0:
-        print("Errors encountered:")
-        for err in errors[:10]:
-            print(f"  ID {err['id']}: {err['error']}")
-        if len(errors) > 10:
-            print(f"  ... and {len(errors) - 10} more")
+            print(f"❌ Database update failed: {e}")
+            print("   Run database/add_standardize_image_extensions_function.sql in the Supabase SQL Editor first")
         print()
-else:
-    print("✓ All database URLs already use standard extension!")
+
+    # Step 5: Final verification
+    print("="*80)
+    print("VERIFICATION:")
+    print("="*80)
+
+    # Count R2 extensions after rename (re-listed, not taken from the snapshot)
+    print("Counting R2 extensions after standardization...")
+    _, r2_extension_counts, _ = list_original_extensions(r2, r2_inventory.FULL, args.inventory)
+    r2_total = sum(r2_extension_counts.values())
+
+    print(f"R2 extension distribution (total: {r2_total}):")
+    for ext, count in sorted(r2_extension_counts.items()):
+        print(f"  {ext}: {count} files")
+    print()
+
+    # Count database extensions after update
+    verify_response = supabase.table('sample_images') \
+        .select('image_url') \
+        .not_.is_('image_url', 'null') \
+        .limit(10000) \
+        .execute()
+
+    db_extension_counts = {}
+    for record in verify_response.data:
+        url = record['image_url']
+        filename = url.split('/')[-1]
+        ext = file_extension(filename) or 'none'
+        db_extension_counts[ext] = db_extension_counts.get(ext, 0) + 1
+
+    print(f"Database extension distribution (total: {len(verify_response.data)}):")
+    for ext, count in sorted(db_extension_counts.items()):
+        print(f"  {ext}: {count} files")
     print()
 
-# Step 5: Final verification
-print("="*80)
-print("VERIFICATION:")
-print("="*80)
-
-# Count R2 extensions after rename
-print("Counting R2 extensions after standardization...")
-paginator = r2.get_paginator('list_objects_v2')
-pages = paginator.paginate(Bucket=R2_BUCKET_NAME, Prefix='original/')
-
-r2_extension_counts = {}
-r2_total = 0
-
-for page in pages:
-    if 'Contents' in page:
-        for obj in page['Contents']:
-            key = obj['Key']
-            if key.startswith('original/'):
-                filename = key[len('original/'):]
-                if filename:
-                    ext = '.' + filename.split('.')[-1] if '.' in filename else 'none'
-                    r2_extension_counts[ext] = r2_extension_counts.get(ext, 0) + 1
-                    r2_total += 1
-
-print(f"R2 extension distribution (total: {r2_total}):")
-for ext, count in sorted(r2_extension_counts.items()):
-    print(f"  {ext}: {count} files")
-print()
-
-# Count database extensions after update
-verify_response = supabase.table('sample_images') \
-    .select('image_url') \
-    .not_.is_('image_url', 'null') \
-    .limit(10000) \
-    .execute()
-
-db_extension_counts = {}
-for record in verify_response.data:
-    url = record['image_url']
-    filename = url.split('/')[-1]
-    ext = '.' + filename.split('.')[-1] if '.' in filename else 'none'
-    db_extension_counts[ext] = db_extension_counts.get(ext, 0) + 1
-
-print(f"Database extension distribution (total: {len(verify_response.data)}):")
-for ext, count in sorted(db_extension_counts.items()):
-    print(f"  {ext}: {count} files")
-print()
-
-# Check if standardized
-r2_standardized = len(r2_extension_counts) == 1 and STANDARD_EXTENSION in r2_extension_counts
-db_standardized = len(db_extension_counts) == 1 and STANDARD_EXTENSION in db_extension_counts
-
-print("="*80)
-print("FINAL STATUS:")
-print("="*80)
-if r2_standardized and db_standardized:
-    print(f"✅ SUCCESS! All files standardized to {STANDARD_EXTENSION}")
-    print(f"   R2: {r2_total} files, all using {STANDARD_EXTENSION}")
-    print(f"   Database: {len(verify_response.data)} records, all using {STANDARD_EXTENSION}")
-else:
-    print("⚠️  Standardization incomplete:")
-    if not r2_standardized:
-        print(f"   R2 still has multiple extensions: {list(r2_extension_counts.keys())}")
-    if not db_standardized:
-        print(f"   Database still has multiple extensions: {list(db_extension_counts.keys())}")
-print("="*80)
+    # Check if standardized
+    r2_standardized = len(r2_extension_counts) == 1 and STANDARD_EXTENSION in r2_extension_counts
+    db_standardized = len(db_extension_counts) == 1 and STANDARD_EXTENSION in db_extension_counts
+
+    print("="*80)
+    print("FINAL STATUS:")
+    print("="*80)
+    if r2_standardized and db_standardized:
+        print(f"✅ SUCCESS! All files standardized to {STANDARD_EXTENSION}")
+        print(f"   R2: {r2_total} files, all using {STANDARD_EXTENSION}")
+        print(f"   Database: {len(verify_response.data)} records, all using {STANDARD_EXTENSION}")
+    else:
+        print("⚠️  Standardization incomplete:")
+        if not r2_standardized:
+            print(f"   R2 still has multiple extensions: {list(r2_extension_counts.keys())}")
+        if not db_standardized:
+            print(f"   Database still has multiple extensions: {list(db_extension_counts.keys())}")
+    print("="*80)
+
+
+if __name__ == '__main__':
+    main()
@@ -7,16 +7,25 @@ This script:
 3. Updates database URLs to match R2's actual extension
 4. Reports all changes made
 
-Run after configuring .env with Supabase and R2 credentials.
+Run after configuring .env with Supabase and R2 credentials. R2 filenames
+come from the local inventory snapshot (see r2_inventory.py); pass --refresh
+to pick up new uploads or --full to re-list the bucket first.
 """
 
 import os
+import argparse
 import boto3
 from botocore.config import Config
 from supabase import create_client
 from dotenv import load_dotenv
 from tqdm import tqdm
 
+import r2_inventory
+
+parser = argparse.ArgumentParser(description='Update database image URLs to match R2 filenames')
+r2_inventory.add_arguments(parser)
+args = parser.parse_args()
+
 # Load environment variables
 env_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), '.env')
 load_dotenv(env_path)
@@ -56,20 +65,13 @@ print("="*80)
 print("STEP 1: Fetching all files from R2 original/ folder...")
 print("="*80)
 
-paginator = r2.get_paginator('list_objects_v2')
-pages = paginator.paginate(Bucket=R2_BUCKET_NAME, Prefix='original/')
-
 r2_filenames = {}  # Map lowercase filename (no ext) to actual filename with extension
-for page in pages:
-    if 'Contents' in page:
-        for obj in page['Contents']:
-            key = obj['Key']
-            if key.startswith('original/'):
-                filename = key[len('original/'):]
-                if filename:  # Skip if it's just the folder itself
-                    # Store mapping: study_number (lowercase, no ext) -> actual filename
-                    study_number = filename.rsplit('.', 1)[0].lower()
-                    r2_filenames[study_number] = filename
+for obj in r2_inventory.load(r2, R2_BUCKET_NAME, 'original/', r2_inventory.mode_from(args), args.inventory):
+    filename = obj['key'][len('original/'):]
+    if filename:  # Skip if it's just the folder itself
+        # Store mapping: study_number (lowercase, no ext) -> actual filename
+        study_number = filename.rsplit('.', 1)[0].lower()
+        r2_filenames[study_number] = filename
 
 print(f"✓ Found {len(r2_filenames)} files in R2 original/")
 print()
@@ -1,8 +1,33 @@
 """
 Upload pork sample images from local directory to Cloudflare R2
+
+Uploads run on a pool of worker threads sharing one client (large files
+also go up in parallel parts), so a full upload is limited by bandwidth
+rather than per-request latency. Objects already in R2 with the same size
+and ETag are skipped, and every finished file is appended to a local
+manifest (key, size, MD5, ETag, status): an interrupted run (crash or
+Ctrl-C) picks up where it stopped when run again.
+
+Originals replaced by optimize_originals.py no longer match the camera
+file, but their camera/{key} backup does, so a file matching its backup also
+counts as already uploaded (it is not written over the optimized copy).
+
+Usage:
+    python upload_to_r2.py
+    python upload_to_r2.py --workers 32 --dir photos_staged_for_upload
+    python upload_to_r2.py --force          # re-upload even if R2 already matches
 """
 import boto3
+import argparse
+import hashlib
+import json
+import time
 from pathlib import Path
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import islice
+from typing import Dict, Optional, Tuple
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 from botocore.exceptions import ClientError
 import sys
 import os
@@ -20,92 +45,235 @@ R2_PUBLIC_URL = os.getenv("R2_PUBLIC_URL")
 
 # Local images directory
 IMAGES_DIR = Path("photos_staged_for_upload")
+PREFIX = 'original/'
+
+# Camera files of originals replaced by optimize_originals.py, at BACKUP_PREFIX + key
+BACKUP_PREFIX = 'camera/'
+
+# Finished uploads, one JSON object per line (last entry per key wins)
+MANIFEST_PATH = Path("r2_upload_manifest.jsonl")
+
+# Files from MULTIPART_THRESHOLD up go up as PART_SIZE parts, PART_CONCURRENCY
+# at a time. The local ETag check assumes the same part size (S3-style
+# multipart ETag: MD5 of the part MD5s, then "-<part count>").
+MULTIPART_THRESHOLD = 16 * 1024 * 1024
+PART_SIZE = 16 * 1024 * 1024
+PART_CONCURRENCY = 4
+DEFAULT_WORKERS = 16
+
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=MULTIPART_THRESHOLD,
+    multipart_chunksize=PART_SIZE,
+    max_concurrency=PART_CONCURRENCY,
+    use_threads=True
+)
+
+
+def file_digests(path: Path, size: int) -> Tuple[str, str]:
+    """(MD5 hex, ETag R2 reports after upload_file with TRANSFER_CONFIG) of a local file"""
+    whole = hashlib.md5()
+    parts = []
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(PART_SIZE), b''):
+            whole.update(chunk)
+            parts.append(hashlib.md5(chunk).digest())
+    md5 = whole.hexdigest()
+    if size < MULTIPART_THRESHOLD:
+        return md5, md5
+    return md5, f"{hashlib.md5(b''.join(parts)).hexdigest()}-{len(parts)}"
+
+
+def load_manifest(path: Path) -> Dict[str, Dict]:
+    """Latest manifest entry per key (a torn last line from a crash is ignored)"""
+    entries = {}
+    if path.exists():
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                entries[entry['key']] = entry
+    return entries
+
+
+def list_remote(s3, prefix: str = PREFIX) -> Dict[str, Dict]:
+    """{key: {'size', 'etag'}} for every object under prefix"""
+    objects = {}
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=BUCKET_NAME, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            objects[obj['Key']] = {'size': obj['Size'], 'etag': obj['ETag'].strip('"')}
+    return objects
+
+
+def upload_one(s3, path: Path, key: str, size: int, mtime: float,
+               cached: Optional[Dict], remote: Optional[Dict], backup: Optional[Dict], force: bool) -> Dict:
+    """
+    Upload one file unless R2 already holds the same bytes, as the original
+    or as its camera/ backup (worker task; never raises)
+    """
+    entry = {'key': key, 'path': str(path), 'size': size, 'mtime': mtime}
+    try:
+        # Hash only when the manifest has no digest for this exact file
+        if cached and cached.get('size') == size and cached.get('mtime') == mtime and cached.get('etag'):
+            md5, etag = cached['md5'], cached['etag']
+        else:
+            md5, etag = file_digests(path, size)
+        entry.update(md5=md5, etag=etag)
+
+        if not force and any(obj and obj['size'] == size and obj['etag'] == etag for obj in (remote, backup)):
+            entry['status'] = 'exists'
+            return entry
 
-def upload_images_to_r2():
+        content_type = 'image/png' if path.name.lower().endswith('.png') else 'image/jpeg'
+        s3.upload_file(
+            str(path),
+            BUCKET_NAME,
+            key,
+            ExtraArgs={
+                'ContentType': content_type,
+                'CacheControl': 'public, max-age=31536000'  # Cache for 1 year
+            },
+            Config=TRANSFER_CONFIG
+        )
+        entry['status'] = 'uploaded'
+    except ClientError as e:
+        entry.update(status='failed', error=str(e))
+    except Exception as e:
+        entry.update(status='failed', error=f"Unexpected error: {e}")
+    return entry
+
+
+def upload_images_to_r2(images_dir: Path = IMAGES_DIR, workers: int = DEFAULT_WORKERS,
+                        manifest_path: Path = MANIFEST_PATH, force: bool = False, list_bucket: bool = True):
     """Upload all images from local folder to R2"""
-    
+
     # Validate configuration
     if not all([R2_ACCOUNT_ID, R2_ACCESS_KEY_ID, R2_SECRET_ACCESS_KEY, R2_PUBLIC_URL]):
         print("❌ Error: Missing R2 credentials")
         print("   Set R2_ACCOUNT_ID, R2_ACCESS_KEY_ID, R2_SECRET_ACCESS_KEY, R2_PUBLIC_URL")
         print("   Create a .env file (see .env.example) or set environment variables")
         sys.exit(1)
-    
-    if not IMAGES_DIR.exists():
-        print(f"❌ Error: Directory not found: {IMAGES_DIR}")
+
+    if not images_dir.exists():
+        print(f"❌ Error: Directory not found: {images_dir}")
         print(f"   Current directory: {Path.cwd()}")
         sys.exit(1)
-    
-    # Configure S3 client for R2
+
+    # Configure S3 client for R2 (one connection per in-flight part)
     print("🔧 Configuring R2 client...")
     s3 = boto3.client(
         's3',
         endpoint_url=f'https://{R2_ACCOUNT_ID}.r2.cloudflarestorage.com',
         aws_access_key_id=R2_ACCESS_KEY_ID,
         aws_secret_access_key=R2_SECRET_ACCESS_KEY,
+        config=Config(signature_version='s3v4', max_pool_connections=workers * PART_CONCURRENCY,
+                      retries={'max_attempts': 5, 'mode': 'adaptive'}),
         region_name='auto'
     )
-    
+
     # Get list of images (case-insensitive using rglob with a set to deduplicate)
     image_files = []
     seen_files = set()
     for pattern in ['*.JPG', '*.JPEG', '*.jpg', '*.jpeg']:
-        for file in IMAGES_DIR.glob(pattern):
+        for file in images_dir.glob(pattern):
             if file.name.lower() not in seen_files:
                 seen_files.add(file.name.lower())
                 image_files.append(file)
-    
+
     if not image_files:
-        print(f"❌ Error: No image files found in {IMAGES_DIR}")
+        print(f"❌ Error: No image files found in {images_dir}")
         sys.exit(1)
-    
-    print(f"📁 Found {len(image_files)} images to upload")
-    print(f"📍 Uploading to bucket: {BUCKET_NAME}")
+
+    manifest = {} if force else load_manifest(manifest_path)
+    remote = {}
+    backups = {}
+    if list_bucket:
+        print(f"📋 Listing {BUCKET_NAME}/{PREFIX} and {BACKUP_PREFIX}{PREFIX}...")
+        remote = list_remote(s3)
+        backups = list_remote(s3, f'{BACKUP_PREFIX}{PREFIX}')
+
+    # Files the manifest already records as in R2, unchanged locally and (when
+    # listed) still matching the bucket, are skipped without hashing them
+    tasks = []
+    skipped = 0
+    for image_path in image_files:
+        key = f'{PREFIX}{image_path.name}'
+        stat = image_path.stat()
+        cached = manifest.get(key)
+        backup = backups.get(f'{BACKUP_PREFIX}{key}')
+        done = (cached and cached.get('status') in ('uploaded', 'exists') and
+                cached.get('size') == stat.st_size and cached.get('mtime') == stat.st_mtime)
+        if done and (not list_bucket or
+                     any(obj and obj['etag'] == cached.get('etag') for obj in (remote.get(key), backup))):
+            skipped += 1
+            continue
+        tasks.append((image_path, key, stat.st_size, stat.st_mtime, cached, remote.get(key), backup))
+
+    total_bytes = sum(task[2] for task in tasks)
+    print(f"📁 Found {len(image_files)} images ({skipped} already uploaded per {manifest_path})")
+    print(f"📍 Checking/uploading {len(tasks)} files ({total_bytes / 1e6:.0f} MB) to bucket: {BUCKET_NAME} "
+          f"with {workers} workers")
     print(f"🌍 Images will be accessible at: {R2_PUBLIC_URL}/original/[filename]")
     print()
-    
-    # Upload all images
-    uploaded = 0
-    failed = 0
-    
-    for i, image_path in enumerate(image_files, 1):
-        filename = image_path.name
-        
-        # Progress indicator every 50 files
-        if i % 50 == 0 or i == 1:
-            print(f"[{i}/{len(image_files)}] Uploading {filename}...")
-        
+
+    counts = {'uploaded': 0, 'exists': 0, 'failed': 0}
+    sent_bytes = 0
+    start = time.perf_counter()
+    pending_tasks = iter(tasks)
+
+    with open(manifest_path, 'a', encoding='utf-8') as manifest_file, \
+            ThreadPoolExecutor(max_workers=workers) as executor:
+        # Bounded: a couple of files per worker in flight
+        pending = {executor.submit(upload_one, s3, *task, force) for task in islice(pending_tasks, workers * 2)}
         try:
-            # Determine content type
-            content_type = 'image/jpeg'
-            if filename.lower().endswith('.png'):
-                content_type = 'image/png'
-            
-            # Upload to R2
-            s3.upload_file(
-                str(image_path),
-                BUCKET_NAME,
-                f'original/{filename}',
-                ExtraArgs={
-                    'ContentType': content_type,
-                    'CacheControl': 'public, max-age=31536000'  # Cache for 1 year
-                }
-            )
-            uploaded += 1
-            
-        except ClientError as e:
-            print(f"  ✗ Failed to upload {filename}: {e}")
-            failed += 1
-        except Exception as e:
-            print(f"  ✗ Unexpected error with {filename}: {e}")
-            failed += 1
-    
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    for task in islice(pending_tasks, 1):
+                        pending.add(executor.submit(upload_one, s3, *task, force))
+                    entry = future.result()
+                    counts[entry['status']] += 1
+                    if entry['status'] == 'failed':
+                        print(f"  ✗ Failed to upload {Path(entry['path']).name}: {entry['error']}")
+                    else:
+                        # Flushed per file so a crash loses at most the uploads in flight
+                        manifest_file.write(json.dumps(entry) + '\n')
+                        manifest_file.flush()
+                        if entry['status'] == 'uploaded':
+                            sent_bytes += entry['size']
+
+                    finished = sum(counts.values())
+                    # Progress indicator every 50 files
+                    if finished % 50 == 0 or finished == len(tasks):
+                        elapsed = time.perf_counter() - start
+                        print(f"[{finished}/{len(tasks)}] {counts['uploaded']} uploaded, "
+                              f"{counts['exists']} already in R2, {counts['failed']} failed — "
+                              f"{sent_bytes / 1e6 / elapsed if elapsed else 0:.1f} MB/s")
+        except KeyboardInterrupt:
+            # Let uploads already running finish and reach the manifest
+            running = [future for future in pending if not future.cancel()]
+            print(f"\n⚠️  Interrupted: finishing {len(running)} uploads in flight...")
+            for future in running:
+                entry = future.result()
+                counts[entry['status']] += 1
+                if entry['status'] != 'failed':
+                    manifest_file.write(json.dumps(entry) + '\n')
+            manifest_file.flush()
+            print(f"   {len(tasks) - sum(counts.values())} files not started; "
+                  f"run again to resume (manifest: {manifest_path})")
+            raise
+
+    elapsed = time.perf_counter() - start
     print()
     print("=" * 60)
     print(f"✅ Upload complete!")
-    print(f"   Uploaded: {uploaded}/{len(image_files)}")
-    if failed > 0:
-        print(f"   Failed: {failed}")
+    print(f"   Uploaded: {counts['uploaded']}/{len(image_files)} "
+          f"({sent_bytes / 1e6:.0f} MB in {elapsed:.0f}s, {sent_bytes / 1e6 / elapsed if elapsed else 0:.1f} MB/s)")
+    print(f"   Already in R2: {counts['exists'] + skipped}")
+    if counts['failed'] > 0:
+        print(f"   Failed: {counts['failed']} (run again to retry)")
     print()
     print(f"🔗 Images are now accessible at:")
     print(f"   {R2_PUBLIC_URL}/original/[filename]")
@@ -113,9 +281,21 @@ def upload_images_to_r2():
     print("📝 Next step: Update database URLs to point to R2")
     print("=" * 60)
 
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Upload staged images to R2 (parallel, resumable)')
+    parser.add_argument('--dir', type=Path, default=IMAGES_DIR, help=f'Images directory (default: {IMAGES_DIR})')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help=f'Files uploaded at once (default: {DEFAULT_WORKERS})')
+    parser.add_argument('--manifest', type=Path, default=MANIFEST_PATH,
+                        help=f'Resume manifest (default: {MANIFEST_PATH})')
+    parser.add_argument('--force', action='store_true', help='Upload every file, ignoring manifest and bucket')
+    parser.add_argument('--no-list', action='store_true',
+                        help='Trust the manifest instead of listing the bucket first')
+    args = parser.parse_args()
+
     try:
-        upload_images_to_r2()
+        upload_images_to_r2(args.dir, max(1, args.workers), args.manifest, args.force, not args.no_list)
     except KeyboardInterrupt:
         print("\n\n⚠️  Upload interrupted by user")
         sys.exit(1)